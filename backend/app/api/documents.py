@@ -1,9 +1,15 @@
-from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.database import get_db
 from app.models.models import Document
 from app.services.document_processor import process_document
+from app.services.retrieval import VECTOR_BACKEND
+from app.services.scheduler import scheduler, request_user_key, PRIORITY_INGESTION
+from app.services.vector_index import vector_store
+from app.services.usage_service import begin_metered_request
+from app.utils.llm_usage import set_usage_context
+from app.utils.document_parsing import load_cached_tables
 from typing import List
 import os
 from pathlib import Path
@@ -14,6 +20,7 @@ UPLOAD_DIR = Path("uploads")
 
 @router.post("/upload")
 async def upload_document(
+    http_request: Request,
     file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db)
 ):
@@ -28,33 +35,56 @@ async def upload_document(
     # Create unique filename
     file_path = UPLOAD_DIR / file.filename
     
-    try:
-        # Save file
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+    user_key = request_user_key(http_request)
+    await begin_metered_request("ingestion", user_id=user_key)
+    
+    # Ingestion yields to interactive QA and metrics extraction under load
+    async with scheduler.admit(PRIORITY_INGESTION, user_key):
+        try:
+            # Save file
+            with open(file_path, "wb") as buffer:
+                content = await file.read()
+                buffer.write(content)
         
-        # Create document record
-        document = Document(
-            file_name=file.filename,
-            file_type=file_ext,
-            user_id="temp_user_id"  # Replace with actual user ID from auth
-        )
+            # Create document record
+            document = Document(
+                file_name=file.filename,
+                file_type=file_ext,
+                user_id="temp_user_id"  # Replace with actual user ID from auth
+            )
         
-        db.add(document)
-        await db.commit()
-        await db.refresh(document)
+            db.add(document)
+            await db.commit()
+            await db.refresh(document)
+            set_usage_context(user_id=user_key, document_id=document.id, route="ingestion")
         
-        # Process document asynchronously
-        await process_document(document.id, file_path)
+            # Process document asynchronously
+            await process_document(document.id, file_path)
         
-        return {"message": "Document uploaded successfully", "document_id": document.id}
+            return {"message": "Document uploaded successfully", "document_id": document.id}
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/list")
 async def list_documents(db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(Document))
     documents = result.scalars().all()
-    return documents 
\ No newline at end of file
+    return documents 
+
+@router.get("/vector-index/stats")
+async def vector_index_stats():
+    """Report memory held by the exact-search vector cache, per document."""
+    return {"backend": VECTOR_BACKEND, **vector_store.memory_stats()}
+
+@router.get("/{document_id}/tables")
+async def get_document_tables(document_id: str, db: AsyncSession = Depends(get_db)):
+    """Structured tables detected in the document's current version."""
+    document = await db.get(Document, document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    tables = load_cached_tables(document.content_hash) if document.content_hash else None
+    if tables is None:
+        raise HTTPException(status_code=404, detail="Document has not been processed")
+    return {"document_id": document_id, "document_version": document.content_hash, "tables": tables}
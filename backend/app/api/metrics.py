@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models.models import ESGMetric
-from app.services.metrics_service import extract_metrics_from_document
-from typing import List
+from app.services.metrics_service import extract_and_store_metrics
+from app.services.scheduler import scheduler, request_user_key, PRIORITY_EXTRACTION
+from app.services.export_service import EXPORT_MEDIA_TYPES, export_filename, export_rows
+from app.services.write_behind import write_queue
+from app.services.usage_service import begin_metered_request
+from app.services.rollup_service import (
+    ROLLUP_DIMENSIONS, ROLLUP_PERIODS, apply_rollup_deltas, query_metric_rollup, rebuild_metric_rollups, rollup_key
+)
+from typing import List, Optional
+from datetime import datetime
 from pydantic import BaseModel
 from sqlalchemy import select
 
@@ -16,28 +25,88 @@ class ESGMetricCreate(BaseModel):
     rag_status: str
 
 @router.post("/extract/{document_id}")
-async def extract_metrics(
-    document_id: str,
+async def extract_metrics(document_id: str, http_request: Request):
+    """Extract ESG metrics from the document's KPI index, using the LLM for gaps."""
+    await begin_metered_request("metrics_extraction", user_id=request_user_key(http_request), document_id=document_id)
+    async with scheduler.admit(PRIORITY_EXTRACTION, request_user_key(http_request)):
+        try:
+            # Concurrent requests for the same document share one extraction and one insert
+            metrics = await extract_and_store_metrics(document_id)
+            return {"message": "Metrics extracted successfully", "metrics": metrics}
+    
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/rollup")
+async def get_metrics_rollup(
+    group_by: List[str] = Query(["category", "rag_status"]),
+    period: str = "month",
+    document_id: Optional[str] = None,
+    category: Optional[str] = None,
+    start_period: Optional[str] = None,
+    end_period: Optional[str] = None,
     db: AsyncSession = Depends(get_db)
 ):
-    """Extract ESG metrics from document using LLM."""
+    """
+    Get ESG metric counts across all documents from the materialized rollup,
+    grouped by any of category, rag_status, document_id and period.
+    """
+    invalid = [dimension for dimension in group_by if dimension not in ROLLUP_DIMENSIONS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by: {', '.join(invalid)}")
+    if period not in ROLLUP_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Invalid period: {period}")
+    
     try:
-        metrics = await extract_metrics_from_document(document_id)
-        
-        # Store metrics in database
-        for metric in metrics:
-            db_metric = ESGMetric(
-                document_id=document_id,
-                category=metric["category"],
-                goal=metric["goal"],
-                actual=metric["actual"],
-                rag_status=metric["rag_status"],
-                extracted_by="LLM"
-            )
-            db.add(db_metric)
-        
-        await db.commit()
-        return {"message": "Metrics extracted successfully", "metrics": metrics}
+        return await query_metric_rollup(
+            db,
+            group_by=group_by,
+            period=period,
+            document_id=document_id,
+            category=category,
+            start_period=start_period,
+            end_period=end_period
+        )
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/export")
+async def export_metrics(
+    export_format: str = Query("csv", alias="format"),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    category: Optional[str] = None,
+    document_id: Optional[str] = None
+):
+    """
+    Stream every ESG metric matching the filters as CSV, JSONL or Parquet.
+    Rows are read from a streaming cursor and sent as a chunked response.
+    """
+    try:
+        chunks = export_rows(
+            "metrics",
+            export_format,
+            start_date=start_date,
+            end_date=end_date,
+            category=category,
+            document_id=document_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename("metrics", export_format)}"'}
+    )
+
+@router.post("/rollup/rebuild")
+async def rebuild_rollup(db: AsyncSession = Depends(get_db)):
+    """Recompute the metrics rollup from all stored metrics."""
+    try:
+        await rebuild_metric_rollups(db)
+        return {"message": "Metrics rollup rebuilt successfully"}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -49,12 +118,16 @@ async def get_metrics(
 ):
     """Get ESG metrics for a document."""
     try:
+        # Include extracted metrics still queued for insert
+        pending = write_queue.pending_rows(ESGMetric, document_id=document_id)
+        
         result = await db.execute(
             select(ESGMetric)
             .where(ESGMetric.document_id == document_id)
         )
         metrics = result.scalars().all()
-        return metrics
+        stored_ids = {metric.id for metric in metrics}
+        return list(metrics) + [metric for metric in pending if metric.id not in stored_ids]
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -76,6 +149,9 @@ async def create_metric(
             extracted_by="Manual"
         )
         db.add(db_metric)
+        await apply_rollup_deltas(db, [
+            (rollup_key(metric.category, metric.rag_status, document_id), 1)
+        ])
         await db.commit()
         await db.refresh(db_metric)
         return db_metric
@@ -91,10 +167,17 @@ async def update_metric(
 ):
     """Update an ESG metric."""
     try:
+        await write_queue.ensure_flushed(ESGMetric, metric_id)
         db_metric = await db.get(ESGMetric, metric_id)
         if not db_metric:
             raise HTTPException(status_code=404, detail="Metric not found")
         
+        # Move the metric from its old rollup bucket to the new one
+        await apply_rollup_deltas(db, [
+            (rollup_key(db_metric.category, db_metric.rag_status, db_metric.document_id, db_metric.created_at), -1),
+            (rollup_key(metric.category, metric.rag_status, db_metric.document_id, db_metric.created_at), 1)
+        ])
+        
         db_metric.category = metric.category
         db_metric.goal = metric.goal
         db_metric.actual = metric.actual
@@ -1,9 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.models.models import QAInteraction
 from app.services.qa_service import get_answer_from_llm
+from app.services.citation_service import to_citation_refs, hydrate_citations
+from app.services.scheduler import scheduler, request_user_key, PRIORITY_INTERACTIVE
+from app.services.export_service import EXPORT_MEDIA_TYPES, export_filename, export_rows
+from app.services.write_behind import write_queue
+from app.services.conversation_service import load_conversation, record_turn, rewrite_follow_up, start_session
+from app.services.usage_service import begin_metered_request
 from typing import Optional
+from datetime import datetime
 from pydantic import BaseModel
 from sqlalchemy import select
 
@@ -12,6 +20,7 @@ router = APIRouter()
 class QuestionRequest(BaseModel):
     document_id: str
     question: str
+    session_id: Optional[str] = None  # Omit to start a new conversation
 
 class ValidationRequest(BaseModel):
     interaction_id: str
@@ -20,41 +29,61 @@ class ValidationRequest(BaseModel):
 @router.post("/ask")
 async def ask_question(
     request: QuestionRequest,
-    db: AsyncSession = Depends(get_db)
+    http_request: Request
 ):
-    try:
-        # Get answer from LLM
-        answer, citations = await get_answer_from_llm(
-            request.document_id,
-            request.question
-        )
+    # Rejected before queueing when the caller or document is over its daily token budget
+    await begin_metered_request("qa", user_id=request_user_key(http_request), document_id=request.document_id)
+    
+    # Interactive questions are admitted ahead of extraction and ingestion work
+    async with scheduler.admit(PRIORITY_INTERACTIVE, request_user_key(http_request)):
+        if request.session_id:
+            conversation = await load_conversation(request.session_id)
+            if conversation is None:
+                raise HTTPException(status_code=404, detail="Session not found")
+            if conversation.document_id != request.document_id:
+                raise HTTPException(status_code=400, detail="Session belongs to a different document")
+        else:
+            conversation = start_session("temp_user_id", request.document_id)  # Replace with actual user ID from auth
         
-        # Store interaction
-        interaction = QAInteraction(
-            user_id="temp_user_id",  # Replace with actual user ID from auth
-            document_id=request.document_id,
-            question=request.question,
-            answer=answer,
-            citations=citations
-        )
+        try:
+            # Rewrite follow-ups so retrieval does not depend on earlier turns
+            retrieval_query = await rewrite_follow_up(request.question, conversation)
+            
+            # Get answer from LLM
+            answer, citations = await get_answer_from_llm(
+                request.document_id,
+                request.question,
+                retrieval_query=retrieval_query,
+                conversation_context=conversation.prompt_context() or None
+            )
         
-        db.add(interaction)
-        await db.commit()
-        await db.refresh(interaction)
+            # Store interaction off the request path; its id is assigned now
+            interaction, = write_queue.enqueue(QAInteraction, [{
+                "user_id": "temp_user_id",  # Replace with actual user ID from auth
+                "document_id": request.document_id,
+                "question": request.question,
+                "answer": answer,
+                "citations": to_citation_refs(citations),  # Chunk text is hydrated on read
+                "validated": None,
+                "session_id": conversation.session_id,
+                "standalone_question": retrieval_query if retrieval_query != request.question else None
+            }])
+            record_turn(conversation, request.question, answer)
         
-        # Ensure we have consistent field names for the frontend
-        return {
-            "id": interaction.id,
-            "interaction_id": interaction.id, # For backward compatibility
-            "question": interaction.question,
-            "answer": interaction.answer,
-            "citations": citations or [], # Ensure citations is always at least an empty array
-            "validated": interaction.validated,
-            "created_at": interaction.created_at.isoformat() if interaction.created_at else None
-        }
+            # Ensure we have consistent field names for the frontend
+            return {
+                "id": interaction["id"],
+                "interaction_id": interaction["id"], # For backward compatibility
+                "session_id": conversation.session_id,
+                "question": interaction["question"],
+                "answer": interaction["answer"],
+                "citations": citations or [], # Ensure citations is always at least an empty array
+                "validated": interaction["validated"],
+                "created_at": interaction["created_at"].isoformat()
+            }
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/validate")
 async def validate_answer(
@@ -62,6 +91,9 @@ async def validate_answer(
     db: AsyncSession = Depends(get_db)
 ):
     try:
+        # A just-asked question may still be queued for insert
+        await write_queue.ensure_flushed(QAInteraction, request.interaction_id)
+        
         # Get interaction
         interaction = await db.get(QAInteraction, request.interaction_id)
         if not interaction:
@@ -76,27 +108,77 @@ async def validate_answer(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/export")
+async def export_interactions(
+    export_format: str = Query("csv", alias="format"),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    validated_only: bool = False,
+    document_id: Optional[str] = None
+):
+    """
+    Stream QA interactions across all documents as CSV, JSONL or Parquet.
+    Citations are exported as the stored chunk references.
+    """
+    try:
+        chunks = export_rows(
+            "qa",
+            export_format,
+            start_date=start_date,
+            end_date=end_date,
+            validated_only=validated_only,
+            document_id=document_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename("qa", export_format)}"'}
+    )
+
 @router.get("/history/{document_id}")
 async def get_chat_history(
     document_id: str,
+    include_text: bool = True,
+    session_id: Optional[str] = None,
     db: AsyncSession = Depends(get_db)
 ):
     try:
-        result = await db.execute(
-            select(QAInteraction)
-            .where(QAInteraction.document_id == document_id)
-            .order_by(QAInteraction.created_at)
-        )
+        filters = {"document_id": document_id}
+        if session_id:
+            filters["session_id"] = session_id
+        
+        # Interactions still queued for insert, so callers see their own writes
+        pending = write_queue.pending_rows(QAInteraction, **filters)
+        
+        query = select(QAInteraction).where(QAInteraction.document_id == document_id)
+        if session_id:
+            query = query.where(QAInteraction.session_id == session_id)
+        result = await db.execute(query.order_by(QAInteraction.created_at))
         interactions = result.scalars().all()
+        stored_ids = {interaction.id for interaction in interactions}
+        interactions = sorted(
+            list(interactions) + [interaction for interaction in pending if interaction.id not in stored_ids],
+            key=lambda interaction: interaction.created_at
+        )
+        
+        # Resolve every interaction's chunk references with one batched lookup
+        citations = hydrate_citations(
+            [interaction.citations for interaction in interactions],
+            include_text=include_text
+        )
         
         # Format the response to ensure consistent structure for frontend
         formatted_interactions = []
-        for interaction in interactions:
+        for interaction, interaction_citations in zip(interactions, citations):
             formatted_interactions.append({
                 "id": interaction.id,
+                "session_id": interaction.session_id,
                 "question": interaction.question,
                 "answer": interaction.answer,
-                "citations": interaction.citations or [],
+                "citations": interaction_citations,
                 "validated": interaction.validated,
                 "created_at": interaction.created_at.isoformat() if interaction.created_at else None
             })
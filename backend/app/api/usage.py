@@ -0,0 +1,72 @@
+from fastapi import APIRouter, HTTPException, Query
+from app.services.usage_service import BUDGET_DEFAULTS, USAGE_DIMENSIONS, get_daily_spend, get_budget_limit, get_usage_summary, set_budget
+from typing import List, Optional
+from datetime import datetime
+from pydantic import BaseModel
+
+router = APIRouter()
+
+class BudgetUpdate(BaseModel):
+    daily_token_limit: int  # 0 means unlimited
+
+@router.get("/summary")
+async def usage_summary(
+    group_by: List[str] = Query(["route"]),
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    document_id: Optional[str] = None,
+    route: Optional[str] = None
+):
+    """
+    Get LLM calls, tokens and latency from the usage ledger, grouped by any of
+    route, model, call_type, cache_status, user_id and document_id.
+    """
+    invalid = [dimension for dimension in group_by if dimension not in USAGE_DIMENSIONS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid group_by: {', '.join(invalid)}")
+    
+    try:
+        return await get_usage_summary(
+            group_by,
+            start_date=start_date,
+            end_date=end_date,
+            user_id=user_id,
+            document_id=document_id,
+            route=route
+        )
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/budgets/{scope}/{subject_id}")
+async def get_budget(scope: str, subject_id: str):
+    """Get a user's or document's daily token limit and today's spend."""
+    if scope not in BUDGET_DEFAULTS:
+        raise HTTPException(status_code=400, detail=f"Invalid scope: {scope}")
+    
+    try:
+        return {
+            "scope": scope,
+            "subject_id": subject_id,
+            "daily_token_limit": await get_budget_limit(scope, subject_id),
+            "tokens_used_today": await get_daily_spend(scope, subject_id)
+        }
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put("/budgets/{scope}/{subject_id}")
+async def update_budget(scope: str, subject_id: str, budget: BudgetUpdate):
+    """Override the configured daily token limit for one user or document."""
+    if scope not in BUDGET_DEFAULTS:
+        raise HTTPException(status_code=400, detail=f"Invalid scope: {scope}")
+    if budget.daily_token_limit < 0:
+        raise HTTPException(status_code=400, detail="daily_token_limit must be 0 (unlimited) or positive")
+    
+    try:
+        await set_budget(scope, subject_id, budget.daily_token_limit)
+        return {"message": "Budget updated successfully"}
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,46 @@
+"""
+Bulk-ingest a directory tree of PDF and DOCX reports.
+
+Prints files/s, chunks/s and tokens/s after every batch. Rerunning the same
+command after an interruption skips finished files and reuses the document
+ids of files that were in flight.
+
+Usage: python -m app.bulk_ingest <directory> [--workers N] [--batch-chunks N]
+       [--batch-files N] [--user-id ID] [--checkpoint PATH]
+"""
+import argparse
+import asyncio
+import os
+from pathlib import Path
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory of PDF and DOCX reports")
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="parser processes")
+    parser.add_argument("--batch-chunks", type=int, default=2048, help="chunks embedded and written per batch")
+    parser.add_argument("--batch-files", type=int, default=100, help="maximum files per batch")
+    parser.add_argument("--user-id", default="temp_user_id", help="owner of the ingested documents")
+    parser.add_argument("--checkpoint", type=Path, help="checkpoint file (default: derived from the directory)")
+    args = parser.parse_args()
+
+    if not args.directory.is_dir():
+        parser.error(f"{args.directory} is not a directory")
+
+    # Imported here so the parser processes, which re-import this module, stay light
+    from app.database import engine
+    from app.services.bulk_ingestion import bulk_ingest, default_checkpoint_path
+
+    # SQL echo would drown out the throughput lines
+    engine.echo = False
+
+    asyncio.run(bulk_ingest(
+        args.directory,
+        workers=args.workers,
+        batch_chunks=args.batch_chunks,
+        batch_files=args.batch_files,
+        user_id=args.user_id,
+        checkpoint_path=args.checkpoint or default_checkpoint_path(args.directory)
+    ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compact stored citations into chunk references.
+
+Older QAInteraction and ESGReport rows store a full copy of every cited
+chunk. This migration replaces each copy whose text still matches the chunk
+in ChromaDB with a (document version, chunk id, chunk index) reference that
+is hydrated on read, then optionally VACUUMs esg.db to release the space.
+
+Usage: python -m app.compact_citations [--vacuum]
+"""
+import asyncio
+import sys
+from sqlalchemy import select, text
+from sqlalchemy.orm.attributes import flag_modified
+from app.database import SessionLocal, engine
+from app.models.models import QAInteraction, ESGReport
+from app.services.citation_service import collection, make_chunk_id, to_citation_refs
+
+BATCH_SIZE = 500
+
+def compact_citation_lists(rows, document_ids):
+    """
+    Return compacted citation lists for a batch of rows, using one ChromaDB
+    lookup for every chunk the batch cites.
+    """
+    candidates = {}
+    for row, document_id in zip(rows, document_ids):
+        for citation in row.citations or []:
+            if "text" in citation and citation.get("chunk_index") is not None:
+                chunk_id = citation.get("chunk_id") or make_chunk_id(document_id, citation["chunk_index"])
+                candidates[chunk_id] = None
+
+    if candidates:
+        stored = collection.get(ids=list(candidates), include=["documents", "metadatas"])
+        for chunk_id, chunk_text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+            candidates[chunk_id] = (chunk_text, metadata)
+
+    compacted = []
+    for row, document_id in zip(rows, document_ids):
+        citations = []
+        for citation in row.citations or []:
+            if "text" not in citation or citation.get("chunk_index") is None:
+                citations.append(citation)
+                continue
+
+            chunk_id = citation.get("chunk_id") or make_chunk_id(document_id, citation["chunk_index"])
+            stored_chunk = candidates.get(chunk_id)
+            if stored_chunk is None or stored_chunk[0] != citation["text"]:
+                # The chunk is gone or has changed, so the copy is the only record left
+                citations.append(citation)
+                continue
+
+            citations.extend(to_citation_refs([{
+                **citation,
+                "document_id": document_id,
+                "document_version": stored_chunk[1].get("document_version"),
+                "chunk_id": chunk_id
+            }]))
+        compacted.append(citations)
+    return compacted
+
+async def compact_table(model) -> int:
+    """Compact the citations column of one table in id-ordered batches."""
+    updated = 0
+    last_id = ""
+    async with SessionLocal() as db:
+        while True:
+            result = await db.execute(
+                select(model)
+                .where(model.id > last_id)
+                .order_by(model.id)
+                .limit(BATCH_SIZE)
+            )
+            rows = result.scalars().all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            compacted = compact_citation_lists(rows, [row.document_id for row in rows])
+            for row, citations in zip(rows, compacted):
+                if citations != (row.citations or []):
+                    row.citations = citations
+                    flag_modified(row, "citations")
+                    updated += 1
+
+            await db.commit()
+            db.expunge_all()
+    return updated
+
+async def compact_citations(vacuum: bool = False) -> None:
+    for model in (QAInteraction, ESGReport):
+        updated = await compact_table(model)
+        print(f"Compacted citations in {updated} {model.__tablename__} rows")
+
+    if vacuum:
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text("VACUUM"))
+        print("Vacuumed database")
+
+if __name__ == "__main__":
+    asyncio.run(compact_citations(vacuum="--vacuum" in sys.argv))
@@ -0,0 +1,190 @@
+"""
+Offline evaluation of question routing.
+
+Compares the embedding router against the current keyword fallback and the
+original keyword rules on a labelled set of questions, and estimates the
+tokens saved relative to the original rules. Question embeddings are
+cached on disk, so reruns make no network calls.
+
+The router only overrides the keyword rules once its thresholds have been
+calibrated for the configured embedding model. --calibrate sweeps the
+thresholds on the eval set and records the most accurate pair in
+eval/intent_route_thresholds.json, or removes the model's entry when no
+pair beats the keyword fallback. Run it whenever the embedding model or the
+route exemplars change.
+
+Usage: python -m app.eval_intent_router [--calibrate] [path/to/intent_routes.jsonl]
+"""
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from app.services.intent_router import (
+    ROUTE_ESG_REPORT, ROUTE_EXEMPLARS, ROUTE_QA, THRESHOLDS_FILE, closest_route, exemplars_hash,
+    load_route_centroids, load_route_thresholds, is_esg_report_generation_query
+)
+from app.utils.embedding_cache import load_cached_embeddings
+from app.utils.embeddings import get_embedding_model_name
+
+DEFAULT_EVAL_SET = Path(__file__).resolve().parent.parent / "eval" / "intent_routes.jsonl"
+
+# Approximate prompt + completion tokens per request on each route (cache miss):
+# QA sends 5 chunks and allows 500 completion tokens, the report route sends
+# 3 chunks and allows 250 completion tokens for each of the 13 categories.
+ROUTE_TOKEN_COST = {
+    ROUTE_QA: 5 * 250 + 500,
+    ROUTE_ESG_REPORT: 13 * (3 * 250 + 250),
+}
+
+# The keyword rules used before embedding routing. Any mention of a single
+# topic such as water or energy was sent to the 13-category report.
+LEGACY_REPORT_KEYWORDS = [
+    "esg report", "sustainability report", "generate table", "create table", "categories",
+    "sustainable materials", "water", "energy", "waste", "ghg emissions",
+]
+
+# Thresholds tried by --calibrate
+CALIBRATION_SIMILARITIES = [round(0.5 + 0.01 * i, 2) for i in range(50)]
+CALIBRATION_MARGINS = [0.0, 0.005, 0.01, 0.02, 0.03, 0.05, 0.08, 0.1]
+
+def keyword_route(question: str) -> str:
+    return ROUTE_ESG_REPORT if is_esg_report_generation_query(question) else ROUTE_QA
+
+def legacy_route(question: str) -> str:
+    q_lower = question.lower()
+    if any(keyword in q_lower for keyword in LEGACY_REPORT_KEYWORDS) or is_esg_report_generation_query(question):
+        return ROUTE_ESG_REPORT
+    return ROUTE_QA
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def load_eval_set(path: Path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def score_eval_set(path: Path) -> List[Tuple[Dict, Tuple[str, float, float]]]:
+    """Pair each eval example with its closest route, similarity and margin."""
+    examples = load_eval_set(path)
+    questions = [example["question"] for example in examples]
+
+    # An exemplar scores near 1.0 against its own centroid and would inflate accuracy
+    exemplars = {normalize(text) for texts in ROUTE_EXEMPLARS.values() for text in texts}
+    overlap = [question for question in questions if normalize(question) in exemplars]
+    if overlap:
+        raise ValueError(f"Eval questions also used as route exemplars: {overlap}")
+    embeddings = load_cached_embeddings("intent_eval", questions)
+
+    if not load_route_centroids():
+        raise RuntimeError("Route centroids are unavailable")
+    return [(example, closest_route(embedding)) for example, embedding in zip(examples, embeddings)]
+
+def router_route(example: Dict, closest: Tuple[str, float, float], thresholds: Optional[Tuple[float, float]]) -> str:
+    """The route_question decision for an eval example under the given thresholds."""
+    route, similarity, margin = closest
+    if thresholds is not None and similarity >= thresholds[0] and margin >= thresholds[1]:
+        return route
+    return keyword_route(example["question"])
+
+def evaluate(path: Path = DEFAULT_EVAL_SET, thresholds: Optional[Tuple[float, float]] = None) -> dict:
+    """Score the router at the given thresholds, defaulting to the calibrated ones."""
+    scored = score_eval_set(path)
+    if thresholds is None:
+        thresholds = load_route_thresholds()
+
+    results = {name: {"correct": 0, "tokens": 0} for name in ("router", "keyword", "legacy")}
+    errors = []
+    for example, closest in scored:
+        predictions = {
+            "router": router_route(example, closest, thresholds),
+            "keyword": keyword_route(example["question"]),
+            "legacy": legacy_route(example["question"]),
+        }
+        for name, route in predictions.items():
+            results[name]["tokens"] += ROUTE_TOKEN_COST[route]
+            if route == example["route"]:
+                results[name]["correct"] += 1
+            elif name == "router":
+                errors.append((example["question"], example["route"], route))
+
+    total = len(scored)
+    return {
+        "model": get_embedding_model_name(),
+        "thresholds": thresholds,
+        "examples": total,
+        "router_accuracy": results["router"]["correct"] / total,
+        "keyword_accuracy": results["keyword"]["correct"] / total,
+        "legacy_accuracy": results["legacy"]["correct"] / total,
+        "router_tokens": results["router"]["tokens"],
+        "keyword_tokens": results["keyword"]["tokens"],
+        "legacy_tokens": results["legacy"]["tokens"],
+        "tokens_saved_per_question": (results["legacy"]["tokens"] - results["router"]["tokens"]) / total,
+        "router_errors": errors,
+    }
+
+def calibrate(path: Path = DEFAULT_EVAL_SET) -> Optional[Dict]:
+    """
+    Find the most accurate thresholds for the configured embedding model,
+    preferring the strictest pair on ties, and record them in THRESHOLDS_FILE
+    if they beat the keyword fallback. Returns the recorded entry, or None.
+    """
+    scored = score_eval_set(path)
+    keyword_correct = sum(keyword_route(example["question"]) == example["route"] for example, _ in scored)
+
+    best = None
+    for min_similarity in CALIBRATION_SIMILARITIES:
+        for min_margin in CALIBRATION_MARGINS:
+            thresholds = (min_similarity, min_margin)
+            correct = sum(router_route(example, closest, thresholds) == example["route"] for example, closest in scored)
+            if best is None or (correct, min_similarity, min_margin) > best:
+                best = (correct, min_similarity, min_margin)
+
+    calibrated = {}
+    if THRESHOLDS_FILE.exists():
+        with open(THRESHOLDS_FILE) as f:
+            calibrated = json.load(f)
+
+    model = get_embedding_model_name()
+    correct, min_similarity, min_margin = best
+    entry = None
+    if correct > keyword_correct:
+        entry = {
+            "min_similarity": min_similarity,
+            "min_margin": min_margin,
+            "exemplars": exemplars_hash(),
+            "examples": len(scored),
+            "router_accuracy": round(correct / len(scored), 4),
+            "keyword_accuracy": round(keyword_correct / len(scored), 4),
+        }
+        calibrated[model] = entry
+    else:
+        calibrated.pop(model, None)
+
+    with open(THRESHOLDS_FILE, "w") as f:
+        json.dump(calibrated, f, indent=2, sort_keys=True)
+        f.write("\n")
+    load_route_thresholds()
+    return entry
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--calibrate"]
+    eval_path = Path(args[0]) if args else DEFAULT_EVAL_SET
+    if "--calibrate" in sys.argv[1:]:
+        entry = calibrate(eval_path)
+        if entry is None:
+            print(f"No thresholds beat the keyword fallback for {get_embedding_model_name()}; keyword routing stays on")
+        else:
+            print(f"Calibrated {get_embedding_model_name()}: min_similarity {entry['min_similarity']}, min_margin {entry['min_margin']}")
+
+    summary = evaluate(eval_path)
+    thresholds = summary["thresholds"]
+    print(f"Embedding model:   {summary['model']}")
+    print(f"Thresholds:        {f'similarity {thresholds[0]}, margin {thresholds[1]}' if thresholds else 'not calibrated, keyword routing only'}")
+    print(f"Examples:          {summary['examples']}")
+    print(f"Router accuracy:   {summary['router_accuracy']:.1%}")
+    print(f"Keyword accuracy:  {summary['keyword_accuracy']:.1%}")
+    print(f"Legacy accuracy:   {summary['legacy_accuracy']:.1%}")
+    print(f"Estimated tokens:  router {summary['router_tokens']}, keyword {summary['keyword_tokens']}, legacy {summary['legacy_tokens']}")
+    print(f"Saved per question vs legacy: {summary['tokens_saved_per_question']:.0f} tokens")
+    for question, expected, predicted in summary["router_errors"]:
+        print(f"  misrouted: {question!r} expected {expected}, got {predicted}")
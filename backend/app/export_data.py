@@ -0,0 +1,63 @@
+"""
+Export ESG metrics or QA interactions across all documents.
+
+Rows are streamed from the database and written as they are encoded, so
+exports of any size run in constant memory. Parquet requires pyarrow.
+
+Usage: python -m app.export_data {metrics,qa} --output PATH|- [--format csv|jsonl|parquet]
+       [--start-date ISO] [--end-date ISO] [--category NAME] [--validated-only]
+       [--document-id ID]
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from app.database import engine
+from app.services.export_service import EXPORT_FORMATS, export_rows
+
+async def export_data(args) -> None:
+    chunks = export_rows(
+        args.dataset,
+        args.format,
+        start_date=args.start_date,
+        end_date=args.end_date,
+        category=args.category,
+        validated_only=args.validated_only,
+        document_id=args.document_id
+    )
+
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    written = 0
+    try:
+        async for chunk in chunks:
+            output.write(chunk)
+            written += len(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+
+    if args.output != "-":
+        print(f"Wrote {written} bytes to {args.output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export ESG metrics or QA interactions")
+    parser.add_argument("dataset", choices=["metrics", "qa"])
+    parser.add_argument("--output", required=True, help="output file, or - for stdout")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--start-date", type=datetime.fromisoformat, help="include rows created at or after this time")
+    parser.add_argument("--end-date", type=datetime.fromisoformat, help="include rows created before this time")
+    parser.add_argument("--category", help="metrics only")
+    parser.add_argument("--validated-only", action="store_true", help="QA only")
+    parser.add_argument("--document-id")
+    args = parser.parse_args()
+
+    # SQL echo would mix into stdout exports
+    engine.echo = False
+
+    try:
+        asyncio.run(export_data(args))
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == "__main__":
+    main()
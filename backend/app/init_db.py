@@ -1,16 +1,46 @@
 import asyncio
+from sqlalchemy import inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine
 from app.database import Base
-from app.models.models import User, Document, QAInteraction, ESGMetric
+from app.models.models import User, Document, QAInteraction, ESGMetric, ESGReport, KPIValue, MetricRollup
+from app.services.rollup_service import rebuild_rollup_statements
+
+def add_missing_columns(conn):
+    """
+    Add nullable columns that were introduced after a table was first created.
+    create_all only creates missing tables, so existing esg.db files need this.
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+def add_missing_indexes(conn):
+    """Create indexes that were added to the models after their table was created."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
 
 async def init_db():
     engine = create_async_engine(
         "sqlite+aiosqlite:///./esg.db",
         echo=True
     )
-    
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
+        await conn.run_sync(add_missing_indexes)
+        
+        # Backfill the metrics rollup from existing metrics
+        for stmt in rebuild_rollup_statements():
+            await conn.execute(stmt)
 
 if __name__ == "__main__":
-    asyncio.run(init_db()) 
\ No newline at end of file
+    asyncio.run(init_db())
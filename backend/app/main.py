@@ -3,6 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pathlib import Path
 import os
+import asyncio
 from dotenv import load_dotenv
 
 # Load environment variables from .env file in project root
@@ -23,15 +24,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Load cached intent-routing centroids so routing questions needs no network calls
+@app.on_event("startup")
+async def load_intent_router():
+    from app.services.intent_router import load_route_centroids
+    await asyncio.to_thread(load_route_centroids)
+
+# Collect recorded LLM calls into the usage ledger
+@app.on_event("startup")
+async def start_usage_ledger():
+    from app.services.usage_service import start_usage_writer
+    start_usage_writer()
+
+# Write queued QA interactions, metrics and usage records before the process exits
+@app.on_event("shutdown")
+async def drain_write_queue():
+    from app.services.usage_service import drain_usage_writer
+    from app.services.write_behind import write_queue
+    await drain_usage_writer()
+    await write_queue.drain()
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     return JSONResponse({"status": "healthy"})
 
+# Admission control queue depths and wait times per priority class
+@app.get("/health/scheduler")
+async def scheduler_stats():
+    from app.services.scheduler import scheduler
+    return JSONResponse(scheduler.stats())
+
 # Import and include routers
-from app.api import documents, auth, qa, metrics
+from app.api import documents, auth, qa, metrics, usage
 
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(documents.router, prefix="/documents", tags=["Documents"])
 app.include_router(qa.router, prefix="/qa", tags=["Question Answering"])
-app.include_router(metrics.router, prefix="/metrics", tags=["ESG Metrics"]) 
\ No newline at end of file
+app.include_router(metrics.router, prefix="/metrics", tags=["ESG Metrics"])
+app.include_router(usage.router, prefix="/usage", tags=["LLM Usage"]) 
\ No newline at end of file
@@ -2,6 +2,6 @@
 Models package
 """
 
-from .models import User, Document, QAInteraction, ESGMetric, Base
+from .models import User, Document, QAInteraction, ESGMetric, ESGReport, KPIValue, MetricRollup, ConversationSession, LLMUsage, LLMBudget, Base
 
-__all__ = ['User', 'Document', 'QAInteraction', 'ESGMetric', 'Base'] 
\ No newline at end of file
+__all__ = ['User', 'Document', 'QAInteraction', 'ESGMetric', 'ESGReport', 'KPIValue', 'MetricRollup', 'ConversationSession', 'LLMUsage', 'LLMBudget', 'Base'] 
\ No newline at end of file
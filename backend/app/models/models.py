@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, JSON, Text, UUID
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, JSON, Text, UUID, UniqueConstraint, Integer, Float, Index
 from sqlalchemy.sql import func
 import uuid
 from app.database import Base
@@ -24,6 +24,9 @@ class Document(Base):
     file_type = Column(String, nullable=False)
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
     processed = Column(Boolean, default=False)
+    content_hash = Column(String, nullable=True)
+    # Version whose KPIs are in kpi_values, set even when none were found so the index is built once
+    kpis_indexed_version = Column(String, nullable=True)
 
 class QAInteraction(Base):
     __tablename__ = "qa_interactions"
@@ -36,6 +39,24 @@ class QAInteraction(Base):
     citations = Column(JSON, nullable=True)
     validated = Column(Boolean, default=None)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    session_id = Column(String, ForeignKey("conversation_sessions.id"), nullable=True)
+    standalone_question = Column(Text, nullable=True)  # Follow-up rewritten for retrieval
+
+    __table_args__ = (
+        Index("ix_qa_interactions_session_created", "session_id", "created_at"),
+    )
+
+class ConversationSession(Base):
+    """A conversation about one document, with a rolling summary of its older turns."""
+    __tablename__ = "conversation_sessions"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    document_id = Column(String, ForeignKey("documents.id"), nullable=False)
+    summary = Column(Text, nullable=True)
+    summarized_turns = Column(Integer, nullable=False, default=0)  # Interactions folded into the summary
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 class ESGMetric(Base):
     __tablename__ = "esg_metrics"
@@ -47,4 +68,92 @@ class ESGMetric(Base):
     actual = Column(Text, nullable=True)
     rag_status = Column(String, nullable=True)
     extracted_by = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now()) 
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_esg_metrics_document_id", "document_id"),
+        Index("ix_esg_metrics_category_status", "category", "rag_status"),
+        Index("ix_esg_metrics_created_at", "created_at"),
+    )
+
+class ESGReport(Base):
+    __tablename__ = "esg_reports"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    document_id = Column(String, ForeignKey("documents.id"), nullable=False)
+    document_version = Column(String, nullable=False)
+    content = Column(Text, nullable=False)
+    citations = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("document_id", "document_version", name="uq_esg_reports_document_version"),
+    )
+
+class KPIValue(Base):
+    __tablename__ = "kpi_values"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    document_id = Column(String, ForeignKey("documents.id"), nullable=False)
+    chunk_index = Column(Integer, nullable=True)
+    category = Column(String, nullable=False)
+    metric = Column(String, nullable=False)
+    kind = Column(String, nullable=False)  # "target" or "actual"
+    value = Column(Float, nullable=False)
+    unit = Column(String, nullable=False)
+    year = Column(Integer, nullable=True)
+    context = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_kpi_values_document_metric", "document_id", "category", "metric", "unit"),
+    )
+
+class MetricRollup(Base):
+    """Materialized count of ESG metrics per category, RAG status, document and month."""
+    __tablename__ = "metric_rollups"
+    
+    category = Column(String, primary_key=True)
+    rag_status = Column(String, primary_key=True)
+    document_id = Column(String, ForeignKey("documents.id"), primary_key=True)
+    period = Column(String, primary_key=True)  # "YYYY-MM"
+    metric_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_metric_rollups_period", "period"),
+        Index("ix_metric_rollups_document_id", "document_id"),
+        Index("ix_metric_rollups_status", "rag_status"),
+    )
+
+class LLMUsage(Base):
+    """One LLM or embedding call, charged to the user, document and route that made it."""
+    __tablename__ = "llm_usage"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    # No foreign keys: calls are recorded before uploads are stored and for unregistered callers
+    user_id = Column(String, nullable=True)
+    document_id = Column(String, nullable=True)
+    route = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    call_type = Column(String, nullable=False)  # "chat" or "embedding"
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    latency_ms = Column(Float, nullable=False, default=0)
+    cache_status = Column(String, nullable=False)  # "miss", "hit", "coalesced" or "error"
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_llm_usage_user_created", "user_id", "created_at"),
+        Index("ix_llm_usage_document_created", "document_id", "created_at"),
+        Index("ix_llm_usage_route_created", "route", "created_at"),
+    )
+
+class LLMBudget(Base):
+    """Daily token limit for one user or document, overriding the configured default."""
+    __tablename__ = "llm_budgets"
+
+    scope = Column(String, primary_key=True)  # "user" or "document"
+    subject_id = Column(String, primary_key=True)
+    daily_token_limit = Column(Integer, nullable=False)  # 0 means unlimited
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
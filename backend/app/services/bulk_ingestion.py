@@ -0,0 +1,265 @@
+"""
+Bulk ingestion of report archives, used by the app.bulk_ingest command.
+
+Files are parsed and chunked in a process pool, their chunks are embedded in
+large batches, and each batch is written to ChromaDB, the exact-search vector
+index and the documents/kpi_values tables in one transaction. Progress is
+checkpointed after every batch so an interrupted run can resume.
+"""
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+from sqlalchemy import delete
+from app.config.chroma_config import BASE_DIR
+from app.database import SessionLocal
+from app.models.models import Document, KPIValue, generate_uuid
+from app.services.document_processor import chroma_client, collection
+from app.services.kpi_extractor import extract_kpis
+from app.services.vector_index import vector_store
+from app.utils.document_parsing import SUPPORTED_EXTENSIONS, parse_document
+from app.services.usage_service import queue_usage_records
+from app.services.write_behind import write_queue
+from app.utils.embeddings import aembed_texts, get_embedding_model_name
+from app.utils.llm_usage import set_usage_context
+
+CHECKPOINT_DIR = BASE_DIR / "bulk_ingest_checkpoints"
+
+# Rough token estimate for throughput reporting, without a tokenizer dependency
+CHARS_PER_TOKEN = 4
+
+class Checkpoint:
+    """
+    Append-only JSONL log of per-file progress. The last record for a path
+    wins: "pending" records hold the document id assigned before writing,
+    "done" records mark files that are fully committed.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.records: Dict[str, Dict] = {}
+        if path.exists():
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record["path"]] = record
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "a")
+
+    def is_done(self, relative_path: str, stat: os.stat_result) -> bool:
+        record = self.records.get(relative_path)
+        return (
+            record is not None
+            and record["status"] == "done"
+            and record["size"] == stat.st_size
+            and record["mtime_ns"] == stat.st_mtime_ns
+        )
+
+    def document_id_for(self, relative_path: str, content_hash: str) -> str:
+        """Reuse the id of an interrupted write of the same file version, so retries overwrite it."""
+        record = self.records.get(relative_path)
+        if record is not None and record["content_hash"] == content_hash and record.get("document_id"):
+            return record["document_id"]
+        return generate_uuid()
+
+    def write(self, records: List[Dict]) -> None:
+        for record in records:
+            self.records[record["path"]] = record
+            self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+def default_checkpoint_path(directory: Path) -> Path:
+    digest = hashlib.sha256(str(directory.resolve()).encode("utf-8")).hexdigest()[:12]
+    return CHECKPOINT_DIR / f"{directory.name}-{digest}.jsonl"
+
+def find_files(directory: Path) -> List[Path]:
+    return sorted(
+        path for path in directory.rglob("*")
+        if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS
+    )
+
+class Throughput:
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.files = 0
+        self.chunks = 0
+        self.tokens = 0
+        self.failed = 0
+
+    def report(self, remaining: int) -> str:
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        return (
+            f"{self.files} files ({self.failed} failed), {self.chunks} chunks, ~{self.tokens} tokens | "
+            f"{self.files / elapsed:.2f} files/s, {self.chunks / elapsed:.1f} chunks/s, "
+            f"{self.tokens / elapsed:.0f} tokens/s | {remaining} files left"
+        )
+
+async def write_batch(batch: List[Dict], user_id: str, checkpoint: Checkpoint) -> None:
+    """Embed and store a batch of parsed files, then mark them done in the checkpoint."""
+    checkpoint.write([{**item["record"], "status": "pending"} for item in batch])
+
+    texts, ids, metadatas = [], [], []
+    for item in batch:
+        for i, (chunk, chunk_metadata) in enumerate(zip(item["chunks"], item["chunk_metadatas"])):
+            texts.append(chunk)
+            ids.append(f"{item['document_id']}_{i}")
+            metadatas.append({
+                **chunk_metadata,
+                "document_id": item["document_id"],
+                "chunk_index": i,
+                "document_version": item["content_hash"]
+            })
+
+    async def embed_document(item: Dict) -> List[List[float]]:
+        # Each document's share of the shared embedding calls is charged to it
+        set_usage_context(user_id=user_id, document_id=item["document_id"], route="bulk_ingestion")
+        return await aembed_texts(item["chunks"])
+
+    if texts:
+        embeddings = [
+            embedding
+            for document_embeddings in await asyncio.gather(*[embed_document(item) for item in batch])
+            for embedding in document_embeddings
+        ]
+
+        # Upsert so a resumed batch overwrites chunks written before an interruption
+        step = chroma_client.max_batch_size
+        for start in range(0, len(ids), step):
+            await asyncio.to_thread(
+                collection.upsert,
+                ids=ids[start:start + step],
+                documents=texts[start:start + step],
+                embeddings=embeddings[start:start + step],
+                metadatas=metadatas[start:start + step]
+            )
+    else:
+        embeddings = []
+
+    offset = 0
+    for item in batch:
+        count = len(item["chunks"])
+        if count:
+            vector_store.write_document(
+                item["document_id"],
+                ids[offset:offset + count],
+                metadatas[offset:offset + count],
+                embeddings[offset:offset + count]
+            )
+        offset += count
+
+    # Documents and their KPI rows for the whole batch in one transaction
+    async with SessionLocal() as db:
+        document_ids = [item["document_id"] for item in batch]
+        await db.execute(delete(KPIValue).where(KPIValue.document_id.in_(document_ids)))
+        for item in batch:
+            await db.merge(Document(
+                id=item["document_id"],
+                user_id=user_id,
+                file_name=item["path"].name,
+                file_type=item["path"].suffix.lower().lstrip("."),
+                processed=True,
+                content_hash=item["content_hash"],
+                kpis_indexed_version=item["content_hash"]
+            ))
+            kpis = []
+            for i, chunk in enumerate(item["chunks"]):
+                kpis.extend(extract_kpis(chunk, chunk_index=i))
+            db.add_all([KPIValue(document_id=item["document_id"], **kpi) for kpi in kpis])
+        await db.commit()
+
+    checkpoint.write([{**item["record"], "status": "done"} for item in batch])
+    queue_usage_records()
+
+async def bulk_ingest(
+    directory: Path,
+    workers: int,
+    batch_chunks: int,
+    batch_files: int,
+    user_id: str,
+    checkpoint_path: Path
+) -> None:
+    checkpoint = Checkpoint(checkpoint_path)
+    files = find_files(directory)
+    todo = []
+    for path in files:
+        relative_path = str(path.relative_to(directory))
+        if not checkpoint.is_done(relative_path, path.stat()):
+            todo.append((path, relative_path))
+
+    print(f"Found {len(files)} files, {len(files) - len(todo)} already ingested, {len(todo)} to go")
+    print(f"Embedding with {get_embedding_model_name()}, checkpoint at {checkpoint_path}")
+
+    stats = Throughput()
+    loop = asyncio.get_running_loop()
+    # Spawned workers import only the parsing module and the command-line entry point
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    queue = iter(todo)
+    in_flight = {}
+    batch: List[Dict] = []
+    batch_size = 0
+
+    def submit_next():
+        item = next(queue, None)
+        if item is not None:
+            future = loop.run_in_executor(pool, parse_document, item[0])
+            in_flight[future] = item
+
+    try:
+        # Keep the pool busy while batches are embedded and written
+        for _ in range(workers * 4):
+            submit_next()
+
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                path, relative_path = in_flight.pop(future)
+                submit_next()
+                try:
+                    content_hash, chunks, chunk_metadatas = future.result()
+                except Exception as e:
+                    print(f"Error parsing {relative_path}: {str(e)}")
+                    stats.failed += 1
+                    continue
+
+                stat = path.stat()
+                document_id = checkpoint.document_id_for(relative_path, content_hash)
+                batch.append({
+                    "path": path,
+                    "content_hash": content_hash,
+                    "chunks": chunks,
+                    "chunk_metadatas": chunk_metadatas,
+                    "document_id": document_id,
+                    "record": {
+                        "path": relative_path,
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "content_hash": content_hash,
+                        "document_id": document_id,
+                    }
+                })
+                batch_size += len(chunks)
+
+            if batch and (batch_size >= batch_chunks or len(batch) >= batch_files or not in_flight):
+                await write_batch(batch, user_id, checkpoint)
+                stats.files += len(batch)
+                stats.chunks += batch_size
+                stats.tokens += sum(len(chunk) for item in batch for chunk in item["chunks"]) // CHARS_PER_TOKEN
+                batch, batch_size = [], 0
+                print(stats.report(len(todo) - stats.files - stats.failed))
+    finally:
+        pool.shutdown(cancel_futures=True)
+        checkpoint.close()
+        queue_usage_records()
+        await write_queue.drain()
+
+    print(f"Finished: {stats.report(0)}")
@@ -0,0 +1,80 @@
+from typing import Dict, List, Optional
+from app.utils.chroma_client import get_chroma_client, get_chunk_collection
+
+# Initialize ChromaDB using the utility function
+chroma_client = get_chroma_client()
+
+# Create or get the chunk collection for the configured embedding model
+collection = get_chunk_collection()
+
+# Fields kept when a citation is persisted; the chunk text is looked up on read
+CITATION_REF_FIELDS = ("document_id", "document_version", "chunk_id", "chunk_index", "score")
+
+def make_chunk_id(document_id: str, chunk_index: int) -> str:
+    """ChromaDB id of a document chunk, as assigned at ingestion."""
+    return f"{document_id}_{chunk_index}"
+
+def distance_to_score(distance: Optional[float]) -> Optional[float]:
+    """
+    Convert a ChromaDB squared L2 distance into a cosine similarity.
+    Embeddings are unit length, so distance = 2 - 2 * cosine.
+    """
+    if distance is None:
+        return None
+    return round(1 - distance / 2, 4)
+
+def citations_from_results(document_id: str, results: Dict) -> List[Dict]:
+    """Build citations, including chunk text, from the first row of a ChromaDB query result."""
+    distances = (results.get("distances") or [[]])[0] or []
+    citations = []
+    for i, (chunk_id, text, metadata) in enumerate(zip(results["ids"][0], results["documents"][0], results["metadatas"][0])):
+        citations.append({
+            "document_id": document_id,
+            "document_version": metadata.get("document_version"),
+            "chunk_id": chunk_id,
+            "chunk_index": metadata.get("chunk_index", i),
+            "score": distance_to_score(distances[i] if i < len(distances) else None),
+            "text": text
+        })
+    return citations
+
+def to_citation_refs(citations: Optional[List[Dict]]) -> List[Dict]:
+    """Strip citations down to chunk references for storage."""
+    return [
+        {field: citation[field] for field in CITATION_REF_FIELDS if citation.get(field) is not None}
+        for citation in citations or []
+    ]
+
+def hydrate_citations(citation_lists: List[Optional[List[Dict]]], include_text: bool = True) -> List[List[Dict]]:
+    """
+    Resolve stored citation references back to chunk text with one batched
+    ChromaDB lookup covering every list. Legacy citations that still carry
+    their own text are returned as they are.
+    """
+    if not include_text:
+        return [
+            [{key: value for key, value in citation.items() if key != "text"} for citation in citations or []]
+            for citations in citation_lists
+        ]
+
+    chunk_ids = sorted({
+        citation["chunk_id"]
+        for citations in citation_lists
+        for citation in citations or []
+        if "text" not in citation and citation.get("chunk_id")
+    })
+
+    texts = {}
+    if chunk_ids:
+        stored = collection.get(ids=chunk_ids, include=["documents"])
+        texts = dict(zip(stored["ids"], stored["documents"]))
+
+    hydrated = []
+    for citations in citation_lists:
+        resolved = []
+        for citation in citations or []:
+            if "text" not in citation:
+                citation = {**citation, "text": texts.get(citation.get("chunk_id"), "")}
+            resolved.append(citation)
+        hydrated.append(resolved)
+    return hydrated
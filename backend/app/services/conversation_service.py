@@ -0,0 +1,238 @@
+import asyncio
+import re
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from sqlalchemy import select
+from app.database import get_db
+from app.models.models import ConversationSession, QAInteraction
+from app.services.write_behind import write_queue
+from app.utils.llm_usage import create_chat_completion
+
+# Turns kept verbatim in prompts; older turns are folded into the rolling summary
+CONVERSATION_RECENT_TURNS = 3
+# Each question or answer is cut to this many characters in prompts
+CONVERSATION_TURN_CHARS = 600
+CONVERSATION_SUMMARY_MAX_TOKENS = 200
+# Sessions whose summary and recent turns are kept in memory
+CONVERSATION_CACHE_SIZE = 1000
+
+# Openers that only make sense as a continuation of the previous turn
+FOLLOW_UP_OPENER = re.compile(r"^\s*(and|what about|how about|same for)\b", re.IGNORECASE)
+# Pronouns that need an antecedent
+ANAPHORIC_PRONOUNS = {"it", "its", "they", "them", "their", "theirs"}
+# Demonstratives are pronouns only when no noun follows them ("that" vs "that target")
+DEMONSTRATIVES = {"this", "that", "these", "those"}
+# Words that are not noun phrases: question words, auxiliaries, articles,
+# prepositions and the verbs follow-ups typically use
+NON_NOUN_WORDS = {
+    "what", "which", "who", "whom", "whose", "when", "where", "why", "how",
+    "is", "are", "was", "were", "be", "been", "being", "do", "does", "did", "has", "have", "had",
+    "will", "would", "can", "could", "should", "may", "might", "must", "shall",
+    "a", "an", "the", "and", "or", "but", "so", "also", "not", "no",
+    "in", "on", "at", "of", "for", "to", "from", "by", "with", "about", "over", "since", "against", "than", "as",
+    "i", "you", "we", "me", "us", "there", "here", "then", "now", "much", "many", "more", "less",
+    "mean", "means", "compare", "compared", "change", "changed", "happen", "happened", "include", "includes",
+    "cover", "covers", "affect", "affected", "go", "went", "improve", "improved", "increase", "increased",
+    "decrease", "decreased", "fall", "fell", "rise", "rose", "perform", "performed", "get", "got", "break", "down",
+    "explain", "tell", "show", "describe", "elaborate", "expand",
+}
+
+class ConversationState:
+    """Rolling summary plus the most recent turns of one session."""
+
+    def __init__(self, session_id: str, document_id: str, summary: Optional[str] = None, summarized_turns: int = 0):
+        self.session_id = session_id
+        self.document_id = document_id
+        self.summary = summary
+        self.summarized_turns = summarized_turns
+        self.recent: List[Tuple[str, str]] = []
+        self.lock = asyncio.Lock()
+        self.folding: Optional[asyncio.Task] = None
+
+    @property
+    def has_history(self) -> bool:
+        return bool(self.summary or self.recent)
+
+    def prompt_context(self) -> str:
+        """Conversation context for prompts, bounded regardless of conversation length."""
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier conversation: {self.summary}")
+        for question, answer in self.recent[-CONVERSATION_RECENT_TURNS:]:
+            parts.append(f"User: {_truncate(question)}\nAssistant: {_truncate(answer)}")
+        return "\n\n".join(parts)
+
+# Per-session locks and fold tasks for this process. The summary and turns are
+# re-read from the database on every load, so summaries folded by other
+# workers are picked up.
+_sessions: "OrderedDict[str, ConversationState]" = OrderedDict()
+
+def _truncate(text: str) -> str:
+    return text if len(text) <= CONVERSATION_TURN_CHARS else text[:CONVERSATION_TURN_CHARS] + "..."
+
+def _cache(state: ConversationState) -> ConversationState:
+    _sessions[state.session_id] = state
+    _sessions.move_to_end(state.session_id)
+    while len(_sessions) > CONVERSATION_CACHE_SIZE:
+        _sessions.popitem(last=False)
+    return state
+
+def start_session(user_id: str, document_id: str) -> ConversationState:
+    """Create a session; the row is written behind like the interactions that follow."""
+    row, = write_queue.enqueue(ConversationSession, [{
+        "user_id": user_id,
+        "document_id": document_id,
+        "summary": None,
+        "summarized_turns": 0
+    }])
+    return _cache(ConversationState(row["id"], document_id))
+
+async def load_conversation(session_id: str) -> Optional[ConversationState]:
+    """
+    Return a session's state, refreshed from the stored summary and the
+    interactions not yet folded into it. Returns None for unknown sessions.
+    """
+    state = _sessions.get(session_id)
+    if state is not None and state.lock.locked():
+        # A fold in this process is updating the state and will store it
+        _sessions.move_to_end(session_id)
+        return state
+
+    # Queued rows first, so a flush between the two reads cannot hide them
+    pending_sessions = write_queue.pending_rows(ConversationSession, id=session_id)
+    pending_turns = write_queue.pending_rows(QAInteraction, session_id=session_id)
+
+    async for db in get_db():
+        session = pending_sessions[0] if pending_sessions else await db.get(ConversationSession, session_id)
+        if session is None:
+            return None
+
+        result = await db.execute(
+            select(QAInteraction)
+            .where(QAInteraction.session_id == session_id)
+            .order_by(QAInteraction.created_at)
+            .offset(session.summarized_turns or 0)
+        )
+        turns = result.scalars().all()
+
+    stored_ids = {turn.id for turn in turns}
+    turns = list(turns) + [turn for turn in pending_turns if turn.id not in stored_ids]
+
+    if state is None:
+        state = ConversationState(session_id, session.document_id)
+    state.summary = session.summary
+    state.summarized_turns = session.summarized_turns or 0
+    state.recent = [(turn.question, turn.answer) for turn in sorted(turns, key=lambda turn: turn.created_at)]
+    _schedule_fold(state)
+    return _cache(state)
+
+def is_follow_up(question: str) -> bool:
+    """
+    Cheap check for questions that need earlier turns to make sense: a
+    continuation opener such as "what about", or a pronoun with no noun
+    phrase before it in the question that it could refer to.
+    """
+    if FOLLOW_UP_OPENER.search(question):
+        return True
+
+    words = re.findall(r"[a-z0-9']+", question.lower())
+    seen_noun = False
+    for i, word in enumerate(words):
+        following = words[i + 1] if i + 1 < len(words) else None
+        if word in ANAPHORIC_PRONOUNS or (word in DEMONSTRATIVES and (following is None or following in NON_NOUN_WORDS)):
+            if not seen_noun:
+                return True
+        elif word not in NON_NOUN_WORDS and word not in DEMONSTRATIVES:
+            seen_noun = True
+    return False
+
+async def rewrite_follow_up(question: str, state: ConversationState) -> str:
+    """
+    Rewrite a follow-up into a standalone retrieval query using the bounded
+    conversation context. Questions that already stand alone, or that start a
+    conversation, are returned unchanged without an LLM call.
+    """
+    if not state.has_history or not is_follow_up(question):
+        return question
+
+    try:
+        response = await asyncio.to_thread(
+            create_chat_completion,
+            route="qa_rewrite",
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": (
+                    "Rewrite the user's latest question about an ESG document as a single standalone "
+                    "search query, resolving references to earlier turns such as pronouns, topics and years. "
+                    "Reply with the query only."
+                )},
+                {"role": "user", "content": f"{state.prompt_context()}\n\nLatest question: {_truncate(question)}"}
+            ],
+            temperature=0,
+            max_tokens=100
+        )
+        rewritten = response.choices[0].message.content.strip().strip('"')
+        return rewritten or question
+
+    except Exception as e:
+        print(f"Error rewriting follow-up question: {str(e)}")
+        return question
+
+def record_turn(state: ConversationState, question: str, answer: str) -> None:
+    """Add a finished turn and fold older turns into the summary in the background."""
+    state.recent.append((question, answer))
+    _schedule_fold(state)
+
+def _schedule_fold(state: ConversationState) -> None:
+    if len(state.recent) > CONVERSATION_RECENT_TURNS and (state.folding is None or state.folding.done()):
+        state.folding = asyncio.get_running_loop().create_task(fold_summary(state))
+
+async def fold_summary(state: ConversationState) -> None:
+    """
+    Fold turns beyond the recent window into the rolling summary with one LLM
+    call per pass, storing the summary so other workers and restarts reuse it.
+    Turns recorded while a pass is running are picked up by the next pass.
+    """
+    async with state.lock:
+        while len(state.recent) > CONVERSATION_RECENT_TURNS:
+            overflow = state.recent[:-CONVERSATION_RECENT_TURNS]
+            turns = "\n\n".join(f"User: {_truncate(question)}\nAssistant: {_truncate(answer)}" for question, answer in overflow)
+
+            try:
+                response = await asyncio.to_thread(
+                    create_chat_completion,
+                    route="conversation_summary",
+                    model="gpt-4o",
+                    messages=[
+                        {"role": "system", "content": (
+                            "Update the running summary of a conversation about an ESG document. Keep the "
+                            "topics, metrics, years and figures the user asked about. Reply with the summary only, "
+                            "in under 150 words."
+                        )},
+                        {"role": "user", "content": f"Current summary: {state.summary or '(none)'}\n\nNew turns:\n{turns}"}
+                    ],
+                    temperature=0,
+                    max_tokens=CONVERSATION_SUMMARY_MAX_TOKENS
+                )
+                summary = response.choices[0].message.content.strip()
+            except Exception as e:
+                # Prompts stay bounded without the summary; the turns are folded on a later turn
+                print(f"Error updating conversation summary: {str(e)}")
+                return
+
+            state.summary = summary
+            state.summarized_turns += len(overflow)
+            del state.recent[:len(overflow)]
+
+            try:
+                # Loads skip summarized_turns stored turns, so the session and its turns must be written first
+                if write_queue.is_pending(ConversationSession, state.session_id) or write_queue.pending_rows(QAInteraction, session_id=state.session_id):
+                    await write_queue.flush(force=True)
+                async for db in get_db():
+                    session = await db.get(ConversationSession, state.session_id)
+                    if session:
+                        session.summary = state.summary
+                        session.summarized_turns = state.summarized_turns
+                        await db.commit()
+            except Exception as e:
+                print(f"Error storing conversation summary: {str(e)}")
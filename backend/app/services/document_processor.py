@@ -1,5 +1,3 @@
-import fitz  # PyMuPDF
-from docx import Document as DocxDocument
 from pathlib import Path
 import asyncio
 from typing import List, Dict, Optional
@@ -8,145 +6,142 @@ import os
 from app.database import get_db
 from app.models.models import Document
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.utils.chroma_client import get_chroma_client, get_or_create_collection
-from app.utils.openai_client import get_openai_client
+from app.utils.chroma_client import get_chroma_client, get_chunk_collection
+from app.utils.embeddings import aembed_texts, get_embedding_model_name
+from app.utils.single_flight import single_flight
+from app.utils.document_parsing import build_chunks, compute_content_hash, load_document
+from app.services.kpi_extractor import index_document_kpis
+from app.services.vector_index import vector_store
 
 # Initialize ChromaDB using the utility function
 chroma_client = get_chroma_client()
 
-# Create or get collection
-collection = get_or_create_collection(name="document_chunks")
+# Create or get the chunk collection for the configured embedding model
+collection = get_chunk_collection()
 
 async def process_document(document_id: str, file_path: Path):
+    """
+    Process a document once, even if the same file is uploaded concurrently
+    from several requests or workers. Uploads are keyed by content, so each
+    follower copies the leader's chunks and embeddings under its own
+    document id instead of parsing and embedding the file again.
+    """
+    content_hash = compute_content_hash(file_path)
+    source_id = await single_flight(
+        f"ingest:{content_hash}",
+        lambda: ingest_document(document_id, file_path, content_hash)
+    )
+    if source_id != document_id:
+        await copy_document_index(source_id, document_id, content_hash)
+
+async def ingest_document(document_id: str, file_path: Path, content_hash: str) -> str:
     """
     Process the uploaded document and extract text content.
     Steps:
-    1. Extract text from document
-    2. Chunk the text into smaller pieces
-    3. Create OpenAI embeddings and store chunks in ChromaDB
-    4. Update document status
+    1. Extract text and tables from document
+    2. Chunk the text into smaller pieces and tables into whole-row chunks
+    3. Create embeddings and store chunks in ChromaDB
+    4. Index numeric KPIs found in the chunks
+    5. Update document status
     """
     try:
-        # Get file extension
-        file_ext = file_path.suffix.lower()
-        
-        # Extract text based on file type
-        if file_ext == '.pdf':
-            text = extract_text_from_pdf(file_path)
-        elif file_ext == '.docx':
-            text = extract_text_from_docx(file_path)
-        else:
-            raise ValueError(f"Unsupported file type: {file_ext}")
+        # Extract prose and structured tables, cached per document version
+        text, tables = await asyncio.to_thread(load_document, file_path, content_hash)
         
-        # Chunk the text
-        chunks = chunk_text(text)
+        # Chunk the prose; each table becomes whole-row chunks
+        chunks, chunk_metadatas = build_chunks(text, tables)
         
         # Generate embeddings and store chunks in ChromaDB
-        await store_chunks_with_embeddings(document_id, chunks)
+        await store_chunks_with_embeddings(document_id, chunks, document_version=content_hash, chunk_metadatas=chunk_metadatas)
         
-        # Update document status in database
-        async for db in get_db():
-            document = await db.get(Document, document_id)
-            if document:
-                document.processed = True
-                await db.commit()
+        # Index KPIs and mark the document processed
+        await finish_document(document_id, chunks, content_hash)
                 
         print(f"Document {document_id} processed and stored in ChromaDB with {len(chunks)} chunks")
+        return document_id
         
     except Exception as e:
         print(f"Error processing document: {str(e)}")
         raise
 
-def extract_text_from_pdf(file_path: Path) -> str:
-    """Extract text from PDF file using PyMuPDF."""
-    doc = fitz.open(str(file_path))
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text
+async def copy_document_index(source_id: str, document_id: str, content_hash: str) -> None:
+    """Index a document from the stored chunks and embeddings of an identical upload."""
+    stored = await asyncio.to_thread(
+        collection.get,
+        where={"document_id": source_id},
+        include=["documents", "metadatas", "embeddings"]
+    )
+    order = sorted(range(len(stored["ids"])), key=lambda i: stored["metadatas"][i].get("chunk_index", i))
+    chunks = [stored["documents"][i] for i in order]
+    embeddings = [list(stored["embeddings"][i]) for i in order]
+    chunk_metadatas = [
+        {key: value for key, value in stored["metadatas"][i].items() if key not in ("document_id", "chunk_index", "document_version")}
+        for i in order
+    ]
 
-def extract_text_from_docx(file_path: Path) -> str:
-    """Extract text from DOCX file using python-docx."""
-    doc = DocxDocument(file_path)
-    text = ""
-    for paragraph in doc.paragraphs:
-        text += paragraph.text + "\n"
-    return text
+    store_chunks(document_id, chunks, embeddings, document_version=content_hash, chunk_metadatas=chunk_metadatas)
+    await finish_document(document_id, chunks, content_hash)
+    print(f"Document {document_id} indexed from identical upload {source_id} with {len(chunks)} chunks")
 
-def chunk_text(text: str, chunk_size: int = 1000) -> List[str]:
-    """Split text into chunks of approximately equal size."""
-    words = text.split()
-    chunks = []
-    current_chunk = []
-    current_size = 0
+async def finish_document(document_id: str, chunks: List[str], content_hash: str) -> None:
+    # Index numeric KPIs so metrics can be served without an LLM call
+    await index_document_kpis(document_id, chunks, document_version=content_hash)
     
-    for word in words:
-        word_size = len(word) + 1  # +1 for space
-        if current_size + word_size > chunk_size and current_chunk:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = [word]
-            current_size = word_size
-        else:
-            current_chunk.append(word)
-            current_size += word_size
-    
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-    
-    return chunks
+    # Update document status in database
+    async for db in get_db():
+        document = await db.get(Document, document_id)
+        if document:
+            document.processed = True
+            document.content_hash = content_hash
+            await db.commit()
 
-async def store_chunks_with_embeddings(document_id: str, chunks: List[str]) -> None:
+async def store_chunks_with_embeddings(
+    document_id: str,
+    chunks: List[str],
+    document_version: Optional[str] = None,
+    chunk_metadatas: Optional[List[Dict]] = None
+) -> None:
     """
-    Generate OpenAI embeddings and store text chunks in ChromaDB with metadata.
+    Generate embeddings and store text chunks in ChromaDB with metadata.
     """
-    ids = [f"{document_id}_{i}" for i in range(len(chunks))]
-    metadatas = [{"document_id": document_id, "chunk_index": i} for i in range(len(chunks))]
-    
-    # Generate embeddings using OpenAI
+    # Generate embeddings with the configured provider
     try:
-        # Get OpenAI client from centralized utility
-        openai_client = get_openai_client()
-        embeddings = []
-        # Process chunks in batches to avoid rate limits
-        batch_size = 20
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i+batch_size]
-            
-            # Using the latest OpenAI API approach
-            response = openai_client.embeddings.create(
-                model="text-embedding-ada-002", 
-                input=batch
-            )
-            
-            batch_embeddings = [item.embedding for item in response.data]
-            embeddings.extend(batch_embeddings)
-            
-        # Add chunks to collection with embeddings
-        collection.add(
-            documents=chunks,
-            embeddings=embeddings,
-            ids=ids,
-            metadatas=metadatas
-        )
-        
-        print(f"Successfully stored {len(chunks)} chunks with OpenAI embeddings")
+        # Requests are batched with other concurrent callers by the embedding utility
+        embeddings = await aembed_texts(chunks)
+        store_chunks(document_id, chunks, embeddings, document_version=document_version, chunk_metadatas=chunk_metadatas)
+        print(f"Successfully stored {len(chunks)} chunks with {get_embedding_model_name()} embeddings")
     
     except Exception as e:
         print(f"Error generating embeddings: {str(e)}")
         raise
 
-# Keep the original store_chunks as fallback
-async def store_chunks(document_id: str, chunks: List[str]) -> None:
-    """Store text chunks in ChromaDB with metadata (without custom embeddings)."""
+def store_chunks(
+    document_id: str,
+    chunks: List[str],
+    embeddings: List[List[float]],
+    document_version: Optional[str] = None,
+    chunk_metadatas: Optional[List[Dict]] = None
+) -> None:
+    """Store embedded chunks in ChromaDB and the exact-search vector index."""
     ids = [f"{document_id}_{i}" for i in range(len(chunks))]
-    metadatas = [{"document_id": document_id, "chunk_index": i} for i in range(len(chunks))]
+    metadatas = [
+        {**(chunk_metadatas[i] if chunk_metadatas else {}), "document_id": document_id, "chunk_index": i}
+        for i in range(len(chunks))
+    ]
+    if document_version:
+        for metadata in metadatas:
+            metadata["document_version"] = document_version
     
-    # Add chunks to collection
+    # Add chunks to collection with embeddings
     collection.add(
         documents=chunks,
+        embeddings=embeddings,
         ids=ids,
         metadatas=metadatas
     )
+    
+    # Keep a compact per-document matrix for exact in-process search
+    vector_store.write_document(document_id, ids, metadatas, embeddings)
 
 async def update_document_status(document_id: str, processed: bool) -> None:
     """Update document processing status in database."""
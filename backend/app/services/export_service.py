@@ -0,0 +1,192 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from sqlalchemy import select
+from app.database import SessionLocal
+from app.models.models import ESGMetric, QAInteraction
+
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Rows fetched from the cursor and encoded at a time
+EXPORT_BATCH_SIZE = 1000
+
+# Exported columns per dataset with their value kind: "string", "bool", "timestamp" or "json"
+EXPORT_COLUMNS: Dict[str, List[Tuple[str, str]]] = {
+    "metrics": [
+        ("id", "string"),
+        ("document_id", "string"),
+        ("category", "string"),
+        ("goal", "string"),
+        ("actual", "string"),
+        ("rag_status", "string"),
+        ("extracted_by", "string"),
+        ("created_at", "timestamp"),
+    ],
+    "qa": [
+        ("id", "string"),
+        ("user_id", "string"),
+        ("document_id", "string"),
+        ("session_id", "string"),
+        ("question", "string"),
+        ("answer", "string"),
+        ("citations", "json"),  # Chunk references, as stored
+        ("validated", "bool"),
+        ("created_at", "timestamp"),
+    ],
+}
+EXPORT_MODELS = {"metrics": ESGMetric, "qa": QAInteraction}
+
+def build_export_query(
+    dataset: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    category: Optional[str] = None,
+    validated_only: bool = False,
+    document_id: Optional[str] = None
+):
+    """
+    Build the export query for a dataset. The date range is half-open
+    (start inclusive, end exclusive); category applies to metrics and
+    validated_only to QA interactions.
+    """
+    if dataset not in EXPORT_MODELS:
+        raise ValueError(f"Unknown dataset: {dataset}. Expected one of {', '.join(EXPORT_MODELS)}")
+    if category is not None and dataset != "metrics":
+        raise ValueError("category filter only applies to metrics")
+    if validated_only and dataset != "qa":
+        raise ValueError("validated_only filter only applies to QA interactions")
+
+    model = EXPORT_MODELS[dataset]
+    query = select(*[getattr(model, name) for name, _ in EXPORT_COLUMNS[dataset]])
+
+    if start_date is not None:
+        query = query.where(model.created_at >= start_date)
+    if end_date is not None:
+        query = query.where(model.created_at < end_date)
+    if document_id is not None:
+        query = query.where(model.document_id == document_id)
+    if category is not None:
+        query = query.where(model.category == category)
+    if validated_only:
+        query = query.where(model.validated == True)
+
+    return query.order_by(model.created_at, model.id)
+
+def check_export_format(export_format: str) -> None:
+    """Raise ValueError for unknown formats or a missing optional dependency."""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format: {export_format}. Expected one of {', '.join(EXPORT_FORMATS)}")
+    if export_format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError("Parquet export requires pyarrow to be installed")
+
+async def stream_row_batches(query, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[Dict]]:
+    """
+    Yield query rows in batches from a streaming cursor, holding one batch in
+    memory at a time. The cursor keeps one read transaction open for the whole
+    export, which does not block writers because esg.db runs in WAL mode.
+    """
+    async with SessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=batch_size))
+        async for partition in result.partitions(batch_size):
+            yield [dict(row._mapping) for row in partition]
+
+def _text_value(value, kind: str):
+    """Flatten a value for formats without nested types."""
+    if value is None:
+        return None
+    if kind == "timestamp":
+        return value.isoformat()
+    if kind == "json":
+        return json.dumps(value)
+    return value
+
+async def encode_csv(columns, batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    yield buffer.getvalue().encode("utf-8")
+
+    async for rows in batches:
+        buffer.seek(0)
+        buffer.truncate(0)
+        for row in rows:
+            writer.writerow([_text_value(row[name], kind) for name, kind in columns])
+        yield buffer.getvalue().encode("utf-8")
+
+async def encode_jsonl(columns, batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    async for rows in batches:
+        lines = []
+        for row in rows:
+            record = {
+                name: row[name] if kind == "json" else _text_value(row[name], kind)
+                for name, kind in columns
+            }
+            lines.append(json.dumps(record) + "\n")
+        yield "".join(lines).encode("utf-8")
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands written bytes back to the caller while keeping the total offset."""
+
+    def __init__(self):
+        self.position = 0
+        self.chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+async def encode_parquet(columns, batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    """Write one Parquet row group per batch and yield the bytes as they are produced."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_types = {"string": pa.string(), "json": pa.string(), "bool": pa.bool_(), "timestamp": pa.timestamp("us")}
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in columns])
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    async for rows in batches:
+        arrays = [
+            pa.array([row[name] if kind in ("bool", "timestamp") else _text_value(row[name], kind) for row in rows], type=arrow_types[kind])
+            for name, kind in columns
+        ]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+ENCODERS = {"csv": encode_csv, "jsonl": encode_jsonl, "parquet": encode_parquet}
+
+def export_rows(dataset: str, export_format: str, batch_size: int = EXPORT_BATCH_SIZE, **filters) -> AsyncIterator[bytes]:
+    """
+    Stream a dataset export as encoded byte chunks in constant memory.
+    Filters are validated eagerly, so errors surface before any bytes are sent.
+    """
+    check_export_format(export_format)
+    query = build_export_query(dataset, **filters)
+    return ENCODERS[export_format](EXPORT_COLUMNS[dataset], stream_row_batches(query, batch_size))
+
+def export_filename(dataset: str, export_format: str) -> str:
+    return f"{dataset}-export-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{export_format}"
@@ -0,0 +1,165 @@
+import hashlib
+import json
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.config.chroma_config import BASE_DIR
+from app.utils.embedding_cache import load_cached_embeddings
+from app.utils.embeddings import get_embedding_model_name
+
+ROUTE_ESG_REPORT = "esg_report"
+ROUTE_QA = "qa"
+
+# Example questions for each route; their mean embedding is the route centroid
+ROUTE_EXEMPLARS = {
+    ROUTE_ESG_REPORT: [
+        "Generate an ESG report for this document",
+        "Create a sustainability report table covering all categories",
+        "Fill in the ESG table with targets, achievements and trends for each category",
+        "Summarize performance across water, energy, waste, GHG emissions and the other ESG categories",
+        "Produce a structured ESG scorecard for this report",
+        "Give me an overview table of all sustainability targets and progress",
+        "Build the 13-category ESG report",
+        "Compile the environmental, social and governance results into a report",
+    ],
+    ROUTE_QA: [
+        "What is the water consumption?",
+        "How much energy did the company use last year?",
+        "What are the scope 1 emissions?",
+        "What is the waste diversion rate?",
+        "Who is on the board of directors?",
+        "When does the company plan to reach net zero?",
+        "What percentage of leadership roles are held by women?",
+        "Does the company have a supplier code of conduct?",
+        "What was the total recordable injury rate?",
+        "How much was invested in community programs?",
+    ],
+}
+
+CENTROIDS_FILE = BASE_DIR / "chroma_data" / "intent_route_centroids.json"
+
+# Confidence thresholds per embedding model, written by
+# `python -m app.eval_intent_router --calibrate`. Below them the keyword rules
+# decide; without thresholds calibrated for the configured model and the
+# current exemplars, they decide every question.
+THRESHOLDS_FILE = BASE_DIR / "eval" / "intent_route_thresholds.json"
+
+_routes: List[str] = []
+_centroids: Optional[np.ndarray] = None
+_thresholds: Optional[Tuple[float, float]] = None
+
+def _exemplar_fingerprint() -> Dict:
+    return {"model": get_embedding_model_name(), "exemplars": ROUTE_EXEMPLARS}
+
+def exemplars_hash() -> str:
+    return hashlib.sha256(json.dumps(ROUTE_EXEMPLARS, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def load_route_thresholds() -> Optional[Tuple[float, float]]:
+    """Load the (min_similarity, min_margin) calibrated for the configured embedding model, if any."""
+    global _thresholds
+    _thresholds = None
+    if THRESHOLDS_FILE.exists():
+        with open(THRESHOLDS_FILE) as f:
+            entry = json.load(f).get(get_embedding_model_name())
+        if entry and entry.get("exemplars") == exemplars_hash():
+            _thresholds = (entry["min_similarity"], entry["min_margin"])
+    return _thresholds
+
+def load_route_centroids(build_if_missing: bool = True) -> bool:
+    """
+    Load route centroids from disk, building them from the exemplars if the
+    cache is missing or stale. Called once at startup so routing a question
+    never needs a network call. Also loads the calibrated thresholds.
+    """
+    global _routes, _centroids
+    if load_route_thresholds() is None:
+        print(f"Intent router is not calibrated for {get_embedding_model_name()}, using keyword routing")
+
+    if CENTROIDS_FILE.exists():
+        with open(CENTROIDS_FILE) as f:
+            data = json.load(f)
+        if data.get("fingerprint") == _exemplar_fingerprint():
+            _routes = list(data["centroids"].keys())
+            _centroids = np.array([data["centroids"][route] for route in _routes], dtype=np.float32)
+            return True
+
+    if not build_if_missing:
+        return False
+
+    try:
+        centroids = build_route_centroids()
+    except Exception as e:
+        print(f"Error building intent route centroids, using keyword routing: {str(e)}")
+        return False
+
+    CENTROIDS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(CENTROIDS_FILE, "w") as f:
+        json.dump({"fingerprint": _exemplar_fingerprint(), "centroids": centroids}, f)
+
+    _routes = list(centroids.keys())
+    _centroids = np.array([centroids[route] for route in _routes], dtype=np.float32)
+    return True
+
+def build_route_centroids() -> Dict[str, List[float]]:
+    """Embed all exemplars in one batch and average them per route."""
+    texts = [text for exemplars in ROUTE_EXEMPLARS.values() for text in exemplars]
+    embeddings = np.array(load_cached_embeddings("intent_route_exemplars", texts), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    centroids = {}
+    offset = 0
+    for route, exemplars in ROUTE_EXEMPLARS.items():
+        centroid = embeddings[offset:offset + len(exemplars)].mean(axis=0)
+        centroids[route] = (centroid / np.linalg.norm(centroid)).tolist()
+        offset += len(exemplars)
+    return centroids
+
+def closest_route(question_embedding: List[float]) -> Tuple[str, float, float]:
+    """Return the route whose centroid is closest, its similarity and its margin over the runner-up."""
+    query = np.asarray(question_embedding, dtype=np.float32)
+    query /= np.linalg.norm(query)
+    similarities = _centroids @ query
+    ranked = np.argsort(similarities)[::-1]
+    best = float(similarities[ranked[0]])
+    runner_up = float(similarities[ranked[1]]) if len(ranked) > 1 else -1.0
+    return _routes[ranked[0]], best, best - runner_up
+
+def route_question(question: str, question_embedding: Optional[List[float]] = None) -> str:
+    """
+    Route a question using the embedding already computed for retrieval.
+    Falls back to keyword rules when centroids or calibrated thresholds are
+    unavailable, or the router is not confident.
+    """
+    if _centroids is not None and _thresholds is not None and question_embedding is not None:
+        route, similarity, margin = closest_route(question_embedding)
+        min_similarity, min_margin = _thresholds
+        if similarity >= min_similarity and margin >= min_margin:
+            return route
+
+    return ROUTE_ESG_REPORT if is_esg_report_generation_query(question) else ROUTE_QA
+
+def is_esg_report_generation_query(question: str) -> bool:
+    """
+    Keyword fallback for routing. Only explicit report phrasing, or a question
+    spanning several ESG categories, goes to the report route; a question about
+    a single topic such as water or energy is answered directly.
+    """
+    # Convert to lowercase for case-insensitive matching
+    q_lower = question.lower()
+
+    # Check for ESG report generation indicators
+    report_keywords = [
+        "esg report",
+        "sustainability report",
+        "generate table",
+        "create table",
+    ]
+
+    # Check if the query mentions multiple ESG categories
+    categories_count = sum(1 for keyword in [
+        "sustainable materials", "water", "energy", "waste", "land use",
+        "ghg emissions", "transportation", "design", "supply chain",
+        "health", "inclusion", "social responsibility", "stakeholder"
+    ] if keyword in q_lower)
+
+    # Return true if multiple report keywords or categories are found
+    return any(keyword in q_lower for keyword in report_keywords) or categories_count >= 3
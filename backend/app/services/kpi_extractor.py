@@ -0,0 +1,180 @@
+import re
+from typing import Dict, List, Optional
+from app.database import get_db
+from app.models.models import Document, KPIValue
+from sqlalchemy import delete
+
+# Version tag for documents uploaded before content hashes were stored
+UNVERSIONED = "unversioned"
+
+# Units recognised after a number, mapped to (canonical unit, multiplier)
+UNIT_ALIASES = [
+    (r"mt\s?co[2₂]e?", ("tCO2e", 1_000_000)),
+    (r"kt\s?co[2₂]e?", ("tCO2e", 1_000)),
+    (r"t\s?co[2₂]e?", ("tCO2e", 1)),
+    (r"(?:metric\s+)?(?:tonnes|tons)\s+(?:of\s+)?co[2₂]e?", ("tCO2e", 1)),
+    (r"gwh", ("MWh", 1_000)),
+    (r"mwh", ("MWh", 1)),
+    (r"kwh", ("MWh", 0.001)),
+    (r"megalit(?:re|er)s", ("m³", 1_000)),
+    (r"ml", ("m³", 1_000)),
+    (r"m³|m3|cubic\s+met(?:re|er)s", ("m³", 1)),
+    (r"%|percent", ("%", 1)),
+    (r"years?", ("years", 1)),
+]
+
+NUMBER_WITH_UNIT = re.compile(
+    r"(?<![\w.])(?P<number>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)\s?(?P<unit>"
+    + "|".join(f"(?:{pattern})" for pattern, _ in UNIT_ALIASES)
+    + r")(?!\w)",
+    re.IGNORECASE
+)
+
+# Metric name, ESG category, and the keywords identifying it in a sentence
+METRICS = [
+    ("GHG emissions", "Environmental", ["emission", "carbon", "co2", "ghg", "scope 1", "scope 2", "scope 3", "net zero"]),
+    ("Energy", "Environmental", ["energy", "electricity", "renewable"]),
+    ("Water", "Environmental", ["water"]),
+    ("Waste", "Environmental", ["waste", "landfill", "recycl"]),
+    ("Diversity", "Social", ["women", "female", "gender", "divers", "inclusion", "minorit"]),
+    ("Health & Safety", "Social", ["injur", "safety", "incident", "fatalit"]),
+    ("Workforce", "Social", ["employee", "training", "turnover", "engagement"]),
+    ("Board & Ethics", "Governance", ["board", "independent", "director", "ethic", "compliance", "audit"]),
+]
+
+# Absolute units always belong to the same metric, whatever the sentence says
+UNIT_METRICS = {"tCO2e": "GHG emissions", "MWh": "Energy", "m³": "Water"}
+
+TARGET_PATTERN = re.compile(r"\b(target|goal|aim|ambition|commit|pledge|plan(?:s|ned)? to|aspire|by 20\d\d)", re.IGNORECASE)
+TARGET_YEAR_PREFIX = re.compile(r"\bby\s+$", re.IGNORECASE)
+YEAR_PATTERN = re.compile(r"\b(19\d\d|20\d\d)\b")
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?;])\s+|\n+")
+
+def normalize_unit(raw_unit: str):
+    for pattern, canonical in UNIT_ALIASES:
+        if re.fullmatch(pattern, raw_unit, re.IGNORECASE):
+            return canonical
+    return None
+
+def classify_metric(sentence: str, unit: str) -> Optional[tuple]:
+    """Return (metric, category) for a value, or None if the sentence is not about a known KPI."""
+    if unit in UNIT_METRICS:
+        metric = UNIT_METRICS[unit]
+        return metric, next(category for name, category, _ in METRICS if name == metric)
+
+    s_lower = sentence.lower()
+    for metric, category, keywords in METRICS:
+        if any(keyword in s_lower for keyword in keywords):
+            return metric, category
+    return None
+
+def _words_between(text: str, start: int, end: int) -> int:
+    return len(re.findall(r"\w+", text[start:end]))
+
+def bind_years(sentence: str, matches: List[re.Match]) -> List[Optional[int]]:
+    """
+    Return the year each value in a sentence refers to. Every year mention
+    binds to the closest value before or after it in words, ties and "by
+    <year>" targets going to the value before; a value takes the year bound
+    to it ("by" years first), else the nearest year in the sentence.
+    """
+    spans = [(match.start(), match.end()) for match in matches]
+    years = [
+        year for year in YEAR_PATTERN.finditer(sentence)
+        if not any(start < year.end() and year.start() < end for start, end in spans)
+    ]
+
+    bound: List[List[tuple]] = [[] for _ in matches]
+    for year in years:
+        is_target_year = bool(TARGET_YEAR_PREFIX.search(sentence[:year.start()]))
+        before = [i for i, (_, end) in enumerate(spans) if end <= year.start()]
+        after = [i for i, (start, _) in enumerate(spans) if start >= year.end()]
+        candidates = []
+        if before:
+            candidates.append((_words_between(sentence, spans[before[-1]][1], year.start()), 0, before[-1]))
+        if after and not (is_target_year and before):
+            candidates.append((_words_between(sentence, year.end(), spans[after[0]][0]), 1, after[0]))
+        if candidates:
+            gap, _, index = min(candidates)
+            bound[index].append((not is_target_year, gap, int(year.group(1))))
+
+    result = []
+    for (start, end), values in zip(spans, bound):
+        if values:
+            result.append(min(values)[2])
+        elif years:
+            nearest = min(years, key=lambda year: min(abs(year.start() - end), abs(start - year.end())))
+            result.append(int(nearest.group(1)))
+        else:
+            result.append(None)
+    return result
+
+def extract_kpis(text: str, chunk_index: Optional[int] = None) -> List[Dict]:
+    """
+    Parse numeric KPI values with units from text, classifying each one as
+    a target or an actual and attaching the year it refers to.
+    """
+    kpis = []
+    # A percentage target like "our goal is 50% by 2025" refers to the metric of the sentence before it
+    previous_metric = None
+    for sentence in SENTENCE_SPLIT.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+
+        matches = list(NUMBER_WITH_UNIT.finditer(sentence))
+        if not matches:
+            previous_metric = None
+            continue
+
+        is_target = bool(TARGET_PATTERN.search(sentence))
+        years = bind_years(sentence, matches)
+
+        current_metric = None
+        for match, year in zip(matches, years):
+            normalized = normalize_unit(match.group("unit"))
+            if normalized is None:
+                continue
+            unit, multiplier = normalized
+
+            classified = classify_metric(sentence, unit)
+            if classified is None and is_target and unit == "%":
+                classified = previous_metric
+            if classified is None:
+                continue
+            metric, category = classified
+            current_metric = classified
+
+            value = float(match.group("number").replace(",", "")) * multiplier
+            kpis.append({
+                "chunk_index": chunk_index,
+                "category": category,
+                "metric": metric,
+                "kind": "target" if is_target else "actual",
+                "value": value,
+                "unit": unit,
+                "year": year,
+                "context": sentence[:500]
+            })
+        previous_metric = current_metric
+    return kpis
+
+async def index_document_kpis(document_id: str, chunks: List[str], document_version: Optional[str] = None) -> int:
+    """
+    Extract KPIs from every chunk of a document and replace the document's
+    rows in the kpi_values table, recording the indexed document version.
+    Returns the number of values indexed.
+    """
+    rows = []
+    for i, chunk in enumerate(chunks):
+        rows.extend(extract_kpis(chunk, chunk_index=i))
+
+    async for db in get_db():
+        await db.execute(delete(KPIValue).where(KPIValue.document_id == document_id))
+        db.add_all([KPIValue(document_id=document_id, **row) for row in rows])
+        document = await db.get(Document, document_id)
+        if document is not None:
+            document.kpis_indexed_version = document_version or document.content_hash or UNVERSIONED
+        await db.commit()
+
+    return len(rows)
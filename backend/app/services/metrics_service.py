@@ -1,76 +1,239 @@
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Optional
 import os
 from pathlib import Path
 import json
-from app.utils.chroma_client import get_chroma_client, get_or_create_collection
-from app.utils.openai_client import get_openai_client
+import numpy as np
+from sqlalchemy import select
+from app.database import get_db
+from app.models.models import Document, ESGMetric, KPIValue
+from app.services.kpi_extractor import UNVERSIONED, index_document_kpis
+from app.services.retrieval import query_document_chunks
+from app.services.write_behind import write_queue
+from app.services.rollup_service import rollup_key
+from app.utils.chroma_client import get_chroma_client, get_chunk_collection
+from app.utils.llm_usage import create_chat_completion
+from app.utils.embeddings import embed_texts
+from app.utils.single_flight import single_flight
 
 # Initialize ChromaDB using the utility function
 chroma_client = get_chroma_client()
 
-# Create or get collection
-collection = get_or_create_collection(name="document_chunks")
+# Create or get the chunk collection for the configured embedding model
+collection = get_chunk_collection()
+
+# Units of absolute quantities where coming in under the target is the goal
+LOWER_IS_BETTER_UNITS = {"tCO2e", "MWh", "m³"}
+
+ESG_CATEGORIES = ["Environmental", "Social", "Governance"]
+RAG_STATUSES = ("Green", "Amber", "Red")
 
 async def extract_metrics_from_document(document_id: str) -> List[Dict]:
     """
-    Extract ESG metrics from document using LLM.
-    This implementation uses OpenAI to extract structured metrics data.
+    Extract ESG metrics for a document.
+    Metrics are computed from the numeric KPI index built at ingestion, without
+    an LLM round trip; the LLM is only asked about categories the index does not cover.
     """
     try:
-        # Query ChromaDB for document chunks
-        results = collection.query(
-            query_texts=["ESG metrics, goals, targets, achievements"],
-            n_results=8,  # Increased to capture more relevant data
-            where={"document_id": document_id}
-        )
-        
-        if not results["documents"] or len(results["documents"][0]) == 0:
-            return []
-        
-        # Combine relevant chunks
-        context = "\n".join(results["documents"][0])
-        
-        # Get OpenAI client
-        openai_client = get_openai_client()
-        
-        # Create a structured prompt for metrics extraction
-        system_prompt = """You are an ESG data analyst extracting key metrics from ESG reports.
-        For each of the following categories, identify specific targets, current achievements, and determine status.
-        
-        Categories to extract:
-        - Environmental (carbon emissions, waste reduction, etc.)
-        - Social (diversity, employee wellbeing, community impact)
-        - Governance (business ethics, board composition, compliance)
-        
-        Format your response as a JSON array with each metric having these fields:
-        - category: The ESG category (Environmental, Social, or Governance)
-        - goal: The target or goal mentioned
-        - actual: The current achievement or status
-        - rag_status: One of "On Track", "Needs Attention", or "At Risk"
-        """
-        
-        # Call OpenAI to extract metrics using the latest approach
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Extract ESG metrics from the following text:\n\n{context}"}
-            ],
-            temperature=0.1,
-            max_tokens=1000,
-            response_format={"type": "json_object"}
-        )
-        
-        # Extract and parse the response
-        response_text = response.choices[0].message.content.strip()
-        metrics = parse_metrics_response(response_text)
-        
+        kpis = await get_indexed_kpis(document_id)
+        metrics = compute_kpi_metrics(kpis)
+
+        covered = {metric["category"] for metric in metrics}
+        missing_categories = [category for category in ESG_CATEGORIES if category not in covered]
+        if missing_categories:
+            metrics.extend(await asyncio.to_thread(extract_metrics_with_llm, document_id, missing_categories))
+
         return metrics
-        
+
     except Exception as e:
         print(f"Error extracting metrics: {str(e)}")
         return []
 
+async def extract_and_store_metrics(document_id: str) -> List[Dict]:
+    """
+    Extract metrics for a document and store them with their rollup counts.
+    Concurrent calls for the same document, in this or another worker, share
+    one extraction and insert the metrics only once.
+    """
+    return await single_flight(
+        f"extract_metrics:{document_id}",
+        lambda: _extract_and_store_metrics(document_id)
+    )
+
+async def _extract_and_store_metrics(document_id: str) -> List[Dict]:
+    extracted = await extract_metrics_from_document(document_id)
+
+    # Rows that would violate esg_metrics constraints are dropped here rather than failing the flush
+    metrics = [metric for metric in map(normalize_metric, extracted) if metric is not None]
+    if len(metrics) < len(extracted):
+        print(f"Dropped {len(extracted) - len(metrics)} metrics with empty fields for document {document_id}")
+
+    # Queue the metrics for a batched insert; their rollup counts commit in the same flush
+    rows = write_queue.enqueue(
+        ESGMetric,
+        [
+            {
+                "document_id": document_id,
+                "category": metric["category"],
+                "goal": metric["goal"],
+                "actual": metric["actual"],
+                "rag_status": metric["rag_status"],
+                "extracted_by": metric.get("extracted_by", "LLM")
+            }
+            for metric in metrics
+        ],
+        rollup_deltas=[(rollup_key(metric["category"], metric["rag_status"], document_id), 1) for metric in metrics]
+    )
+
+    for metric, row in zip(metrics, rows):
+        metric["id"] = row["id"]
+    return metrics
+
+async def get_indexed_kpis(document_id: str) -> List[KPIValue]:
+    """
+    Load a document's KPI rows, indexing its stored chunks first if the
+    current version has never been indexed. Documents indexed without any
+    KPIs are not re-scanned.
+    """
+    async for db in get_db():
+        result = await db.execute(select(KPIValue).where(KPIValue.document_id == document_id))
+        kpis = result.scalars().all()
+        if kpis:
+            return kpis
+        document = await db.get(Document, document_id)
+        if document is None:
+            return []
+        document_version = document.content_hash or UNVERSIONED
+        if document.kpis_indexed_version == document_version:
+            return []
+
+    stored = await asyncio.to_thread(
+        collection.get,
+        where={"document_id": document_id},
+        include=["documents", "metadatas"]
+    )
+    if not stored["documents"]:
+        return []
+
+    ordered = sorted(
+        zip(stored["documents"], stored["metadatas"]),
+        key=lambda item: item[1].get("chunk_index", 0)
+    )
+    if await index_document_kpis(document_id, [text for text, _ in ordered], document_version=document_version) == 0:
+        return []
+
+    async for db in get_db():
+        result = await db.execute(select(KPIValue).where(KPIValue.document_id == document_id))
+        return result.scalars().all()
+    return []
+
+def compute_kpi_metrics(kpis: List[KPIValue]) -> List[Dict]:
+    """
+    Pair the latest target and actual of each indexed KPI and compute all
+    RAG statuses in a single vectorized pass.
+    """
+    targets = {}
+    actuals = {}
+    for kpi in kpis:
+        key = (kpi.category, kpi.metric, kpi.unit)
+        latest = targets if kpi.kind == "target" else actuals
+        if key not in latest or (kpi.year or 0) >= (latest[key].year or 0):
+            latest[key] = kpi
+
+    keys = [key for key in targets if key in actuals]
+    if not keys:
+        return []
+
+    goals = np.array([targets[key].value for key in keys], dtype=float)
+    achieved = np.array([actuals[key].value for key in keys], dtype=float)
+    lower_is_better = np.array([key[2] in LOWER_IS_BETTER_UNITS for key in keys])
+    statuses = calculate_rag_statuses(goals, achieved, lower_is_better)
+
+    metrics = []
+    for key, rag_status in zip(keys, statuses):
+        category, metric, _ = key
+        metrics.append({
+            "category": category,
+            "goal": f"{metric}: {format_kpi(targets[key], 'by')}",
+            "actual": format_kpi(actuals[key], "in"),
+            "rag_status": rag_status,
+            "extracted_by": "KPI Index"
+        })
+    return metrics
+
+def format_kpi(kpi: KPIValue, year_preposition: str) -> str:
+    separator = "" if kpi.unit == "%" else " "
+    text = f"{kpi.value:,.6g}{separator}{kpi.unit}"
+    if kpi.year:
+        text += f" {year_preposition} {kpi.year}"
+    return text
+
+def extract_metrics_with_llm(document_id: str, categories: List[str]) -> List[Dict]:
+    """Use the LLM to extract metrics for the given categories only."""
+    query_embedding = embed_texts([f"ESG metrics, goals, targets, achievements for {', '.join(categories)}"])[0]
+
+    # Query the configured vector backend for document chunks
+    results = query_document_chunks(
+        document_id,
+        query_embedding,
+        n_results=8  # Increased to capture more relevant data
+    )
+
+    if not results["documents"] or len(results["documents"][0]) == 0:
+        return []
+
+    # Combine relevant chunks
+    context = "\n".join(results["documents"][0])
+
+    # Create a structured prompt for metrics extraction
+    system_prompt = f"""You are an ESG data analyst extracting key metrics from ESG reports.
+    For each of the following categories, identify specific targets, current achievements, and determine status.
+    
+    Categories to extract: {", ".join(categories)}
+    
+    Format your response as a JSON array with each metric having these fields:
+    - category: The ESG category ({" or ".join(categories)})
+    - goal: The target or goal mentioned
+    - actual: The current achievement or status
+    - rag_status: One of "Green", "Amber", or "Red"
+    """
+
+    # Call OpenAI to extract metrics using the latest approach
+    response = create_chat_completion(
+        route="metrics_extraction",
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Extract ESG metrics from the following text:\n\n{context}"}
+        ],
+        temperature=0.1,
+        max_tokens=1000,
+        response_format={"type": "json_object"}
+    )
+
+    # Extract and parse the response
+    response_text = response.choices[0].message.content.strip()
+    metrics = parse_metrics_response(response_text)
+    for metric in metrics:
+        metric["extracted_by"] = "LLM"
+    return metrics
+
+def normalize_metric(metric: Dict) -> Optional[Dict]:
+    """
+    Return the metric with its required fields as stripped strings and
+    rag_status as Green, Amber or Red (Amber if unrecognised), or None if a
+    required field is missing or empty.
+    """
+    values = {field: metric.get(field) for field in ("category", "goal", "actual", "rag_status")}
+    if any(value is None or not str(value).strip() for value in values.values()):
+        return None
+
+    normalized = {**metric, **{field: str(value).strip() for field, value in values.items()}}
+    normalized["rag_status"] = normalized["rag_status"].capitalize()
+    if normalized["rag_status"] not in RAG_STATUSES:
+        normalized["rag_status"] = "Amber"
+    return normalized
+
 def parse_metrics_response(response: str) -> List[Dict]:
     """Parse metrics from LLM response."""
     try:
@@ -92,60 +255,49 @@ def parse_metrics_response(response: str) -> List[Dict]:
         validated_metrics = []
         for metric in metrics:
             if isinstance(metric, dict):
-                # Ensure all required fields are present
-                required_fields = ["category", "goal", "actual", "rag_status"]
-                if all(field in metric for field in required_fields):
-                    validated_metrics.append(metric)
-                else:
-                    # Try to fix metrics with missing fields
-                    fixed_metric = {
-                        "category": metric.get("category", "Other"),
-                        "goal": metric.get("goal", "Not specified"),
-                        "actual": metric.get("actual", "Not available"),
-                        "rag_status": metric.get("rag_status", "Needs Attention")
-                    }
-                    validated_metrics.append(fixed_metric)
+                # Fill in missing fields, but drop entries whose fields are present and empty:
+                # esg_metrics columns are NOT NULL and a null row would fail the whole insert
+                fixed_metric = normalize_metric({
+                    "category": metric.get("category", "Other"),
+                    "goal": metric.get("goal", "Not specified"),
+                    "actual": metric.get("actual", "Not available"),
+                    "rag_status": metric.get("rag_status", "Amber")
+                })
+                if fixed_metric is None:
+                    print(f"Dropping metric with empty fields: {metric}")
+                    continue
+                validated_metrics.append(fixed_metric)
         
-        return validated_metrics if validated_metrics else get_default_metrics()
+        return validated_metrics
     
     except Exception as e:
         print(f"Error parsing metrics response: {str(e)}")
-        return get_default_metrics()
-
-def get_default_metrics() -> List[Dict]:
-    """Return default metrics if extraction fails."""
-    return [
-        {
-            "category": "Environmental",
-            "goal": "Reduce carbon emissions by 50% by 2030",
-            "actual": "Reduced by 25% in 2023",
-            "rag_status": "On Track"
-        },
-        {
-            "category": "Social",
-            "goal": "Achieve 50% female representation in leadership by 2025",
-            "actual": "Currently at 35%",
-            "rag_status": "Needs Attention"
-        },
-        {
-            "category": "Governance",
-            "goal": "Implement ESG reporting framework by 2024",
-            "actual": "Framework developed, implementation in progress",
-            "rag_status": "On Track"
-        }
-    ]
+        return []
 
 def calculate_rag_status(goal: float, actual: float) -> str:
     """Calculate RAG status based on achievement percentage."""
     try:
-        percentage = (actual / goal) * 100
-        
-        if percentage < 50:
-            return "Red"
-        elif percentage < 80:
-            return "Amber"
-        else:
-            return "Green"
+        return calculate_rag_statuses(np.array([goal], dtype=float), np.array([actual], dtype=float))[0]
     
     except Exception:
-        return "Red"  # Default to Red if calculation fails 
\ No newline at end of file
+        return "Red"  # Default to Red if calculation fails
+
+def calculate_rag_statuses(goals: np.ndarray, actuals: np.ndarray, lower_is_better: Optional[np.ndarray] = None) -> List[str]:
+    """
+    Vectorized RAG status: below 50% of goal is Red, below 80% Amber, otherwise Green.
+    For lower-is-better KPIs (absolute emissions, energy, water) achievement is goal / actual,
+    and an actual of zero meets any goal. Invalid ratios (missing values, zero goals) are Red.
+    """
+    if lower_is_better is None:
+        lower_is_better = np.zeros(len(goals), dtype=bool)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percentage = np.where(lower_is_better, goals / actuals, actuals / goals) * 100
+    percentage = np.where(lower_is_better & (actuals == 0) & (goals >= 0), 100, percentage)
+
+    statuses = np.select(
+        [~np.isfinite(percentage) | (percentage < 50), percentage < 80],
+        ["Red", "Amber"],
+        default="Green"
+    )
+    return statuses.tolist()
@@ -1,47 +1,86 @@
+import asyncio
 import os
 from typing import Tuple, List, Dict, Optional
 import json
 import re
+import hashlib
 from pathlib import Path
-from app.utils.chroma_client import get_chroma_client, get_or_create_collection
-from app.utils.openai_client import get_openai_client
+from app.utils.chroma_client import get_chroma_client, get_chunk_collection
+from app.utils.llm_usage import create_chat_completion, record_usage
+from app.utils.embeddings import aembed_texts
+from app.utils.single_flight import single_flight
+from app.services.report_service import generate_esg_report
+from app.services.citation_service import citations_from_results
+from app.services.retrieval import query_document_chunks
+from app.services.intent_router import ROUTE_ESG_REPORT, route_question, is_esg_report_generation_query
 
 # Initialize ChromaDB using the utility function
 chroma_client = get_chroma_client()
 
-# Create or get collection
-collection = get_or_create_collection(name="document_chunks")
+# Create or get the chunk collection for the configured embedding model
+collection = get_chunk_collection()
 
-async def get_answer_from_llm(document_id: str, question: str) -> Tuple[str, Optional[List[Dict]]]:
+async def get_answer_from_llm(
+    document_id: str,
+    question: str,
+    retrieval_query: Optional[str] = None,
+    conversation_context: Optional[str] = None
+) -> Tuple[str, Optional[List[Dict]]]:
     """
     Get answer from OpenAI's LLM based on document content and question.
-    Uses Retrieval Augmented Generation (RAG) with ChromaDB and OpenAI.
+    Concurrent requests asking the same question about the same document
+    share a single embedding, retrieval and LLM computation. Answers in a
+    conversation depend on its history, so they are keyed on the context and
+    retrieval query they were generated from; opening questions, which have
+    neither, coalesce across sessions.
+    """
+    question_hash = hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+    context_hash = "-"
+    if conversation_context or (retrieval_query and retrieval_query != question):
+        context_hash = hashlib.sha256(json.dumps([conversation_context, retrieval_query]).encode("utf-8")).hexdigest()
+    led = False
+
+    async def compute():
+        nonlocal led
+        led = True
+        return await answer_question(document_id, question, retrieval_query, conversation_context)
+
+    answer = await single_flight(f"qa:{document_id}:{context_hash}:{question_hash}", compute, decode=tuple)
+    if not led:
+        # Served from another caller's computation; recorded so hit rates show in the ledger
+        record_usage("gpt-4o", "chat", cache_status="coalesced", route="qa")
+    return answer
+
+def normalize_question(question: str) -> str:
+    """Collapse case and whitespace so trivially different phrasings coalesce."""
+    return " ".join(question.lower().split())
+
+async def answer_question(
+    document_id: str,
+    question: str,
+    retrieval_query: Optional[str] = None,
+    conversation_context: Optional[str] = None
+) -> Tuple[str, Optional[List[Dict]]]:
+    """
+    Answer a question using Retrieval Augmented Generation (RAG) with ChromaDB and OpenAI.
     Handles ESG report generation with specific formatting for tables.
+    Follow-ups are retrieved with their standalone rewrite and answered with
+    the bounded conversation context.
     """
     try:
-        openai_client = get_openai_client()
+        retrieval_query = retrieval_query or question
         
-        # First, create embedding for the question using the latest approach
-        embedding_response = openai_client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=question
-        )
-        question_embedding = embedding_response.data[0].embedding
+        # First, create embedding for the retrieval query with the configured provider
+        question_embedding = (await aembed_texts([retrieval_query]))[0]
         
-        # Query ChromaDB for relevant chunks using embedding
-        results = collection.query(
-            query_embeddings=[question_embedding],
-            n_results=5,  # Increased for ESG report generation
-            where={"document_id": document_id}
-        )
+        # ESG report requests are served by the report engine, which runs its
+        # own per-category retrieval and materializes the result per document version
+        if route_question(retrieval_query, question_embedding) == ROUTE_ESG_REPORT:
+            return await generate_esg_report(document_id)
         
-        # If no results with embeddings, fallback to text query
-        if not results["documents"] or len(results["documents"][0]) == 0:
-            results = collection.query(
-                query_texts=[question],
-                n_results=5,  # Increased for ESG report generation
-                where={"document_id": document_id}
-            )
+        # Query the configured vector backend off the event loop: the first query
+        # for a document may build its exact index from ChromaDB
+        results = await asyncio.to_thread(query_document_chunks, document_id, question_embedding, n_results=5)
         
         if not results["documents"] or len(results["documents"][0]) == 0:
             return "I couldn't find any relevant information in the document to answer your question.", []
@@ -49,83 +88,34 @@ async def get_answer_from_llm(document_id: str, question: str) -> Tuple[str, Opt
         # Combine relevant chunks for context
         context = "\n".join(results["documents"][0])
         
-        # Check if this is an ESG report generation query
-        is_esg_report_query = is_esg_report_generation_query(question)
+        # Regular question answering prompt
+        system_prompt = """You are an AI assistant for question answering on ESG (Environmental, Social, and Governance) documents. 
+        Use the provided document excerpts to answer the user's question. 
+        If the answer cannot be found in the excerpts, say "I don't have enough information to answer this question."
+        Provide specific answers with direct references to the document where possible."""
         
-        if is_esg_report_query:
-            # Use specialized prompt for ESG report generation
-            system_prompt = """You are an ESG report specialist tasked with generating a structured report from document content.
-
-Objective: Carefully analyze the provided ESG document to identify specific targets, achievements, and trends for each of the 13 categories listed below. Fill in the table with the extracted information, ensuring that all categories are addressed.
-
-Instructions:
-1. Carefully read the data, focusing on sections that discuss the following categories:
-   - Sustainable Materials
-   - Water
-   - Energy
-   - Waste & Effluent
-   - Land Use/Animal Stewardship
-   - GHG Emissions
-   - Transportation
-   - Design & Operation
-   - Supply Chain Compliance
-   - Health & Wellbeing
-   - Inclusion
-   - Social Responsibility
-   - Stakeholder Engagement
-
-2. Assess Trends:
-   Evaluate and record the trend for each category as IMPROVED, SAME, or WORSENED.
-
-3. Compile Data into a Structured Markdown Table:
-   Organize the information into the required table format with columns for Category, Target/Goal, Achievement, and Trend.
-
-4. Verification:
-   Cross-check the information for accuracy against the document content provided.
-
-5. Do not leave any category empty. If information is not available for a category, indicate "No data available" in the corresponding cells.
-
-6. Format the table as a standard markdown table that will render properly on all platforms.
-"""
-            
-            # Call OpenAI with specialized prompt for ESG report using the latest approach
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Document content:\n{context}\n\nGenerate a comprehensive ESG report using the information from this document, following the format in the instructions."}
-                ],
-                temperature=0.2,
-                max_tokens=2000  # Increased for longer table responses
-            )
-        else:
-            # Regular question answering prompt
-            system_prompt = """You are an AI assistant for question answering on ESG (Environmental, Social, and Governance) documents. 
-            Use the provided document excerpts to answer the user's question. 
-            If the answer cannot be found in the excerpts, say "I don't have enough information to answer this question."
-            Provide specific answers with direct references to the document where possible."""
-            
-            # Call OpenAI to generate answer using the latest approach
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",  # Or gpt-3.5-turbo depending on your needs
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Document excerpts:\n{context}\n\nQuestion: {question}"}
-                ],
-                temperature=0.3,
-                max_tokens=500
-            )
+        user_prompt = f"Document excerpts:\n{context}\n\nQuestion: {question}"
+        if conversation_context:
+            user_prompt = f"Conversation so far:\n{conversation_context}\n\n{user_prompt}"
+        
+        # Call OpenAI off the event loop so queued requests keep being admitted
+        response = await asyncio.to_thread(
+            create_chat_completion,
+            route="qa",
+            model="gpt-4o",  # Or gpt-3.5-turbo depending on your needs
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.3,
+            max_tokens=500
+        )
         
         # Extract answer
         answer = response.choices[0].message.content.strip()
         
-        # Format citations
-        citations = []
-        for i, (text, metadata) in enumerate(zip(results["documents"][0], results["metadatas"][0])):
-            citations.append({
-                "text": text,
-                "chunk_index": metadata.get("chunk_index", i)
-            })
+        # Format citations as chunk references plus the chunk text for this response
+        citations = citations_from_results(document_id, results)
         
         return answer, citations
         
@@ -133,38 +123,6 @@ Instructions:
         print(f"Error getting answer from LLM: {str(e)}")
         return f"Sorry, I couldn't process your question at this time. Error: {str(e)}", []
 
-def is_esg_report_generation_query(question: str) -> bool:
-    """
-    Determine if a question is asking for ESG report generation.
-    Looks for keywords and phrases related to ESG reporting.
-    """
-    # Convert to lowercase for case-insensitive matching
-    q_lower = question.lower()
-    
-    # Check for ESG report generation indicators
-    report_keywords = [
-        "esg report", 
-        "sustainability report", 
-        "generate table", 
-        "create table", 
-        "categories",
-        "sustainable materials",
-        "water",
-        "energy",
-        "waste",
-        "ghg emissions"
-    ]
-    
-    # Check if the query mentions multiple ESG categories
-    categories_count = sum(1 for keyword in [
-        "sustainable materials", "water", "energy", "waste", "land use", 
-        "ghg emissions", "transportation", "design", "supply chain",
-        "health", "inclusion", "social responsibility", "stakeholder"
-    ] if keyword in q_lower)
-    
-    # Return true if multiple report keywords or categories are found
-    return any(keyword in q_lower for keyword in report_keywords) or categories_count >= 3
-
 def format_citations(citations: List[Dict]) -> List[Dict]:
     """Format citations for frontend display."""
     return [
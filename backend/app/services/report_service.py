@@ -0,0 +1,255 @@
+import asyncio
+import json
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from app.database import get_db
+from app.models.models import Document, ESGReport
+from sqlalchemy import select
+from app.utils.embedding_cache import load_cached_embeddings
+from app.utils.llm_usage import create_chat_completion, record_usage, usage_route
+from app.services.citation_service import citations_from_results, hydrate_citations, to_citation_refs
+from app.services.retrieval import query_document_chunks
+
+# The 13 report categories and the retrieval query used for each of them
+ESG_REPORT_CATEGORIES = [
+    ("Sustainable Materials", "sustainable materials, recycled and renewable material sourcing targets"),
+    ("Water", "water consumption, withdrawal, recycling and water reduction targets"),
+    ("Energy", "energy consumption, renewable energy share and energy efficiency targets"),
+    ("Waste & Effluent", "waste generation, landfill diversion, recycling rates and effluent discharge"),
+    ("Land Use/Animal Stewardship", "land use, biodiversity, habitat protection and animal welfare"),
+    ("GHG Emissions", "greenhouse gas emissions, scope 1 2 3, carbon reduction and net zero targets"),
+    ("Transportation", "transportation, logistics, fleet emissions and business travel"),
+    ("Design & Operation", "building design, operations, green certifications and facility efficiency"),
+    ("Supply Chain Compliance", "supplier code of conduct, supply chain audits and compliance"),
+    ("Health & Wellbeing", "employee health, safety, injury rates and wellbeing programs"),
+    ("Inclusion", "diversity, equity and inclusion, gender representation and pay equity"),
+    ("Social Responsibility", "community investment, volunteering, philanthropy and human rights"),
+    ("Stakeholder Engagement", "stakeholder engagement, materiality assessment and investor dialogue"),
+]
+
+# Chunks retrieved per category and number of category sections generated at once
+CHUNKS_PER_CATEGORY = 3
+REPORT_CONCURRENCY = 6
+
+NO_DATA = "No data available"
+# Shown for sections whose generation failed; such reports are not materialized
+SECTION_UNAVAILABLE = "Temporarily unavailable"
+VALID_TRENDS = {"IMPROVED", "SAME", "WORSENED"}
+
+# Finished reports kept in memory; older ones are reloaded from the esg_reports table
+REPORT_CACHE_SIZE = 100
+
+# Finished reports keyed by (document_id, document_version), least recently used first
+_report_cache: "OrderedDict[Tuple[str, str], Tuple[str, List[Dict]]]" = OrderedDict()
+# Build locks with the number of requests holding or waiting for them, removed when unused
+_report_locks: Dict[Tuple[str, str], Tuple[asyncio.Lock, int]] = {}
+
+async def generate_esg_report(document_id: str) -> Tuple[str, List[Dict]]:
+    """
+    Return the 13-category ESG report for a document as a markdown table.
+    Reports are materialized per document version, so only the first request
+    for a version pays for retrieval and generation; concurrent requests for
+    a version that is not materialized yet wait for one build.
+    """
+    document_version = await get_document_version(document_id)
+    key = (document_id, document_version)
+
+    report = _cached_report(key)
+    if report is None:
+        async with _report_lock(key):
+            report = _cached_report(key)
+            if report is None:
+                return await materialize_report(document_id, document_version)
+
+    record_usage("gpt-4o", "chat", cache_status="hit", route="esg_report")
+    return report
+
+@asynccontextmanager
+async def _report_lock(key: Tuple[str, str]):
+    lock, users = _report_locks.get(key, (asyncio.Lock(), 0))
+    _report_locks[key] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = _report_locks[key]
+        if users == 1:
+            del _report_locks[key]
+        else:
+            _report_locks[key] = (lock, users - 1)
+
+def _cached_report(key: Tuple[str, str]) -> Optional[Tuple[str, List[Dict]]]:
+    report = _report_cache.get(key)
+    if report is not None:
+        _report_cache.move_to_end(key)
+    return report
+
+def _cache_report(key: Tuple[str, str], report: Tuple[str, List[Dict]]) -> None:
+    _report_cache[key] = report
+    _report_cache.move_to_end(key)
+    while len(_report_cache) > REPORT_CACHE_SIZE:
+        _report_cache.popitem(last=False)
+
+async def materialize_report(document_id: str, document_version: str) -> Tuple[str, List[Dict]]:
+    """Load a document version's stored report, or build and store it."""
+    report = await load_materialized_report(document_id, document_version)
+    if report is not None:
+        record_usage("gpt-4o", "chat", cache_status="hit", route="esg_report")
+    else:
+        # Category embeddings and section calls are charged to the report route
+        with usage_route("esg_report"):
+            content, citations, failed = await build_esg_report(document_id)
+        if not citations:
+            # Nothing indexed for this document yet, so there is nothing to materialize
+            return "I couldn't find any relevant information in the document to generate an ESG report.", []
+        if failed:
+            # Serve the partial report but regenerate it on the next request
+            print(f"Report for document {document_id} not materialized, sections failed: {', '.join(failed)}")
+            return content, citations
+        report = content, citations
+        await save_materialized_report(document_id, document_version, *report)
+
+    _cache_report((document_id, document_version), report)
+    return report
+
+async def get_document_version(document_id: str) -> str:
+    """Return the content hash of a document, or a fixed tag for legacy uploads."""
+    async for db in get_db():
+        document = await db.get(Document, document_id)
+        if document and document.content_hash:
+            return document.content_hash
+    return "unversioned"
+
+async def load_materialized_report(document_id: str, document_version: str):
+    async for db in get_db():
+        result = await db.execute(
+            select(ESGReport)
+            .where(ESGReport.document_id == document_id)
+            .where(ESGReport.document_version == document_version)
+        )
+        report = result.scalars().first()
+        if report:
+            return report.content, hydrate_citations([report.citations])[0]
+    return None
+
+async def save_materialized_report(document_id: str, document_version: str, content: str, citations: List[Dict]) -> None:
+    async for db in get_db():
+        db.add(ESGReport(
+            document_id=document_id,
+            document_version=document_version,
+            content=content,
+            citations=to_citation_refs(citations)
+        ))
+        try:
+            await db.commit()
+        except Exception as e:
+            # Another worker materialized the same version first
+            await db.rollback()
+            print(f"Report for document {document_id} already materialized: {str(e)}")
+
+async def build_esg_report(document_id: str) -> Tuple[str, List[Dict], List[str]]:
+    """
+    Retrieve context for every category concurrently, generate each category
+    section in parallel and assemble the results into a markdown table.
+    Also returns the categories whose generation failed, which must not be
+    materialized as "No data available".
+    """
+    category_embeddings = await asyncio.to_thread(
+        load_cached_embeddings,
+        "esg_report_categories",
+        [query for _, query in ESG_REPORT_CATEGORIES]
+    )
+
+    retrievals = await asyncio.gather(*[
+        asyncio.to_thread(retrieve_category_chunks, document_id, embedding)
+        for embedding in category_embeddings
+    ])
+
+    semaphore = asyncio.Semaphore(REPORT_CONCURRENCY)
+
+    async def generate(category: str, chunks: List[Dict]) -> Dict:
+        if not chunks:
+            return empty_section(category)
+        async with semaphore:
+            return await asyncio.to_thread(generate_category_section, category, chunks)
+
+    sections = await asyncio.gather(*[
+        generate(category, chunks)
+        for (category, _), chunks in zip(ESG_REPORT_CATEGORIES, retrievals)
+    ])
+
+    # Deduplicate citations across categories, keeping document order
+    citations_by_index = {}
+    for citations in retrievals:
+        for citation in citations:
+            citations_by_index.setdefault(citation["chunk_index"], citation)
+    citations = [citation for _, citation in sorted(citations_by_index.items())]
+
+    failed = [section["category"] for section in sections if section.get("failed")]
+    return format_report_table(sections), citations, failed
+
+def retrieve_category_chunks(document_id: str, embedding: List[float]) -> List[Dict]:
+    """Retrieve the chunks most relevant to one report category."""
+    results = query_document_chunks(document_id, embedding, n_results=CHUNKS_PER_CATEGORY)
+    if not results["documents"] or len(results["documents"][0]) == 0:
+        return []
+
+    return citations_from_results(document_id, results)
+
+def generate_category_section(category: str, chunks: List[Dict]) -> Dict:
+    """Ask the LLM to fill one row of the report from the category's chunks."""
+    context = "\n".join(chunk["text"] for chunk in chunks)
+
+    system_prompt = f"""You are an ESG report specialist filling in one row of a structured ESG report.
+    Using only the provided document excerpts, identify the target/goal, the achievement and the trend for the category "{category}".
+
+    Format your response as a JSON object with these fields:
+    - target: The target or goal mentioned, or "{NO_DATA}"
+    - achievement: The current achievement or status, or "{NO_DATA}"
+    - trend: One of "IMPROVED", "SAME", "WORSENED", or "{NO_DATA}"
+    """
+
+    try:
+        response = create_chat_completion(
+            route="esg_report",
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"Document excerpts:\n{context}"}
+            ],
+            temperature=0.2,
+            max_tokens=250,
+            response_format={"type": "json_object"}
+        )
+        data = json.loads(response.choices[0].message.content.strip())
+    except Exception as e:
+        print(f"Error generating report section for {category}: {str(e)}")
+        return {"category": category, "target": SECTION_UNAVAILABLE, "achievement": SECTION_UNAVAILABLE, "trend": SECTION_UNAVAILABLE, "failed": True}
+
+    trend = str(data.get("trend") or NO_DATA).strip().upper()
+    return {
+        "category": category,
+        "target": str(data.get("target") or NO_DATA).strip(),
+        "achievement": str(data.get("achievement") or NO_DATA).strip(),
+        "trend": trend if trend in VALID_TRENDS else NO_DATA
+    }
+
+def empty_section(category: str) -> Dict:
+    return {"category": category, "target": NO_DATA, "achievement": NO_DATA, "trend": NO_DATA}
+
+def format_report_table(sections: List[Dict]) -> str:
+    """Render report sections as a standard markdown table."""
+    def cell(value: str) -> str:
+        return value.replace("|", "\\|").replace("\n", " ")
+
+    lines = [
+        "| Category | Target/Goal | Achievement | Trend |",
+        "| --- | --- | --- | --- |",
+    ]
+    for section in sections:
+        lines.append(
+            f"| {cell(section['category'])} | {cell(section['target'])} "
+            f"| {cell(section['achievement'])} | {cell(section['trend'])} |"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,55 @@
+import os
+from typing import Dict, List, Optional
+from app.utils.chroma_client import get_chroma_client, get_chunk_collection
+from app.services.vector_index import vector_store
+
+# "chroma" queries the shared HNSW collection, "exact" scores the document's own matrix
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# Initialize ChromaDB using the utility function
+chroma_client = get_chroma_client()
+
+# Create or get the chunk collection for the configured embedding model
+collection = get_chunk_collection()
+
+def query_document_chunks(document_id: str, query_embedding: List[float], n_results: int) -> Dict:
+    """
+    Retrieve the chunks of one document closest to a query embedding.
+    Results use ChromaDB's query format whichever backend serves them.
+    """
+    if VECTOR_BACKEND == "exact":
+        results = search_exact(document_id, query_embedding, n_results)
+        if results is not None:
+            return results
+
+    return collection.query(
+        query_embeddings=[query_embedding],
+        n_results=n_results,
+        where={"document_id": document_id}
+    )
+
+def search_exact(document_id: str, query_embedding: List[float], n_results: int) -> Optional[Dict]:
+    """Brute-force search over the document's matrix, indexing it from ChromaDB if needed."""
+    if not vector_store.has_document(document_id) and not index_document_from_chroma(document_id):
+        return None
+
+    results = vector_store.search(document_id, query_embedding, n_results)
+    if results is None:
+        return None
+
+    ids = results["ids"][0]
+    texts = {}
+    if ids:
+        stored = collection.get(ids=ids, include=["documents"])
+        texts = dict(zip(stored["ids"], stored["documents"]))
+    results["documents"] = [[texts.get(chunk_id, "") for chunk_id in ids]]
+    return results
+
+def index_document_from_chroma(document_id: str) -> bool:
+    """Build the exact-search matrix of a document ingested before the matrix existed."""
+    stored = collection.get(where={"document_id": document_id}, include=["embeddings", "metadatas"])
+    if not stored["ids"]:
+        return False
+
+    vector_store.write_document(document_id, stored["ids"], stored["metadatas"], stored["embeddings"])
+    return True
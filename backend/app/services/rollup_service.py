@@ -0,0 +1,117 @@
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import delete, func, insert, literal, select, cast, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.models import ESGMetric, MetricRollup
+
+# Dimensions the rollup can be grouped by
+ROLLUP_DIMENSIONS = ("category", "rag_status", "document_id", "period")
+ROLLUP_PERIODS = ("month", "quarter", "year")
+
+RollupKey = Tuple[str, str, str, str]
+
+def metric_period(created_at: Optional[datetime] = None) -> str:
+    """Return the rollup month ("YYYY-MM") of a metric, defaulting to now for new rows."""
+    return (created_at or datetime.now(timezone.utc)).strftime("%Y-%m")
+
+def rollup_key(category: str, rag_status: Optional[str], document_id: str, created_at: Optional[datetime] = None) -> RollupKey:
+    return (category, rag_status or "", document_id, metric_period(created_at))
+
+async def apply_rollup_deltas(db: AsyncSession, deltas: Iterable[Tuple[RollupKey, int]]) -> None:
+    """
+    Incrementally update the materialized rollup with count changes.
+    Runs inside the caller's transaction so rollups commit with the metrics.
+    """
+    merged = Counter()
+    for key, delta in deltas:
+        merged[key] += delta
+
+    changes = [(key, delta) for key, delta in merged.items() if delta != 0]
+    if not changes:
+        return
+
+    stmt = sqlite_insert(MetricRollup).values([
+        {"category": category, "rag_status": rag_status, "document_id": document_id, "period": period, "metric_count": delta}
+        for (category, rag_status, document_id, period), delta in changes
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MetricRollup.category, MetricRollup.rag_status, MetricRollup.document_id, MetricRollup.period],
+        set_={"metric_count": MetricRollup.metric_count + stmt.excluded.metric_count}
+    )
+    await db.execute(stmt)
+
+    if any(delta < 0 for _, delta in changes):
+        await db.execute(delete(MetricRollup).where(MetricRollup.metric_count <= 0))
+
+def rebuild_rollup_statements() -> List:
+    """Statements that recompute the whole rollup from the esg_metrics table."""
+    period = func.strftime("%Y-%m", func.coalesce(ESGMetric.created_at, func.current_timestamp()))
+    source = (
+        select(
+            ESGMetric.category,
+            func.coalesce(ESGMetric.rag_status, literal("")),
+            ESGMetric.document_id,
+            period,
+            func.count()
+        )
+        .group_by(ESGMetric.category, func.coalesce(ESGMetric.rag_status, literal("")), ESGMetric.document_id, period)
+    )
+    return [
+        delete(MetricRollup),
+        insert(MetricRollup).from_select(
+            ["category", "rag_status", "document_id", "period", "metric_count"],
+            source
+        ),
+    ]
+
+async def rebuild_metric_rollups(db: AsyncSession) -> None:
+    """Recompute all rollups, e.g. to backfill metrics created before rollups existed."""
+    for stmt in rebuild_rollup_statements():
+        await db.execute(stmt)
+    await db.commit()
+
+def _period_expression(period: str):
+    if period == "year":
+        return func.substr(MetricRollup.period, 1, 4)
+    if period == "quarter":
+        quarter = (cast(func.substr(MetricRollup.period, 6, 2), Integer) + 2) // 3
+        return func.printf("%s-Q%d", func.substr(MetricRollup.period, 1, 4), quarter)
+    return MetricRollup.period
+
+async def query_metric_rollup(
+    db: AsyncSession,
+    group_by: List[str],
+    period: str = "month",
+    document_id: Optional[str] = None,
+    category: Optional[str] = None,
+    start_period: Optional[str] = None,
+    end_period: Optional[str] = None
+) -> List[Dict]:
+    """
+    Aggregate the materialized rollup by any combination of category, RAG
+    status, document and time period. Start and end periods are "YYYY-MM".
+    """
+    columns = {
+        "category": MetricRollup.category,
+        "rag_status": MetricRollup.rag_status,
+        "document_id": MetricRollup.document_id,
+        "period": _period_expression(period),
+    }
+    selected = [columns[dimension].label(dimension) for dimension in group_by]
+
+    stmt = select(*selected, func.sum(MetricRollup.metric_count).label("count"))
+    if document_id:
+        stmt = stmt.where(MetricRollup.document_id == document_id)
+    if category:
+        stmt = stmt.where(MetricRollup.category == category)
+    if start_period:
+        stmt = stmt.where(MetricRollup.period >= start_period)
+    if end_period:
+        stmt = stmt.where(MetricRollup.period <= end_period)
+    if selected:
+        stmt = stmt.group_by(*selected).order_by(*selected)
+
+    result = await db.execute(stmt)
+    return [dict(row._mapping) for row in result]
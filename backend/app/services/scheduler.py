@@ -0,0 +1,214 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+from fastapi import HTTPException, Request
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_EXTRACTION = "extraction"
+PRIORITY_INGESTION = "ingestion"
+
+# Work admitted at once across all classes, sized to the shared OpenAI rate limit
+SCHEDULER_GLOBAL_CONCURRENCY = int(os.getenv("SCHEDULER_GLOBAL_CONCURRENCY", "8"))
+
+@dataclass
+class PriorityClass:
+    name: str
+    max_concurrency: int
+    rate_per_second: float  # Token bucket refill rate for admissions
+    burst: int
+    max_queue_depth: int
+    max_queued_per_user: int
+
+def _class_from_env(name: str, max_concurrency: int, rate_per_second: float, burst: int, max_queue_depth: int, max_queued_per_user: int) -> PriorityClass:
+    prefix = f"SCHEDULER_{name.upper()}_"
+    return PriorityClass(
+        name=name,
+        max_concurrency=int(os.getenv(prefix + "CONCURRENCY", str(max_concurrency))),
+        rate_per_second=float(os.getenv(prefix + "RATE", str(rate_per_second))),
+        burst=int(os.getenv(prefix + "BURST", str(burst))),
+        max_queue_depth=int(os.getenv(prefix + "QUEUE_DEPTH", str(max_queue_depth))),
+        max_queued_per_user=int(os.getenv(prefix + "QUEUED_PER_USER", str(max_queued_per_user))),
+    )
+
+# Highest priority first. Lower classes are capped below the global limit,
+# so interactive QA always finds free slots.
+PRIORITY_CLASSES = [
+    _class_from_env(PRIORITY_INTERACTIVE, max_concurrency=8, rate_per_second=10, burst=20, max_queue_depth=100, max_queued_per_user=5),
+    _class_from_env(PRIORITY_EXTRACTION, max_concurrency=3, rate_per_second=2, burst=5, max_queue_depth=50, max_queued_per_user=3),
+    _class_from_env(PRIORITY_INGESTION, max_concurrency=2, rate_per_second=1, burst=2, max_queue_depth=200, max_queued_per_user=50),
+]
+
+class AdmissionRejected(HTTPException):
+    """Raised when a priority class is saturated; carries a Retry-After header."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+class _ClassState:
+    def __init__(self, config: PriorityClass):
+        self.config = config
+        self.running = 0
+        # Waiters grouped per user; users are served round robin
+        self.queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.queued = 0
+        self.tokens = float(config.burst)
+        self.refilled_at = time.monotonic()
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_times: Deque[float] = deque(maxlen=500)
+        self.service_times: Deque[float] = deque(maxlen=500)
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.config.burst, self.tokens + (now - self.refilled_at) * self.config.rate_per_second)
+        self.refilled_at = now
+
+    def seconds_until_token(self) -> float:
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.config.rate_per_second if self.config.rate_per_second > 0 else 60.0
+
+    def estimated_wait(self) -> float:
+        """Rough time until a new request would start, used for Retry-After."""
+        service_time = (sum(self.service_times) / len(self.service_times)) if self.service_times else 5.0
+        by_concurrency = (self.queued + 1) * service_time / max(self.config.max_concurrency, 1)
+        by_rate = (self.queued + 1) / self.config.rate_per_second if self.config.rate_per_second > 0 else 60.0
+        return max(by_concurrency, by_rate)
+
+class Scheduler:
+    """
+    Priority-aware admission control. Each class has its own concurrency
+    cap, admission rate, queue depth limit and per-user queue limit; free
+    slots go to the highest priority class with waiters, and within a class
+    to users in round-robin order. Saturated classes reject immediately
+    with 429 (per-user limit) or 503 (class queue full) and a Retry-After.
+    """
+
+    def __init__(self, classes=PRIORITY_CLASSES, global_concurrency: int = SCHEDULER_GLOBAL_CONCURRENCY):
+        self.global_concurrency = global_concurrency
+        self._classes: Dict[str, _ClassState] = {config.name: _ClassState(config) for config in classes}
+        self._running = 0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    @asynccontextmanager
+    async def admit(self, priority: str, user_id: str):
+        """Hold a slot of the given priority class for the duration of the block."""
+        state = self._classes[priority]
+        enqueued_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+
+        user_queue = state.queues.get(user_id)
+        if user_queue is not None and len(user_queue) >= state.config.max_queued_per_user:
+            state.rejected += 1
+            raise AdmissionRejected(429, f"Too many queued {priority} requests for this user", state.estimated_wait())
+        if state.queued >= state.config.max_queue_depth:
+            state.rejected += 1
+            raise AdmissionRejected(503, f"The {priority} queue is full", state.estimated_wait())
+
+        state.queues.setdefault(user_id, deque()).append(future)
+        state.queued += 1
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.done() or future.cancelled():
+                self._remove_waiter(state, user_id, future)
+            else:
+                # Admitted just as the caller went away; hand the slot back
+                self._release(state)
+            raise
+
+        started_at = time.monotonic()
+        state.wait_times.append(started_at - enqueued_at)
+        try:
+            yield
+        finally:
+            state.service_times.append(time.monotonic() - started_at)
+            self._release(state)
+
+    def _remove_waiter(self, state: _ClassState, user_id: str, future: asyncio.Future) -> None:
+        user_queue = state.queues.get(user_id)
+        if user_queue is not None and future in user_queue:
+            user_queue.remove(future)
+            state.queued -= 1
+            if not user_queue:
+                del state.queues[user_id]
+
+    def _release(self, state: _ClassState) -> None:
+        state.running -= 1
+        self._running -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Start as many queued requests as the limits allow, highest priority first."""
+        next_refill = None
+        for state in self._classes.values():
+            state.refill()
+            while state.queued and state.running < state.config.max_concurrency and self._running < self.global_concurrency:
+                if state.tokens < 1:
+                    wait = state.seconds_until_token()
+                    next_refill = wait if next_refill is None else min(next_refill, wait)
+                    break
+
+                # Round robin: take the first user's oldest request, then move that user to the back
+                user_id, user_queue = next(iter(state.queues.items()))
+                future = user_queue.popleft()
+                state.queued -= 1
+                if user_queue:
+                    state.queues.move_to_end(user_id)
+                else:
+                    del state.queues[user_id]
+                if future.done():
+                    # Cancelled, but its task has not run to leave the queue yet
+                    continue
+
+                state.tokens -= 1
+                state.running += 1
+                state.admitted += 1
+                self._running += 1
+                future.set_result(None)
+
+        if next_refill is not None and self._wakeup is None:
+            def wake():
+                self._wakeup = None
+                self._dispatch()
+            self._wakeup = asyncio.get_running_loop().call_later(next_refill, wake)
+
+    def stats(self) -> Dict:
+        """Queue depth, concurrency and wait times per class, for monitoring."""
+        classes = {}
+        for name, state in self._classes.items():
+            waits = sorted(state.wait_times)
+            classes[name] = {
+                "queued": state.queued,
+                "running": state.running,
+                "max_concurrency": state.config.max_concurrency,
+                "max_queue_depth": state.config.max_queue_depth,
+                "queued_users": len(state.queues),
+                "admitted": state.admitted,
+                "rejected": state.rejected,
+                "wait_ms_avg": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+                "wait_ms_p95": round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+            }
+        return {"running": self._running, "global_concurrency": self.global_concurrency, "classes": classes}
+
+def request_user_key(request: Request) -> str:
+    """
+    Identify the caller for per-user fairness and usage attribution until
+    real authentication exists. The X-User-Id header is client-supplied, so
+    a caller can pick any key: this is not a security boundary.
+    """
+    return request.headers.get("X-User-Id") or (request.client.host if request.client else "anonymous")
+
+# Shared scheduler for all routes
+scheduler = Scheduler()
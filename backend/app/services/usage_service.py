@@ -0,0 +1,195 @@
+import asyncio
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from app.database import get_db
+from app.models.models import LLMBudget, LLMUsage
+from app.services.write_behind import write_queue
+from app.utils.llm_usage import set_usage_context, take_usage_records
+
+# Default daily token limits; 0 means unlimited. Per-subject overrides live in llm_budgets.
+# User budgets are keyed on request_user_key, which callers can spoof until
+# authentication exists, so they curb accidental overspend rather than enforce
+# a quota. Document budgets do not depend on the caller's identity.
+LLM_BUDGET_USER_DAILY_TOKENS = int(os.getenv("LLM_BUDGET_USER_DAILY_TOKENS", "0"))
+LLM_BUDGET_DOCUMENT_DAILY_TOKENS = int(os.getenv("LLM_BUDGET_DOCUMENT_DAILY_TOKENS", "0"))
+BUDGET_DEFAULTS = {"user": LLM_BUDGET_USER_DAILY_TOKENS, "document": LLM_BUDGET_DOCUMENT_DAILY_TOKENS}
+
+# How often recorded calls are handed to the write-behind queue
+USAGE_WRITE_INTERVAL_MS = float(os.getenv("USAGE_WRITE_INTERVAL_MS", "200"))
+
+# Columns the usage summary can be grouped by
+USAGE_DIMENSIONS = ("route", "model", "call_type", "cache_status", "user_id", "document_id")
+
+_writer_task: Optional[asyncio.Task] = None
+_writer_stopping = False
+
+class BudgetExceeded(HTTPException):
+    """Raised before any LLM call when a user or document has spent its daily tokens."""
+
+    def __init__(self, detail: str):
+        now = datetime.now(timezone.utc)
+        tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        super().__init__(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil((tomorrow - now).total_seconds())))}
+        )
+
+def queue_usage_records() -> int:
+    """Move recorded calls into the write-behind queue. Returns the number moved."""
+    records = take_usage_records()
+    if records:
+        write_queue.enqueue(LLMUsage, records)
+    return len(records)
+
+def start_usage_writer() -> None:
+    global _writer_task, _writer_stopping
+    if _writer_task is None or _writer_task.done():
+        _writer_stopping = False
+        _writer_task = asyncio.get_running_loop().create_task(_run_writer())
+
+async def _run_writer() -> None:
+    # Calls are recorded from worker threads, so they are collected here rather than queued directly
+    while not _writer_stopping:
+        await asyncio.sleep(USAGE_WRITE_INTERVAL_MS / 1000)
+        queue_usage_records()
+
+async def drain_usage_writer() -> None:
+    """Stop the writer and queue everything recorded so far. Call before draining write_queue."""
+    global _writer_task, _writer_stopping
+    if _writer_task is not None:
+        _writer_stopping = True
+        await _writer_task
+        _writer_task = None
+    queue_usage_records()
+
+def _day_start() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+
+async def get_daily_spend(scope: str, subject_id: str) -> int:
+    """Tokens a user or document has used since midnight UTC, including calls not yet written."""
+    column = "user_id" if scope == "user" else "document_id"
+    since = _day_start()
+
+    # Queued rows first, so a flush between the two reads cannot hide them
+    queue_usage_records()
+    pending = [
+        row for row in write_queue.pending_rows(LLMUsage, **{column: subject_id})
+        if row.created_at >= since
+    ]
+
+    # Rows committed since they were read from the queue are counted once, from the queue
+    query = (
+        select(func.coalesce(func.sum(LLMUsage.total_tokens), 0))
+        .where(getattr(LLMUsage, column) == subject_id)
+        .where(LLMUsage.created_at >= since)
+    )
+    if pending:
+        query = query.where(LLMUsage.id.notin_([row.id for row in pending]))
+
+    async for db in get_db():
+        stored = await db.scalar(query)
+
+    return stored + sum(row.total_tokens for row in pending)
+
+async def get_budget_limit(scope: str, subject_id: str) -> int:
+    """Daily token limit for a user or document; 0 means unlimited."""
+    async for db in get_db():
+        budget = await db.get(LLMBudget, (scope, subject_id))
+        if budget is not None:
+            return budget.daily_token_limit
+    return BUDGET_DEFAULTS[scope]
+
+async def check_budget(user_id: Optional[str] = None, document_id: Optional[str] = None) -> None:
+    """
+    Raise BudgetExceeded if the user or document has used its daily tokens.
+    Checked before a request makes any LLM call; a request already admitted
+    can overshoot the limit by its own usage. The user check is only as
+    strong as the user_id passed in, see LLM_BUDGET_USER_DAILY_TOKENS.
+    """
+    for scope, subject_id in (("user", user_id), ("document", document_id)):
+        if subject_id is None:
+            continue
+        limit = await get_budget_limit(scope, subject_id)
+        if limit and await get_daily_spend(scope, subject_id) >= limit:
+            raise BudgetExceeded(f"Daily LLM token budget of {limit} exhausted for {scope} {subject_id}")
+
+async def begin_metered_request(route: str, user_id: Optional[str] = None, document_id: Optional[str] = None) -> None:
+    """Charge the request's LLM calls to the user, document and route, after checking their budgets."""
+    await check_budget(user_id, document_id)
+    set_usage_context(user_id=user_id, document_id=document_id, route=route)
+
+async def set_budget(scope: str, subject_id: str, daily_token_limit: int) -> None:
+    if scope not in BUDGET_DEFAULTS:
+        raise ValueError(f"Unknown budget scope: {scope}. Expected one of {', '.join(BUDGET_DEFAULTS)}")
+    async for db in get_db():
+        budget = await db.get(LLMBudget, (scope, subject_id))
+        if budget is None:
+            db.add(LLMBudget(scope=scope, subject_id=subject_id, daily_token_limit=daily_token_limit))
+        else:
+            budget.daily_token_limit = daily_token_limit
+        await db.commit()
+
+async def get_usage_summary(
+    group_by: List[str],
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    document_id: Optional[str] = None,
+    route: Optional[str] = None
+) -> List[Dict]:
+    """
+    Calls, tokens and latency grouped by the given dimensions over a
+    half-open date range, most expensive groups first.
+    """
+    unknown = [dimension for dimension in group_by if dimension not in USAGE_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown dimensions: {', '.join(unknown)}. Expected any of {', '.join(USAGE_DIMENSIONS)}")
+
+    # Include calls made up to now
+    queue_usage_records()
+    await write_queue.flush()
+
+    dimensions = [getattr(LLMUsage, dimension) for dimension in group_by]
+    total_tokens = func.sum(LLMUsage.total_tokens)
+    query = select(
+        *dimensions,
+        func.count(LLMUsage.id).label("calls"),
+        func.sum(LLMUsage.prompt_tokens).label("prompt_tokens"),
+        func.sum(LLMUsage.completion_tokens).label("completion_tokens"),
+        total_tokens.label("total_tokens"),
+        func.avg(LLMUsage.latency_ms).label("avg_latency_ms"),
+        func.max(LLMUsage.latency_ms).label("max_latency_ms")
+    )
+
+    if start_date is not None:
+        query = query.where(LLMUsage.created_at >= start_date)
+    if end_date is not None:
+        query = query.where(LLMUsage.created_at < end_date)
+    if user_id is not None:
+        query = query.where(LLMUsage.user_id == user_id)
+    if document_id is not None:
+        query = query.where(LLMUsage.document_id == document_id)
+    if route is not None:
+        query = query.where(LLMUsage.route == route)
+
+    query = query.group_by(*dimensions).order_by(total_tokens.desc())
+
+    async for db in get_db():
+        result = await db.execute(query)
+        return [
+            {
+                **{dimension: row._mapping[dimension] for dimension in group_by},
+                "calls": row.calls,
+                "prompt_tokens": row.prompt_tokens or 0,
+                "completion_tokens": row.completion_tokens or 0,
+                "total_tokens": row.total_tokens or 0,
+                "avg_latency_ms": round(row.avg_latency_ms or 0, 1),
+                "max_latency_ms": round(row.max_latency_ms or 0, 1)
+            }
+            for row in result
+        ]
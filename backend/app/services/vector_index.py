@@ -0,0 +1,227 @@
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.config.chroma_config import BASE_DIR
+from app.utils.chroma_client import chunk_collection_name
+from app.utils.embeddings import get_embedding_model_name
+
+VECTOR_INDEX_DIR = BASE_DIR / "chroma_data" / "vector_index"
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float16")  # "float16" or "int8"
+VECTOR_CACHE_MAX_BYTES = int(os.getenv("VECTOR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Rows upcast to float32 at a time while scoring, to keep scratch memory small
+SCORE_BLOCK_ROWS = 4096
+
+class DocumentVectors:
+    """Embeddings of one document as a memory-mapped matrix plus chunk ids and metadata."""
+
+    def __init__(self, ids: List[str], metadatas: List[Dict], matrix: np.ndarray, scales: Optional[np.ndarray] = None, stamp: Tuple[int, int] = (0, 0)):
+        self.ids = ids
+        self.metadatas = metadatas
+        self.matrix = matrix
+        self.scales = scales
+        # Inode and modification time of the chunk list the vectors were loaded from
+        self.stamp = stamp
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Dot product of a unit-length query with every chunk embedding."""
+        scores = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), SCORE_BLOCK_ROWS):
+            block = self.matrix[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+class DocumentVectorStore:
+    """
+    Per-document exact vector search. Each document's embeddings live on disk
+    as a float16 or int8-quantized .npy file that is memory-mapped on first use
+    and kept in a bounded LRU of hot documents.
+
+    Each write saves the arrays under a new version and then atomically
+    replaces the chunk list that names it, so files another thread or worker
+    has memory-mapped are never overwritten. Cached entries are reloaded when
+    the chunk list changes on disk.
+    """
+
+    def __init__(self, directory: Path = VECTOR_INDEX_DIR, dtype: str = VECTOR_INDEX_DTYPE, max_bytes: int = VECTOR_CACHE_MAX_BYTES):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported vector index dtype: {dtype}")
+        self.directory = Path(directory)
+        self.dtype = dtype
+        self.max_bytes = max_bytes
+        self._cache: "OrderedDict[str, DocumentVectors]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _paths(self, document_id: str, version: Optional[str] = None) -> Dict[str, Path]:
+        # Indexes written before versioning use unversioned array files
+        prefix = f"{document_id}.{version}" if version else document_id
+        return {
+            "vectors": self.directory / f"{prefix}.vectors.npy",
+            "scales": self.directory / f"{prefix}.scales.npy",
+            "chunks": self.directory / f"{document_id}.chunks.json",
+        }
+
+    def _read_chunks(self, document_id: str) -> Optional[Dict]:
+        try:
+            with open(self._paths(document_id)["chunks"]) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _unlink_arrays(self, document_id: str, version: Optional[str]) -> None:
+        # Workers that still map the old arrays keep reading them until they reload
+        paths = self._paths(document_id, version)
+        for name in ("vectors", "scales"):
+            try:
+                paths[name].unlink(missing_ok=True)
+            except OSError as e:
+                print(f"Error removing {paths[name]}: {str(e)}")
+
+    def has_document(self, document_id: str) -> bool:
+        return self._paths(document_id)["chunks"].exists()
+
+    def write_document(self, document_id: str, ids: List[str], metadatas: List[Dict], embeddings: List[List[float]]) -> None:
+        """Normalize, quantize and save a document's embeddings, replacing any previous version."""
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+        previous = self._read_chunks(document_id)
+        version = uuid.uuid4().hex
+        paths = self._paths(document_id, version)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        if self.dtype == "int8":
+            # Symmetric per-row quantization: row ≈ quantized * scale / 127
+            scales = np.maximum(np.abs(matrix).max(axis=1), 1e-12)
+            quantized = np.round(matrix / scales[:, None] * 127).astype(np.int8)
+            np.save(paths["vectors"], quantized)
+            np.save(paths["scales"], (scales / 127).astype(np.float32))
+        else:
+            np.save(paths["vectors"], matrix.astype(np.float16))
+
+        # The chunk list is written last; its presence marks the document as indexed
+        tmp_path = paths["chunks"].with_suffix(f".json.{version}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": version, "ids": ids, "metadatas": metadatas}, f)
+        os.replace(tmp_path, paths["chunks"])
+
+        with self._lock:
+            self._cache.pop(document_id, None)
+        if previous is not None:
+            self._unlink_arrays(document_id, previous.get("version"))
+
+    def delete_document(self, document_id: str) -> None:
+        previous = self._read_chunks(document_id)
+        self._paths(document_id)["chunks"].unlink(missing_ok=True)
+        with self._lock:
+            self._cache.pop(document_id, None)
+        if previous is not None:
+            self._unlink_arrays(document_id, previous.get("version"))
+
+    def load_document(self, document_id: str) -> Optional[DocumentVectors]:
+        """
+        Return a document's vectors from the LRU, memory-mapping them on a miss
+        or when another thread or worker has rewritten the document since.
+        """
+        chunks_path = self._paths(document_id)["chunks"]
+        # A concurrent rewrite can remove the arrays between reading the chunk list and mapping them
+        for attempt in range(3):
+            try:
+                stat = chunks_path.stat()
+            except FileNotFoundError:
+                with self._lock:
+                    self._cache.pop(document_id, None)
+                return None
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+
+            with self._lock:
+                vectors = self._cache.get(document_id)
+                if vectors is not None and vectors.stamp == stamp:
+                    self._cache.move_to_end(document_id)
+                    return vectors
+
+            chunks = self._read_chunks(document_id)
+            if chunks is None:
+                return None
+            paths = self._paths(document_id, chunks.get("version"))
+            try:
+                matrix = np.load(paths["vectors"], mmap_mode="r")
+                scales = np.load(paths["scales"]) if matrix.dtype == np.int8 else None
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+        vectors = DocumentVectors(chunks["ids"], chunks["metadatas"], matrix, scales, stamp)
+
+        with self._lock:
+            self._cache[document_id] = vectors
+            self._cache.move_to_end(document_id)
+            self._evict()
+        return vectors
+
+    def _evict(self) -> None:
+        total = sum(vectors.nbytes for vectors in self._cache.values())
+        while total > self.max_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            total -= evicted.nbytes
+
+    def search(self, document_id: str, query_embedding: List[float], n_results: int) -> Optional[Dict]:
+        """
+        Score every chunk of a document with one matmul and return the top
+        results in ChromaDB's query format, or None if the document is not indexed.
+        Distances are squared L2 between unit vectors, as ChromaDB reports them.
+        """
+        vectors = self.load_document(document_id)
+        if vectors is None:
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+
+        scores = vectors.scores(query)
+        k = min(n_results, len(scores))
+        if k == 0:
+            top = np.array([], dtype=int)
+        else:
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+        return {
+            "ids": [[vectors.ids[i] for i in top]],
+            "metadatas": [[vectors.metadatas[i] for i in top]],
+            "distances": [[float(2 - 2 * scores[i]) for i in top]],
+        }
+
+    def memory_stats(self) -> Dict:
+        """Memory held by each cached document and in total."""
+        with self._lock:
+            documents = [
+                {
+                    "document_id": document_id,
+                    "chunks": len(vectors.ids),
+                    "dimensions": vectors.matrix.shape[1] if vectors.matrix.ndim == 2 else 0,
+                    "dtype": str(vectors.matrix.dtype),
+                    "bytes": vectors.nbytes,
+                }
+                for document_id, vectors in self._cache.items()
+            ]
+        return {
+            "dtype": self.dtype,
+            "max_bytes": self.max_bytes,
+            "used_bytes": sum(document["bytes"] for document in documents),
+            "documents": documents,
+        }
+
+# Shared store used by retrieval and ingestion, kept apart per embedding model
+vector_store = DocumentVectorStore(VECTOR_INDEX_DIR / chunk_collection_name(get_embedding_model_name()))
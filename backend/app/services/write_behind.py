@@ -0,0 +1,287 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from app.config.chroma_config import BASE_DIR
+from app.database import SessionLocal
+from app.models.models import generate_uuid
+from app.services.rollup_service import RollupKey, apply_rollup_deltas
+
+# Pending rows are flushed after this long, or as soon as this many are queued
+WRITE_BEHIND_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "50"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))
+
+# A row that fails this many flushes is dead-lettered; retries back off exponentially
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "8"))
+WRITE_BEHIND_MAX_BACKOFF_SECONDS = 30.0
+DEAD_LETTER_PATH = BASE_DIR / "write_behind_dead_letter.jsonl"
+
+# Errors caused by the rows themselves. Anything else, such as a locked
+# database, says nothing about the rows, so the batch is retried as a whole.
+ROW_ERRORS = (IntegrityError, DataError)
+
+Batch = Dict[type, Dict[str, Dict]]
+
+class WriteBehindQueue:
+    """
+    Buffers inserts off the request path. Rows get their id and created_at
+    when queued, so responses can be returned immediately; a background task
+    writes them in multi-row INSERTs, one transaction per flush, together with
+    the rollup deltas queued alongside them. Queued rows stay readable through
+    pending_rows until their transaction commits.
+
+    When a flush fails on a constraint or data error, each model's rows and
+    then each row are retried in their own transactions, so one bad row
+    cannot hold back the others. Rows that keep failing are retried with
+    backoff and dead-lettered to a JSONL file after WRITE_BEHIND_MAX_ATTEMPTS.
+    Any other failure, e.g. a locked database, requeues the whole batch with
+    backoff and does not count against the rows' attempts.
+
+    Rows are only durable once flushed: a crash can lose the last interval of
+    writes, and other worker processes do not see rows queued here.
+    """
+
+    def __init__(self, interval_ms: float = WRITE_BEHIND_INTERVAL_MS, max_batch: int = WRITE_BEHIND_MAX_BATCH):
+        self.interval = interval_ms / 1000
+        self.max_batch = max_batch
+        self._pending: Batch = {}
+        self._flushing: Batch = {}
+        # Per-row rollup deltas, attempt counts and retry times, keyed by row id
+        self._deltas: Dict[str, Tuple[RollupKey, int]] = {}
+        self._attempts: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+        # Backoff after flushes that failed for reasons unrelated to the rows
+        self._batch_failures = 0
+        self._batch_retry_at = 0.0
+        self._pending_count = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def enqueue(self, model, rows: List[Dict], rollup_deltas: Iterable[Tuple[RollupKey, int]] = ()) -> List[Dict]:
+        """
+        Queue rows for insert, filling in id and created_at. Returns the
+        completed rows. rollup_deltas, if given, holds one delta per row; a
+        row's delta is applied in the transaction that writes the row.
+        """
+        self._ensure_started()
+        rollup_deltas = list(rollup_deltas)
+        if rollup_deltas and len(rollup_deltas) != len(rows):
+            raise ValueError("rollup_deltas must hold one delta per row")
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        pending = self._pending.setdefault(model, {})
+        for i, row in enumerate(rows):
+            row.setdefault("id", generate_uuid())
+            row.setdefault("created_at", now)
+            pending[row["id"]] = row
+            if rollup_deltas:
+                self._deltas[row["id"]] = rollup_deltas[i]
+        self._pending_count += len(rows)
+
+        if self._pending_count >= self.max_batch:
+            self._wakeup.set()
+        return rows
+
+    def pending_rows(self, model, **filters) -> List:
+        """
+        Queued and in-flight rows of a model matching column equality filters,
+        as transient instances. Call this before querying the database and
+        de-duplicate by id, so a flush committing in between cannot hide a row.
+        """
+        rows = list(self._flushing.get(model, {}).values()) + list(self._pending.get(model, {}).values())
+        return [
+            model(**row) for row in rows
+            if all(row.get(column) == value for column, value in filters.items())
+        ]
+
+    def is_pending(self, model, row_id: str) -> bool:
+        return row_id in self._pending.get(model, {}) or row_id in self._flushing.get(model, {})
+
+    async def ensure_flushed(self, model, row_id: str) -> None:
+        """Flush now if a row is still queued, e.g. before updating it."""
+        if self.is_pending(model, row_id):
+            await self.flush(force=True)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._pending_count:
+                await self.flush()
+
+    def _take_ready(self, force: bool) -> Batch:
+        """Move rows that are not waiting out a retry backoff into a batch."""
+        now = time.monotonic()
+        ready: Batch = {}
+        if not force and self._batch_retry_at > now:
+            return ready
+        for model, rows in self._pending.items():
+            for row_id in [row_id for row_id in rows if force or self._retry_at.get(row_id, 0) <= now]:
+                ready.setdefault(model, {})[row_id] = rows.pop(row_id)
+        self._pending = {model: rows for model, rows in self._pending.items() if rows}
+        self._pending_count -= sum(len(rows) for rows in ready.values())
+        return ready
+
+    async def _write(self, batch: Batch) -> None:
+        """Insert a batch and apply its rollup deltas in one transaction."""
+        async with SessionLocal() as db:
+            for model, rows in batch.items():
+                # A multi-row VALUES list needs the same columns in every row
+                groups: Dict[Tuple[str, ...], List[Dict]] = {}
+                for row in rows.values():
+                    groups.setdefault(tuple(sorted(row)), []).append(row)
+                for group in groups.values():
+                    for start in range(0, len(group), self.max_batch):
+                        await db.execute(insert(model).values(group[start:start + self.max_batch]))
+            await apply_rollup_deltas(db, [
+                self._deltas[row_id] for rows in batch.values() for row_id in rows if row_id in self._deltas
+            ])
+            await db.commit()
+
+    async def _write_isolated(self, batch: Batch, written: Set[str]) -> Dict[str, Tuple[type, Dict, Exception]]:
+        """
+        Write a batch, narrowing down to model groups and then single rows
+        when a transaction fails on a row error. Returns the rows that could
+        not be written and adds the ids of those that were to written. Other
+        errors are raised to the caller.
+        """
+        try:
+            await self._write(batch)
+            written.update(row_id for rows in batch.values() for row_id in rows)
+            return {}
+        except ROW_ERRORS as e:
+            if sum(len(rows) for rows in batch.values()) == 1:
+                (model, rows), = batch.items()
+                (row_id, row), = rows.items()
+                return {row_id: (model, row, e)}
+            print(f"Error flushing write-behind queue, retrying rows separately: {str(e)}")
+
+        failed = {}
+        for model, rows in batch.items():
+            try:
+                await self._write({model: rows})
+                written.update(rows)
+            except ROW_ERRORS:
+                for row_id, row in rows.items():
+                    failed.update(await self._write_isolated({model: {row_id: row}}, written))
+        return failed
+
+    async def flush(self, force: bool = False) -> None:
+        """
+        Write every queued row that is due, in one transaction when possible.
+        force also writes rows that are waiting out a retry backoff.
+        """
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            if not self._pending_count:
+                return
+            self._flushing = self._take_ready(force)
+            if not self._flushing:
+                return
+
+            batch = self._flushing
+            written: Set[str] = set()
+            try:
+                failed = await self._write_isolated(batch, written)
+            except Exception as e:
+                # Not the rows' fault: keep them queued and back off the whole queue
+                self._requeue(batch, written)
+                self._batch_failures += 1
+                backoff = min(self.interval * 2 ** self._batch_failures, WRITE_BEHIND_MAX_BACKOFF_SECONDS)
+                self._batch_retry_at = time.monotonic() + backoff
+                print(f"Error flushing write-behind queue, retrying in {backoff:.1f}s: {str(e)}")
+                return
+            except BaseException:
+                # Cancelled mid-flush: keep the rows queued
+                self._requeue(batch, written)
+                raise
+            finally:
+                self._flushing = {}
+
+            self._batch_failures = 0
+            self._batch_retry_at = 0.0
+
+            for row_id in [row_id for rows in batch.values() for row_id in rows]:
+                if row_id not in failed:
+                    self._deltas.pop(row_id, None)
+                    self._attempts.pop(row_id, None)
+                    self._retry_at.pop(row_id, None)
+
+            for row_id, (model, row, error) in failed.items():
+                attempts = self._attempts.get(row_id, 0) + 1
+                if attempts >= WRITE_BEHIND_MAX_ATTEMPTS:
+                    self._dead_letter(model, row, error, attempts)
+                    continue
+                self._attempts[row_id] = attempts
+                self._retry_at[row_id] = time.monotonic() + min(self.interval * 2 ** attempts, WRITE_BEHIND_MAX_BACKOFF_SECONDS)
+                self._pending.setdefault(model, {})[row_id] = row
+                self._pending_count += 1
+
+    def _requeue(self, batch: Batch, written: Set[str]) -> None:
+        """Put the rows of a failed flush back in the queue, except those already committed."""
+        for model, rows in batch.items():
+            for row_id, row in rows.items():
+                if row_id in written:
+                    self._deltas.pop(row_id, None)
+                    self._attempts.pop(row_id, None)
+                    self._retry_at.pop(row_id, None)
+                else:
+                    self._pending.setdefault(model, {})[row_id] = row
+                    self._pending_count += 1
+
+    def _dead_letter(self, model, row: Dict, error: Exception, attempts: int) -> None:
+        """Drop a row that cannot be written, keeping a copy for inspection or replay."""
+        print(f"Dead-lettering {model.__tablename__} row {row['id']} after {attempts} attempts: {str(error)}")
+        self._deltas.pop(row["id"], None)
+        self._attempts.pop(row["id"], None)
+        self._retry_at.pop(row["id"], None)
+        try:
+            with open(DEAD_LETTER_PATH, "a") as f:
+                f.write(json.dumps({
+                    "table": model.__tablename__,
+                    "row": row,
+                    "error": str(error),
+                    "attempts": attempts,
+                    "failed_at": datetime.now(timezone.utc).isoformat()
+                }, default=str) + "\n")
+        except Exception as e:
+            print(f"Error writing dead-letter file: {str(e)}")
+
+    async def drain(self) -> None:
+        """Stop the background task and write everything still queued. Called on shutdown."""
+        if self._task is not None:
+            # Let the task finish any flush in progress rather than cancelling it mid-transaction
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush(force=True)
+
+        # Rows that failed their final attempt are kept in the dead-letter file rather than lost
+        for model, rows in self._pending.items():
+            for row in rows.values():
+                self._dead_letter(model, row, RuntimeError("not written before shutdown"), self._attempts.get(row["id"], 0))
+        if self._pending_count:
+            print(f"Write-behind queue drained with {self._pending_count} rows not written")
+        self._pending = {}
+        self._pending_count = 0
+
+# Shared queue for the API process
+write_queue = WriteBehindQueue()
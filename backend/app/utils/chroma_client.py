@@ -1,7 +1,12 @@
 import chromadb
+import hashlib
+import re
 from app.config.chroma_config import get_chroma_client as config_get_client, get_or_create_collection as config_get_or_create_collection
+from app.utils.embeddings import OPENAI_EMBEDDING_MODEL, get_embedding_model_name
 from typing import Optional
 
+CHUNK_COLLECTION = "document_chunks"
+
 _client: Optional[chromadb.PersistentClient] = None  # Use Optional and type hint
 
 def get_chroma_client() -> chromadb.PersistentClient:
@@ -17,5 +22,39 @@ def get_or_create_collection(name: str, metadata: Optional[dict] = None) -> chro
     """
     Get an existing collection or create a new one if it doesn't exist.
     """
-    collection = config_get_or_create_collection(name=name)
+    collection = config_get_or_create_collection(name=name, metadata=metadata)
+    return collection
+
+def chunk_collection_name(model_name: str) -> str:
+    """
+    Name of the chunk collection for an embedding model. Each model gets its
+    own collection so vectors from different models are never mixed.
+    """
+    if model_name == OPENAI_EMBEDDING_MODEL:
+        # The original collection, created before models were recorded
+        return CHUNK_COLLECTION
+    slug = re.sub(r"[^a-zA-Z0-9_-]+", "-", model_name).strip("-_")
+    if len(slug) > 40:
+        slug = slug[:30] + hashlib.sha256(model_name.encode("utf-8")).hexdigest()[:10]
+    return f"{CHUNK_COLLECTION}__{slug}"
+
+def get_chunk_collection() -> chromadb.Collection:
+    """
+    Get the document chunk collection for the configured embedding model,
+    refusing to use a collection whose vectors came from another model.
+    """
+    model_name = get_embedding_model_name()
+    collection = get_or_create_collection(
+        name=chunk_collection_name(model_name),
+        metadata={"embedding_model": model_name}
+    )
+
+    recorded_model = (collection.metadata or {}).get("embedding_model")
+    if recorded_model is None:
+        collection.modify(metadata={**(collection.metadata or {}), "embedding_model": model_name})
+    elif recorded_model != model_name:
+        raise ValueError(
+            f"Collection {collection.name} holds {recorded_model} embeddings, "
+            f"but the configured embedding model is {model_name}"
+        )
     return collection
\ No newline at end of file
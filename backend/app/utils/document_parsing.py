@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import fitz  # PyMuPDF
+from docx import Document as DocxDocument
+
+# Kept free of database and ChromaDB imports so process pool workers start quickly
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx")
+
+# Structured tables per document version; same base directory as app.config.chroma_config
+TABLE_CACHE_DIR = Path(__file__).resolve().parent.parent.parent / "chroma_data" / "tables"
+# Bump when table extraction changes so cached tables are rebuilt
+TABLE_EXTRACTION_VERSION = 1
+
+# Tables longer than this are split between rows, repeating the header in each chunk
+TABLE_CHUNK_MAX_CHARS = 4000
+
+def compute_content_hash(file_path: Path) -> str:
+    """Return the SHA-256 hex digest of a file, used as its document version."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def extract_document(file_path: Path) -> Tuple[str, List[Dict]]:
+    """
+    Extract prose text and structured tables from a supported document.
+    Returns (text, tables); table text is left out of the prose.
+    """
+    file_ext = file_path.suffix.lower()
+    if file_ext == '.pdf':
+        return extract_from_pdf(file_path)
+    elif file_ext == '.docx':
+        return extract_from_docx(file_path)
+    raise ValueError(f"Unsupported file type: {file_ext}")
+
+def extract_from_pdf(file_path: Path) -> Tuple[str, List[Dict]]:
+    """Extract text and tables from a PDF using PyMuPDF's table finder."""
+    doc = fitz.open(str(file_path))
+    text = ""
+    tables = []
+    for page in doc:
+        table_rects = []
+        for found in page.find_tables().tables:
+            table = make_table(found.extract(), page=page.number + 1)
+            if table is not None:
+                tables.append(table)
+                table_rects.append(fitz.Rect(found.bbox))
+
+        if not table_rects:
+            text += page.get_text()
+            continue
+
+        # Keep only the text blocks outside the detected tables
+        for x0, y0, x1, y1, block_text, *_ in page.get_text("blocks"):
+            if not any(fitz.Rect(x0, y0, x1, y1).intersects(rect) for rect in table_rects):
+                text += block_text + "\n"
+    return text, tables
+
+def extract_from_docx(file_path: Path) -> Tuple[str, List[Dict]]:
+    """Extract paragraphs and tables from a DOCX using python-docx."""
+    doc = DocxDocument(file_path)
+    text = ""
+    for paragraph in doc.paragraphs:
+        text += paragraph.text + "\n"
+
+    tables = []
+    for docx_table in doc.tables:
+        table = make_table([[cell.text for cell in row.cells] for row in docx_table.rows])
+        if table is not None:
+            tables.append(table)
+    return text, tables
+
+def make_table(rows: List[List[Optional[str]]], page: Optional[int] = None) -> Optional[Dict]:
+    """
+    Normalize raw table cells into {"page", "header", "rows", "row_labels"}.
+    Empty rows and columns are dropped; tables without a body row are ignored.
+    """
+    cleaned = [[" ".join((cell or "").split()) for cell in row] for row in rows]
+    cleaned = [row for row in cleaned if any(row)]
+    if len(cleaned) < 2:
+        return None
+
+    width = max(len(row) for row in cleaned)
+    cleaned = [row + [""] * (width - len(row)) for row in cleaned]
+    keep = [column for column in range(width) if any(row[column] for row in cleaned)]
+    cleaned = [[row[column] for column in keep] for row in cleaned]
+
+    header, body = cleaned[0], cleaned[1:]
+    return {
+        "page": page,
+        "header": header,
+        "rows": body,
+        "row_labels": [row[0] for row in body if row and row[0]],
+    }
+
+def load_document(file_path: Path, content_hash: str) -> Tuple[str, List[Dict]]:
+    """
+    Extract a document, reusing the cached prose and structured tables of
+    its version so table detection runs once per document version.
+    """
+    cache_file = TABLE_CACHE_DIR / f"{content_hash}.json"
+    if cache_file.exists():
+        with open(cache_file) as f:
+            cached = json.load(f)
+        if cached.get("version") == TABLE_EXTRACTION_VERSION:
+            return cached["text"], cached["tables"]
+
+    text, tables = extract_document(file_path)
+
+    TABLE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({"version": TABLE_EXTRACTION_VERSION, "text": text, "tables": tables}, f)
+    tmp_file.replace(cache_file)
+    return text, tables
+
+def load_cached_tables(content_hash: str) -> Optional[List[Dict]]:
+    """Structured tables of a document version, or None if it has not been extracted."""
+    cache_file = TABLE_CACHE_DIR / f"{content_hash}.json"
+    if not cache_file.exists():
+        return None
+    with open(cache_file) as f:
+        return json.load(f)["tables"]
+
+def format_table(table: Dict, rows: List[List[str]]) -> str:
+    """Render a table as compact pipe-separated lines under a caption."""
+    caption = f"Table (page {table['page']})" if table.get("page") else "Table"
+    lines = [caption, " | ".join(table["header"])]
+    lines.extend(" | ".join(row) for row in rows)
+    return "\n".join(lines)
+
+def chunk_table(table: Dict, max_chars: int = TABLE_CHUNK_MAX_CHARS) -> List[Tuple[str, List[str]]]:
+    """
+    Split a table into whole-row chunks, each with the header repeated.
+    Returns (chunk text, row labels in the chunk) pairs.
+    """
+    chunks = []
+    current: List[List[str]] = []
+    for row in table["rows"]:
+        if current and len(format_table(table, current + [row])) > max_chars:
+            chunks.append(current)
+            current = []
+        current.append(row)
+    if current:
+        chunks.append(current)
+    return [(format_table(table, rows), [row[0] for row in rows if row and row[0]]) for rows in chunks]
+
+def chunk_text(text: str, chunk_size: int = 1000) -> List[str]:
+    """Split text into chunks of approximately equal size."""
+    words = text.split()
+    chunks = []
+    current_chunk = []
+    current_size = 0
+    
+    for word in words:
+        word_size = len(word) + 1  # +1 for space
+        if current_size + word_size > chunk_size and current_chunk:
+            chunks.append(" ".join(current_chunk))
+            current_chunk = [word]
+            current_size = word_size
+        else:
+            current_chunk.append(word)
+            current_size += word_size
+    
+    if current_chunk:
+        chunks.append(" ".join(current_chunk))
+    
+    return chunks
+
+def build_chunks(text: str, tables: List[Dict]) -> Tuple[List[str], List[Dict]]:
+    """
+    Chunk prose and tables. Returns chunk texts and their extra metadata:
+    chunk_type "text" or "table", and for tables the table index, page and
+    row labels. ChromaDB metadata only holds scalars, so labels are joined.
+    """
+    chunks = chunk_text(text)
+    metadatas = [{"chunk_type": "text"} for _ in chunks]
+    for table_index, table in enumerate(tables):
+        for table_chunk, row_labels in chunk_table(table):
+            metadata = {"chunk_type": "table", "table_index": table_index, "row_labels": " ; ".join(row_labels)}
+            if table.get("page"):
+                metadata["page"] = table["page"]
+            chunks.append(table_chunk)
+            metadatas.append(metadata)
+    return chunks, metadatas
+
+def parse_document(file_path: Path) -> Tuple[str, List[str], List[Dict]]:
+    """Hash, extract and chunk one file. Returns (content_hash, chunks, chunk metadata)."""
+    file_path = Path(file_path)
+    content_hash = compute_content_hash(file_path)
+    chunks, metadatas = build_chunks(*load_document(file_path, content_hash))
+    return content_hash, chunks, metadatas
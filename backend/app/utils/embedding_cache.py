@@ -0,0 +1,40 @@
+import hashlib
+import json
+from typing import Dict, List
+from app.config.chroma_config import BASE_DIR
+from app.utils.embeddings import embed_texts, get_embedding_model_name
+
+EMBEDDING_CACHE_DIR = BASE_DIR / "chroma_data" / "embedding_cache"
+
+# In-process copy of every embedding set loaded or computed so far
+_cache: Dict[str, List[List[float]]] = {}
+
+def _cache_key(name: str, texts: List[str], model: str) -> str:
+    digest = hashlib.sha256(json.dumps([model, texts]).encode("utf-8")).hexdigest()[:16]
+    return f"{name}-{digest}"
+
+def load_cached_embeddings(name: str, texts: List[str]) -> List[List[float]]:
+    """
+    Return embeddings for a fixed list of texts (e.g. prompt templates).
+    Embeddings are computed once with a single batched call and then served
+    from memory or from a JSON file on disk, keyed by model and text content.
+    """
+    key = _cache_key(name, texts, get_embedding_model_name())
+    if key in _cache:
+        return _cache[key]
+
+    cache_file = EMBEDDING_CACHE_DIR / f"{key}.json"
+    if cache_file.exists():
+        with open(cache_file) as f:
+            embeddings = json.load(f)
+        _cache[key] = embeddings
+        return embeddings
+
+    embeddings = embed_texts(texts)
+
+    EMBEDDING_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(cache_file, "w") as f:
+        json.dump(embeddings, f)
+
+    _cache[key] = embeddings
+    return embeddings
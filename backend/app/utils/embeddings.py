@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.utils.openai_client import get_openai_client, logger
+from app.utils.llm_usage import get_usage_context, record_usage
+
+# "openai" (default), "local" (ONNX or sentence-transformers model directory) or "hashing"
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "")
+# Optional name for the local model's vector space; derived from the model files when unset
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "")
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Concurrent requests are merged into batches of up to this many texts,
+# waiting at most this long for more requests to arrive
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "2"))
+
+class EmbeddingProvider(ABC):
+    """Turns texts into embedding vectors. model_name identifies the vector space."""
+
+    model_name: str = ""
+    max_batch_size: int = 64
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, returning one unit-length vector per text."""
+
+    def embed_with_usage(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        """Embed texts and report the billed tokens (0 for providers that are not billed per token)."""
+        return self.embed(texts), 0
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings from the OpenAI API."""
+
+    max_batch_size = 256
+
+    def __init__(self, model: str = OPENAI_EMBEDDING_MODEL):
+        self.model_name = model
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_with_usage(texts)[0]
+
+    def embed_with_usage(self, texts: List[str]) -> Tuple[List[List[float]], int]:
+        response = get_openai_client().embeddings.create(model=self.model_name, input=texts)
+        return [item.embedding for item in response.data], response.usage.prompt_tokens
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    CPU embeddings from a model directory on disk. A directory containing
+    model.onnx and tokenizer.json runs through onnxruntime with mean pooling;
+    any other directory is loaded with sentence-transformers.
+    """
+
+    max_batch_size = 64
+
+    # Model files hashed, with the resolved directory, into the default model_name
+    FINGERPRINT_FILES = ("model.onnx", "tokenizer.json", "config.json", "modules.json", "sentence_bert_config.json")
+
+    def __init__(self, model_path: str, max_length: int = 512, model_name: str = EMBEDDING_MODEL_NAME):
+        path = Path(model_path)
+        if not path.exists():
+            raise ValueError(f"Embedding model path does not exist: {model_path}")
+        self.model_name = f"local:{model_name}" if model_name else f"local:{path.name}-{self.fingerprint(path)}"
+        self.max_length = max_length
+
+        if (path / "model.onnx").exists():
+            import onnxruntime
+            from tokenizers import Tokenizer
+            self._session = onnxruntime.InferenceSession(str(path / "model.onnx"), providers=["CPUExecutionProvider"])
+            self._input_names = {model_input.name for model_input in self._session.get_inputs()}
+            self._tokenizer = Tokenizer.from_file(str(path / "tokenizer.json"))
+            self._tokenizer.enable_truncation(max_length=max_length)
+            self._tokenizer.enable_padding()
+            self._model = None
+        else:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(str(path), device="cpu")
+
+    @classmethod
+    def fingerprint(cls, path: Path) -> str:
+        """
+        Short hash of the resolved model directory and its model files, so
+        directories with the same basename (e.g. .../bge-small/onnx and
+        .../minilm/onnx) get different vector spaces.
+        """
+        digest = hashlib.sha256(str(path.resolve()).encode("utf-8"))
+        for name in cls.FINGERPRINT_FILES:
+            file_path = path / name
+            if not file_path.is_file():
+                continue
+            digest.update(name.encode("utf-8"))
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()[:12]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if self._model is not None:
+            return self._model.encode(texts, normalize_embeddings=True).tolist()
+
+        encodings = self._tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        outputs = self._session.run(None, {name: value for name, value in inputs.items() if name in self._input_names})
+
+        # Mean-pool token embeddings over the attention mask, then normalize
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        pooled = (outputs[0] * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.tolist()
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Dependency-free feature-hashing embedder over words and word bigrams.
+    Deterministic and fast; meant for tests and offline development.
+    """
+
+    max_batch_size = 1024
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+        self.model_name = f"hashing-{dimensions}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = re.findall(r"\w+", text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                matrix[row, value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return matrix.tolist()
+
+class EmbeddingBatcher:
+    """
+    Merges embedding requests from concurrent callers into shared batches.
+    A collector thread gathers requests until a batch is full or the wait
+    window closes, then a worker pool runs the provider on the batch.
+    """
+
+    def __init__(self, provider: EmbeddingProvider, max_wait_ms: float = EMBEDDING_MAX_WAIT_MS, workers: int = EMBEDDING_WORKERS):
+        self.provider = provider
+        self.max_wait = max_wait_ms / 1000
+        self._requests: "queue.Queue[Tuple[List[str], Future, Dict]]" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embedding")
+        self._collector = threading.Thread(target=self._collect, name="embedding-batcher", daemon=True)
+        self._collector.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future = Future()
+        if not texts:
+            future.set_result([])
+        else:
+            # Keep the caller's usage context so its share of the batch is charged to it
+            self._requests.put((list(texts), future, get_usage_context()))
+        return future
+
+    def _collect(self) -> None:
+        while True:
+            batch = [self._requests.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.provider.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._pool.submit(self._run, batch)
+
+    def _run(self, batch: List[Tuple[List[str], Future, Dict]]) -> None:
+        texts = [text for request_texts, _, _ in batch for text in request_texts]
+        started_at = time.monotonic()
+        try:
+            embeddings = []
+            tokens = 0
+            for start in range(0, len(texts), self.provider.max_batch_size):
+                batch_embeddings, batch_tokens = self.provider.embed_with_usage(texts[start:start + self.provider.max_batch_size])
+                embeddings.extend(batch_embeddings)
+                tokens += batch_tokens
+        except Exception as e:
+            for _, future, context in batch:
+                record_usage(self.provider.model_name, "embedding", latency_ms=1000 * (time.monotonic() - started_at), cache_status="error", context=context)
+                future.set_exception(e)
+            return
+        latency_ms = 1000 * (time.monotonic() - started_at)
+
+        # Split the batch's tokens between requests by text length
+        total_chars = max(sum(len(text) for text in texts), 1)
+        offset = 0
+        for request_texts, future, context in batch:
+            share = sum(len(text) for text in request_texts) / total_chars
+            record_usage(self.provider.model_name, "embedding", prompt_tokens=round(tokens * share), latency_ms=latency_ms, context=context)
+            future.set_result(embeddings[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+
+_provider: Optional[EmbeddingProvider] = None
+_batcher: Optional[EmbeddingBatcher] = None
+_lock = threading.Lock()
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """
+    Get the configured embedding provider (singleton).
+    """
+    global _provider
+    with _lock:
+        if _provider is None:
+            if EMBEDDING_PROVIDER == "local":
+                _provider = LocalEmbeddingProvider(EMBEDDING_MODEL_PATH)
+            elif EMBEDDING_PROVIDER == "hashing":
+                _provider = HashingEmbeddingProvider()
+            elif EMBEDDING_PROVIDER == "openai":
+                _provider = OpenAIEmbeddingProvider()
+            else:
+                raise ValueError(f"Unknown EMBEDDING_PROVIDER: {EMBEDDING_PROVIDER}")
+            logger.info(f"Using embedding model {_provider.model_name}")
+    return _provider
+
+def get_embedding_model_name() -> str:
+    return get_embedding_provider().model_name
+
+def _get_batcher() -> EmbeddingBatcher:
+    global _batcher
+    provider = get_embedding_provider()
+    with _lock:
+        if _batcher is None:
+            _batcher = EmbeddingBatcher(provider)
+    return _batcher
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Embed texts with the configured provider, batched with concurrent callers."""
+    return _get_batcher().submit(texts).result()
+
+async def aembed_texts(texts: List[str]) -> List[List[float]]:
+    """Async variant of embed_texts that does not block the event loop."""
+    return await asyncio.wrap_future(_get_batcher().submit(texts))
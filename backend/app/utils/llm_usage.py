@@ -0,0 +1,89 @@
+import contextvars
+import queue
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from app.utils.openai_client import get_openai_client
+
+# Who a request's LLM calls are charged to. Copied into tasks and asyncio.to_thread
+# calls automatically; the embedding batcher captures it when a request is submitted.
+_usage_context: contextvars.ContextVar[Dict] = contextvars.ContextVar("llm_usage_context", default={})
+
+# Usage records waiting to be written; safe to append from any thread
+_records: "queue.SimpleQueue[Dict]" = queue.SimpleQueue()
+
+def set_usage_context(user_id: Optional[str] = None, document_id: Optional[str] = None, route: Optional[str] = None) -> None:
+    """Attribute the current request's LLM calls to a user, document and route."""
+    _usage_context.set({"user_id": user_id, "document_id": document_id, "route": route})
+
+def get_usage_context() -> Dict:
+    return _usage_context.get()
+
+@contextmanager
+def usage_route(route: str):
+    """Charge LLM calls made inside the block to a different route, e.g. the report path."""
+    token = _usage_context.set({**_usage_context.get(), "route": route})
+    try:
+        yield
+    finally:
+        _usage_context.reset(token)
+
+def record_usage(
+    model: str,
+    call_type: str,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    latency_ms: float = 0.0,
+    cache_status: str = "miss",
+    route: Optional[str] = None,
+    context: Optional[Dict] = None
+) -> None:
+    """Queue one ledger entry. Cheap and non-blocking; rows are written in batches."""
+    context = context if context is not None else _usage_context.get()
+    _records.put({
+        "user_id": context.get("user_id"),
+        "document_id": context.get("document_id"),
+        "route": route or context.get("route") or "unknown",
+        "model": model,
+        "call_type": call_type,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "latency_ms": round(latency_ms, 1),
+        "cache_status": cache_status,
+        "created_at": datetime.now(timezone.utc).replace(tzinfo=None),
+    })
+
+def take_usage_records(limit: int = 10000) -> List[Dict]:
+    """Remove and return queued ledger entries."""
+    records = []
+    while len(records) < limit:
+        try:
+            records.append(_records.get_nowait())
+        except queue.Empty:
+            break
+    return records
+
+def create_chat_completion(route: Optional[str] = None, **kwargs):
+    """
+    Call chat.completions.create and record the call's token usage and
+    latency in the ledger. Failed calls are recorded with no tokens.
+    """
+    started_at = time.monotonic()
+    try:
+        response = get_openai_client().chat.completions.create(**kwargs)
+    except Exception:
+        record_usage(kwargs.get("model", ""), "chat", latency_ms=1000 * (time.monotonic() - started_at), cache_status="error", route=route)
+        raise
+
+    usage = getattr(response, "usage", None)
+    record_usage(
+        kwargs.get("model", ""),
+        "chat",
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        latency_ms=1000 * (time.monotonic() - started_at),
+        route=route
+    )
+    return response
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+from app.config.chroma_config import BASE_DIR
+
+# Lease table shared by all workers on this host
+SINGLE_FLIGHT_DB_PATH = str(BASE_DIR / "single_flight.db")
+
+# How long a leader may go without renewing its lease before others assume it died.
+# Leaders renew the lease this many times per lease period while they run.
+DEFAULT_LEASE_SECONDS = 300
+LEASE_RENEWALS_PER_PERIOD = 3
+# Results finished this recently are handed to requests that arrive just after completion
+RESULT_GRACE_SECONDS = 2.0
+RESULT_RETENTION_SECONDS = 60
+POLL_INTERVAL_SECONDS = 0.1
+
+# Calls in flight in this process, keyed by request key
+_inflight: Dict[str, asyncio.Future] = {}
+_owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_schema_ready = False
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    conn = sqlite3.connect(SINGLE_FLIGHT_DB_PATH, timeout=30, isolation_level=None)
+    if not _schema_ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL)")
+        _schema_ready = True
+    return conn
+
+def _try_acquire(key: str, lease_seconds: float) -> bool:
+    """Take the lease for a key unless another live owner holds it."""
+    now = time.time()
+    with _connect() as conn:
+        cursor = conn.execute(
+            "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at < ?",
+            (key, _owner, now + lease_seconds, now)
+        )
+        return cursor.rowcount == 1
+
+def _renew(key: str, lease_seconds: float) -> bool:
+    """Extend a lease this worker holds. Returns False if it has lost the lease."""
+    with _connect() as conn:
+        cursor = conn.execute(
+            "UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?",
+            (time.time() + lease_seconds, key, _owner)
+        )
+        return cursor.rowcount == 1
+
+async def _keep_lease(key: str, lease_seconds: float) -> None:
+    """Renew a lease until cancelled, so long-running leaders are not taken over."""
+    while True:
+        await asyncio.sleep(lease_seconds / LEASE_RENEWALS_PER_PERIOD)
+        try:
+            renewed = await asyncio.to_thread(_renew, key, lease_seconds)
+        except sqlite3.Error as e:
+            print(f"Error renewing single-flight lease for {key}: {str(e)}")
+            continue
+        if not renewed:
+            print(f"Single-flight lease for {key} was taken over by another worker")
+            return
+
+def _release(key: str, result: Optional[str]) -> None:
+    now = time.time()
+    with _connect() as conn:
+        if result is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, result, created_at) VALUES (?, ?, ?)",
+                (key, result, now)
+            )
+            conn.execute("DELETE FROM results WHERE created_at < ?", (now - RESULT_RETENTION_SECONDS,))
+        conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, _owner))
+
+def _lookup(key: str, since: float):
+    """Return (result, lease_held) for a key, considering results created after `since`."""
+    with _connect() as conn:
+        row = conn.execute("SELECT result FROM results WHERE key = ? AND created_at >= ?", (key, since)).fetchone()
+        lease = conn.execute("SELECT 1 FROM leases WHERE key = ? AND expires_at >= ?", (key, time.time())).fetchone()
+    return (row[0] if row else None), lease is not None
+
+async def single_flight(
+    key: str,
+    fn: Callable[[], Awaitable[Any]],
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    encode: Callable[[Any], Any] = lambda value: value,
+    decode: Callable[[Any], Any] = lambda value: value
+) -> Any:
+    """
+    Run fn once for all concurrent callers with the same key.
+    Callers in this process share an asyncio future; callers in other worker
+    processes wait on a lease in a local SQLite table and read the leader's
+    JSON-encoded result when it finishes. The leader renews its lease while
+    fn runs; if it fails or dies, waiting workers retry and one of them
+    becomes the new leader.
+    """
+    future = _inflight.get(key)
+    if future is not None:
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await _run_across_workers(key, fn, lease_seconds, encode, decode)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        _inflight.pop(key, None)
+        if future.done() and not future.cancelled():
+            # Avoid "exception was never retrieved" warnings when nobody else waited
+            future.exception()
+
+async def _run_across_workers(key, fn, lease_seconds, encode, decode):
+    started_at = time.time()
+    while True:
+        result, lease_held = await asyncio.to_thread(_lookup, key, started_at - RESULT_GRACE_SECONDS)
+        if result is not None:
+            return decode(json.loads(result))
+
+        if not lease_held and await asyncio.to_thread(_try_acquire, key, lease_seconds):
+            break
+
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    # This worker is the leader
+    heartbeat = asyncio.get_running_loop().create_task(_keep_lease(key, lease_seconds))
+    try:
+        value = await fn()
+    except BaseException:
+        await asyncio.to_thread(_release, key, None)
+        raise
+    finally:
+        heartbeat.cancel()
+
+    try:
+        encoded = json.dumps(encode(value))
+    except (TypeError, ValueError) as e:
+        # Results that cannot be shared across workers are still shared in-process
+        print(f"Single-flight result for {key} is not JSON serializable: {str(e)}")
+        encoded = None
+    await asyncio.to_thread(_release, key, encoded)
+    return value
@@ -0,0 +1,101 @@
+"""
+Benchmark per-document retrieval: ChromaDB filtered HNSW query versus exact
+in-process search over float16 and int8 matrices.
+
+Builds a synthetic corpus in temporary directories, so it never touches the
+application's data. Recall@k is measured against float32 brute force.
+
+Usage (from backend/): python -m benchmarks.bench_vector_search [--documents 10] [--chunks 2000]
+"""
+import argparse
+import tempfile
+import time
+import numpy as np
+import chromadb
+from app.services.vector_index import DocumentVectorStore
+
+def make_corpus(rng, documents, chunks, dim, topics=50):
+    """Clustered unit vectors, which resemble text embeddings better than uniform noise."""
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    corpus = {}
+    for d in range(documents):
+        assignment = rng.integers(0, topics, chunks)
+        vectors = centers[assignment] + 0.6 * rng.standard_normal((chunks, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        corpus[f"doc{d}"] = vectors
+    return corpus
+
+def make_queries(rng, corpus, queries):
+    document_ids = list(corpus)
+    result = []
+    for _ in range(queries):
+        document_id = document_ids[rng.integers(0, len(document_ids))]
+        vectors = corpus[document_id]
+        query = vectors[rng.integers(0, len(vectors))] + 0.3 * rng.standard_normal(vectors.shape[1]).astype(np.float32)
+        result.append((document_id, query / np.linalg.norm(query)))
+    return result
+
+def ground_truth(corpus, queries, k):
+    return [set(np.argsort(-(corpus[document_id] @ query))[:k].tolist()) for document_id, query in queries]
+
+def run(name, search, queries, truth, k):
+    latencies = []
+    hits = 0
+    for (document_id, query), expected in zip(queries, truth):
+        start = time.perf_counter()
+        ids = search(document_id, query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len({int(chunk_id.rsplit("_", 1)[1]) for chunk_id in ids} & expected)
+    latencies = np.array(latencies)
+    print(f"{name:<16} p50 {np.percentile(latencies, 50):8.2f} ms   p95 {np.percentile(latencies, 95):8.2f} ms   "
+          f"recall@{k} {hits / (len(queries) * k):.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus = make_corpus(rng, args.documents, args.chunks, args.dim)
+    queries = make_queries(rng, corpus, args.queries)
+    truth = ground_truth(corpus, queries, args.k)
+
+    with tempfile.TemporaryDirectory() as chroma_dir, tempfile.TemporaryDirectory() as index_dir:
+        collection = chromadb.PersistentClient(path=chroma_dir).create_collection("bench_chunks")
+        stores = {dtype: DocumentVectorStore(f"{index_dir}/{dtype}", dtype=dtype) for dtype in ("float16", "int8")}
+
+        start = time.perf_counter()
+        for document_id, vectors in corpus.items():
+            ids = [f"{document_id}_{i}" for i in range(len(vectors))]
+            metadatas = [{"document_id": document_id, "chunk_index": i} for i in range(len(vectors))]
+            for offset in range(0, len(ids), 5000):
+                collection.add(
+                    ids=ids[offset:offset + 5000],
+                    embeddings=vectors[offset:offset + 5000].tolist(),
+                    metadatas=metadatas[offset:offset + 5000]
+                )
+            for store in stores.values():
+                store.write_document(document_id, ids, metadatas, vectors)
+        print(f"Indexed {args.documents} documents x {args.chunks} chunks x {args.dim} dims "
+              f"in {time.perf_counter() - start:.1f} s")
+
+        def chroma_search(document_id, query, k):
+            results = collection.query(query_embeddings=[query.tolist()], n_results=k, where={"document_id": document_id})
+            return results["ids"][0]
+
+        def exact_search(store):
+            return lambda document_id, query, k: store.search(document_id, query, k)["ids"][0]
+
+        run("chroma (hnsw)", chroma_search, queries, truth, args.k)
+        for dtype, store in stores.items():
+            run(f"exact {dtype}", exact_search(store), queries, truth, args.k)
+            stats = store.memory_stats()
+            per_document = stats["used_bytes"] / max(len(stats["documents"]), 1)
+            print(f"{'':<16} {len(stats['documents'])} cached documents, {per_document / 1024 / 1024:.2f} MiB per document")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Shared test setup. Run from backend/ with `python -m pytest tests`.
+
+Embeddings use the offline hashing provider and every OpenAI chat call goes
+through a fake client, so the tests need no network access.
+"""
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+
+os.environ.setdefault("EMBEDDING_PROVIDER", "hashing")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+class FakeChatClient:
+    """Stands in for the OpenAI client, recording each chat completion request."""
+
+    def __init__(self, content: str = "An answer.", delay: float = 0.0):
+        self.content = content
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls.append(kwargs)
+        time.sleep(self.delay)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.content))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20)
+        )
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    from app.utils import llm_usage
+    client = FakeChatClient()
+    monkeypatch.setattr(llm_usage, "get_openai_client", lambda: client)
+    return client
+
+@pytest.fixture(autouse=True)
+def isolated_single_flight(monkeypatch, tmp_path):
+    from app.utils import single_flight
+    monkeypatch.setattr(single_flight, "SINGLE_FLIGHT_DB_PATH", str(tmp_path / "single_flight.db"))
+    monkeypatch.setattr(single_flight, "_schema_ready", False)
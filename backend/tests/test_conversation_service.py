@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from app.services.conversation_service import ConversationState, is_follow_up, rewrite_follow_up
+
+FOLLOW_UPS = [
+    "How did it change?",
+    "What is its target?",
+    "What were their emissions?",
+    "How do they compare?",
+    "Why did that happen?",
+    "Is that on track?",
+    "What does this mean?",
+    "Can you explain that?",
+    "What about scope 2?",
+    "And in 2022?",
+]
+
+STANDALONE = [
+    # Short questions with no pronoun
+    "Who is the CEO?",
+    "What is the scope 1 total?",
+    "Net zero by when?",
+    # Demonstratives used as determiners
+    "What is this year's water consumption?",
+    "Fill in the ESG report template from this document",
+    "Is that target science based?",
+    # Pronouns that refer to a noun phrase earlier in the question
+    "Does the company audit its suppliers?",
+    "When will the company reach net zero and how will it get there?",
+    "What does the report say about water?",
+]
+
+@pytest.mark.parametrize("question", FOLLOW_UPS)
+def test_detects_follow_ups(question):
+    assert is_follow_up(question)
+
+@pytest.mark.parametrize("question", STANDALONE)
+def test_standalone_questions_are_not_follow_ups(question):
+    assert not is_follow_up(question)
+
+def test_eval_questions_are_not_follow_ups():
+    from app.eval_intent_router import DEFAULT_EVAL_SET, load_eval_set
+    flagged = [example["question"] for example in load_eval_set(DEFAULT_EVAL_SET) if is_follow_up(example["question"])]
+    assert flagged == []
+
+def test_standalone_question_skips_rewrite_call(fake_llm):
+    state = ConversationState("session", "document")
+    state.recent = [("What is the water consumption?", "2.1 million m³ in 2023.")]
+
+    rewritten = asyncio.run(rewrite_follow_up("Does the company audit its suppliers?", state))
+
+    assert rewritten == "Does the company audit its suppliers?"
+    assert fake_llm.calls == []
+
+def test_follow_up_is_rewritten_with_history(fake_llm):
+    fake_llm.content = "How did water consumption change?"
+    state = ConversationState("session", "document")
+    state.recent = [("What is the water consumption?", "2.1 million m³ in 2023.")]
+
+    rewritten = asyncio.run(rewrite_follow_up("How did it change?", state))
+
+    assert rewritten == "How did water consumption change?"
+    assert len(fake_llm.calls) == 1
+
+def test_first_question_is_never_rewritten(fake_llm):
+    state = ConversationState("session", "document")
+
+    assert asyncio.run(rewrite_follow_up("How did it change?", state)) == "How did it change?"
+    assert fake_llm.calls == []
@@ -0,0 +1,73 @@
+import json
+import numpy as np
+import pytest
+from app import eval_intent_router
+from app.services import intent_router
+from app.services.intent_router import ROUTE_ESG_REPORT, ROUTE_QA, exemplars_hash, route_question
+from app.utils.embeddings import get_embedding_model_name
+
+REPORT_LIKE = [1.0, 0.0]
+
+@pytest.fixture
+def centroids(monkeypatch, tmp_path):
+    monkeypatch.setattr(intent_router, "_routes", [ROUTE_ESG_REPORT, ROUTE_QA])
+    monkeypatch.setattr(intent_router, "_centroids", np.eye(2, dtype=np.float32))
+    monkeypatch.setattr(intent_router, "_thresholds", None)
+    thresholds_file = tmp_path / "intent_route_thresholds.json"
+    monkeypatch.setattr(intent_router, "THRESHOLDS_FILE", thresholds_file)
+    monkeypatch.setattr(eval_intent_router, "THRESHOLDS_FILE", thresholds_file)
+    return thresholds_file
+
+def write_thresholds(path, **entries):
+    path.write_text(json.dumps(entries))
+
+def test_uncalibrated_router_leaves_routing_to_keywords(centroids):
+    assert intent_router.load_route_thresholds() is None
+    assert route_question("What is the water consumption?", REPORT_LIKE) == ROUTE_QA
+
+def test_calibrated_router_overrides_keywords(centroids):
+    write_thresholds(centroids, **{get_embedding_model_name(): {"min_similarity": 0.8, "min_margin": 0.1, "exemplars": exemplars_hash()}})
+
+    assert intent_router.load_route_thresholds() == (0.8, 0.1)
+    assert route_question("What is the water consumption?", REPORT_LIKE) == ROUTE_ESG_REPORT
+    # Not confident enough: the keyword rules decide
+    assert route_question("What is the water consumption?", [0.7, 0.7]) == ROUTE_QA
+
+@pytest.mark.parametrize("model, exemplars", [
+    ("another-model", None),
+    (None, "stale"),
+])
+def test_thresholds_for_another_model_or_exemplar_set_are_ignored(centroids, model, exemplars):
+    write_thresholds(centroids, **{model or get_embedding_model_name(): {"min_similarity": 0.8, "min_margin": 0.1, "exemplars": exemplars or exemplars_hash()}})
+
+    assert intent_router.load_route_thresholds() is None
+    assert route_question("What is the water consumption?", REPORT_LIKE) == ROUTE_QA
+
+def scored(*examples):
+    return [({"question": question, "route": route}, closest) for question, route, closest in examples]
+
+def test_calibrate_records_thresholds_that_beat_keywords(centroids, monkeypatch):
+    monkeypatch.setattr(eval_intent_router, "score_eval_set", lambda path: scored(
+        # Misrouted by the keyword rules, confidently recognised by the router
+        ("Produce the ESG scorecard", ROUTE_ESG_REPORT, (ROUTE_ESG_REPORT, 0.9, 0.3)),
+        # The router is wrong here, but less sure
+        ("What is the water consumption?", ROUTE_QA, (ROUTE_ESG_REPORT, 0.7, 0.05)),
+    ))
+
+    entry = eval_intent_router.calibrate()
+
+    assert entry["router_accuracy"] == 1.0 and entry["keyword_accuracy"] == 0.5
+    # The strictest of the equally accurate pairs
+    assert (entry["min_similarity"], entry["min_margin"]) == (0.9, 0.1)
+    assert json.loads(centroids.read_text())[get_embedding_model_name()] == entry
+    assert intent_router._thresholds == (entry["min_similarity"], entry["min_margin"])
+
+def test_calibrate_removes_thresholds_that_do_not_beat_keywords(centroids, monkeypatch):
+    write_thresholds(centroids, **{get_embedding_model_name(): {"min_similarity": 0.5, "min_margin": 0.0, "exemplars": exemplars_hash()}})
+    monkeypatch.setattr(eval_intent_router, "score_eval_set", lambda path: scored(
+        ("What is the water consumption?", ROUTE_QA, (ROUTE_ESG_REPORT, 0.95, 0.5)),
+    ))
+
+    assert eval_intent_router.calibrate() is None
+    assert json.loads(centroids.read_text()) == {}
+    assert intent_router._thresholds is None
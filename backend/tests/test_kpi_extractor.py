@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from app.models.models import KPIValue
+from app.services.kpi_extractor import extract_kpis
+from app.services.metrics_service import calculate_rag_statuses, compute_kpi_metrics
+
+def summarize(text):
+    return [(kpi["metric"], kpi["kind"], kpi["value"], kpi["unit"], kpi["year"]) for kpi in extract_kpis(text)]
+
+@pytest.mark.parametrize("text, expected", [
+    (
+        "Energy use was 1,200 GWh in 2022 and 1,100 GWh in 2023.",
+        [("Energy", "actual", 1_200_000, "MWh", 2022), ("Energy", "actual", 1_100_000, "MWh", 2023)],
+    ),
+    (
+        "In 2022, we used 1,200 GWh and in 2023 1,100 GWh.",
+        [("Energy", "actual", 1_200_000, "MWh", 2022), ("Energy", "actual", 1_100_000, "MWh", 2023)],
+    ),
+    (
+        "Emissions fell from 150 tCO2e in 2019 to 120 tCO2e in 2023.",
+        [("GHG emissions", "actual", 150, "tCO2e", 2019), ("GHG emissions", "actual", 120, "tCO2e", 2023)],
+    ),
+    (
+        "Scope 1 was 120 tCO2e and scope 2 was 80 tCO2e in 2023.",
+        [("GHG emissions", "actual", 120, "tCO2e", 2023), ("GHG emissions", "actual", 80, "tCO2e", 2023)],
+    ),
+    (
+        "We aim to cut emissions 30% by 2030 against a 2019 baseline.",
+        [("GHG emissions", "target", 30, "%", 2030)],
+    ),
+])
+def test_each_value_gets_its_own_year(text, expected):
+    assert summarize(text) == expected
+
+def test_percentage_target_refers_to_previous_sentence():
+    assert summarize("Renewable energy was 35% of electricity in 2023. Our goal is 60% by 2030.") == [
+        ("Energy", "actual", 35, "%", 2023),
+        ("Energy", "target", 60, "%", 2030),
+    ]
+
+@pytest.mark.parametrize("text", [
+    # No target cue
+    "Water withdrawal was 2.1 ML in 2023. We had 12 years of continuous reporting.",
+    # Target cue, but not a percentage
+    "Water withdrawal was 2.1 ML in 2023. We plan to report for 12 years.",
+])
+def test_unrelated_values_are_not_attributed_to_previous_metric(text):
+    assert summarize(text) == [("Water", "actual", 2_100, "m³", 2023)]
+
+def test_sentences_without_a_known_metric_are_skipped():
+    assert summarize("Revenue grew 8% in 2023.") == []
+
+def kpi(metric, kind, value, unit, year, category="Environmental"):
+    return KPIValue(document_id="document", category=category, metric=metric, kind=kind, value=value, unit=unit, year=year)
+
+def test_compute_kpi_metrics_pairs_latest_target_and_actual():
+    metrics = compute_kpi_metrics([
+        kpi("Energy", "target", 50, "%", 2025),
+        kpi("Energy", "target", 80, "%", 2030),
+        kpi("Energy", "actual", 30, "%", 2022),
+        kpi("Energy", "actual", 70, "%", 2023),
+        # No target to compare against
+        kpi("Water", "actual", 2_100, "m³", 2023),
+    ])
+
+    assert metrics == [{
+        "category": "Environmental",
+        "goal": "Energy: 80% by 2030",
+        "actual": "70% in 2023",
+        "rag_status": "Green",
+        "extracted_by": "KPI Index",
+    }]
+
+def test_compute_kpi_metrics_treats_absolute_emissions_as_lower_is_better():
+    metrics = compute_kpi_metrics([
+        kpi("GHG emissions", "target", 100, "tCO2e", 2030),
+        kpi("GHG emissions", "actual", 250, "tCO2e", 2023),
+    ])
+
+    assert [metric["rag_status"] for metric in metrics] == ["Red"]
+
+@pytest.mark.parametrize("goal, actual, lower_is_better, expected", [
+    (100, 90, False, "Green"),
+    (100, 60, False, "Amber"),
+    (100, 40, False, "Red"),
+    (100, 110, True, "Green"),
+    (100, 150, True, "Amber"),
+    (100, 250, True, "Red"),
+    (0, 10, False, "Red"),
+    (100, 0, True, "Green"),
+])
+def test_rag_statuses(goal, actual, lower_is_better, expected):
+    statuses = calculate_rag_statuses(np.array([goal], dtype=float), np.array([actual], dtype=float), np.array([lower_is_better]))
+    assert statuses == [expected]
@@ -0,0 +1,41 @@
+import asyncio
+import pytest
+from app.services import qa_service
+
+CHUNKS = {
+    "ids": [["document_0"]],
+    "documents": [["Energy use fell 12% in 2023 against a 10% target."]],
+    "metadatas": [[{"chunk_index": 0}]],
+    "distances": [[0.2]],
+}
+
+@pytest.fixture
+def indexed_document(monkeypatch):
+    monkeypatch.setattr(qa_service, "query_document_chunks", lambda *args, **kwargs: CHUNKS)
+
+def ask_concurrently(requests):
+    async def ask_all():
+        return await asyncio.gather(*[qa_service.get_answer_from_llm("document", **request) for request in requests])
+    return asyncio.run(ask_all())
+
+def test_concurrent_opening_questions_share_one_llm_call(fake_llm, indexed_document):
+    # Each /qa/ask without a session_id starts a new session; opening questions have no history
+    fake_llm.delay = 0.2
+    question = "How much did energy use fall in 2023?"
+    answers = ask_concurrently([
+        {"question": question, "retrieval_query": question, "conversation_context": None}
+        for _ in range(4)
+    ])
+
+    assert len(fake_llm.calls) == 1
+    assert all(answer == answers[0] for answer in answers)
+
+def test_questions_with_different_history_are_answered_separately(fake_llm, indexed_document):
+    fake_llm.delay = 0.2
+    question = "How did it change?"
+    ask_concurrently([
+        {"question": question, "retrieval_query": "How did energy use change?", "conversation_context": "User: What was energy use?"},
+        {"question": question, "retrieval_query": "How did water use change?", "conversation_context": "User: What was water use?"},
+    ])
+
+    assert len(fake_llm.calls) == 2
@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+from app.services import report_service
+from app.services.report_service import SECTION_UNAVAILABLE, generate_esg_report
+
+@pytest.fixture
+def reports(monkeypatch):
+    """Stands in for retrieval, generation and the esg_reports table."""
+    state = {"builds": [], "stored": {}, "failed": []}
+
+    async def get_document_version(document_id):
+        return f"{document_id}-v1"
+
+    async def load_materialized_report(document_id, document_version):
+        return state["stored"].get((document_id, document_version))
+
+    async def save_materialized_report(document_id, document_version, content, citations):
+        state["stored"][(document_id, document_version)] = (content, citations)
+
+    async def build_esg_report(document_id):
+        state["builds"].append(document_id)
+        await asyncio.sleep(0.05)
+        content = f"| Report for {document_id} |" if not state["failed"] else SECTION_UNAVAILABLE
+        return content, [{"chunk_index": 0, "text": "Energy use fell 12%."}], list(state["failed"])
+
+    monkeypatch.setattr(report_service, "get_document_version", get_document_version)
+    monkeypatch.setattr(report_service, "load_materialized_report", load_materialized_report)
+    monkeypatch.setattr(report_service, "save_materialized_report", save_materialized_report)
+    monkeypatch.setattr(report_service, "build_esg_report", build_esg_report)
+    monkeypatch.setattr(report_service, "_report_cache", report_service.OrderedDict())
+    return state
+
+def test_concurrent_requests_share_one_build(reports):
+    async def run():
+        return await asyncio.gather(*[generate_esg_report("document") for _ in range(4)])
+
+    results = asyncio.run(run())
+
+    assert reports["builds"] == ["document"]
+    assert all(result == results[0] for result in results)
+    assert report_service._report_locks == {}
+    assert reports["stored"] == {("document", "document-v1"): results[0]}
+
+def test_report_cache_is_bounded(reports, monkeypatch):
+    monkeypatch.setattr(report_service, "REPORT_CACHE_SIZE", 2)
+
+    async def run():
+        for document_id in ["a", "b", "a", "c"]:
+            await generate_esg_report(document_id)
+        # Evicted from memory, so reloaded from the table rather than rebuilt
+        await generate_esg_report("b")
+
+    asyncio.run(run())
+
+    assert reports["builds"] == ["a", "b", "c"]
+    assert list(report_service._report_cache) == [("c", "c-v1"), ("b", "b-v1")]
+    assert report_service._report_locks == {}
+
+def test_reports_with_failed_sections_are_not_kept(reports):
+    reports["failed"] = ["Water"]
+    asyncio.run(generate_esg_report("document"))
+    reports["failed"] = []
+    content, _ = asyncio.run(generate_esg_report("document"))
+
+    assert reports["builds"] == ["document", "document"]
+    assert SECTION_UNAVAILABLE not in content
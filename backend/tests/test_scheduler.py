@@ -0,0 +1,176 @@
+import asyncio
+import time
+import pytest
+from app.services.scheduler import AdmissionRejected, PriorityClass, Scheduler
+
+def priority_class(name, max_concurrency=1, rate_per_second=1000, burst=1000, max_queue_depth=100, max_queued_per_user=10):
+    return PriorityClass(name, max_concurrency, rate_per_second, burst, max_queue_depth, max_queued_per_user)
+
+class Requests:
+    """Runs requests through a scheduler, recording admission order and holding slots until released."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.admitted = []
+        self.releases = {}
+
+    def start(self, name, priority, user_id):
+        self.releases[name] = asyncio.Event()
+
+        async def request():
+            async with self.scheduler.admit(priority, user_id):
+                self.admitted.append(name)
+                await self.releases[name].wait()
+        return asyncio.get_running_loop().create_task(request())
+
+    async def release(self, name):
+        self.releases[name].set()
+        await settle()
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_free_slots_go_to_the_highest_priority_class():
+    async def run():
+        scheduler = Scheduler([priority_class("interactive"), priority_class("ingestion")], global_concurrency=1)
+        requests = Requests(scheduler)
+        tasks = [requests.start("running", "ingestion", "a")]
+        await settle()
+        tasks.append(requests.start("ingestion", "ingestion", "a"))
+        tasks.append(requests.start("interactive", "interactive", "b"))
+        await settle()
+
+        for name in ["running", "interactive", "ingestion"]:
+            await requests.release(name)
+        await asyncio.gather(*tasks)
+        return requests.admitted
+
+    assert asyncio.run(run()) == ["running", "interactive", "ingestion"]
+
+def test_users_are_served_round_robin():
+    async def run():
+        scheduler = Scheduler([priority_class("interactive")])
+        requests = Requests(scheduler)
+        tasks = [requests.start("holder", "interactive", "holder")]
+        await settle()
+        for name, user_id in [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b")]:
+            tasks.append(requests.start(name, "interactive", user_id))
+        await settle()
+
+        for name in ["holder", "a1", "b1", "a2", "a3"]:
+            await requests.release(name)
+        await asyncio.gather(*tasks)
+        return requests.admitted
+
+    assert asyncio.run(run()) == ["holder", "a1", "b1", "a2", "a3"]
+
+def test_saturated_classes_reject_with_retry_after():
+    async def run():
+        scheduler = Scheduler([priority_class("interactive", max_queue_depth=3, max_queued_per_user=2)])
+        requests = Requests(scheduler)
+        tasks = [requests.start("holder", "interactive", "holder")]
+        await settle()
+        tasks += [requests.start(name, "interactive", "a") for name in ["a1", "a2"]]
+        await settle()
+
+        rejections = []
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with scheduler.admit("interactive", "a"):
+                pass
+        rejections.append(rejected.value)
+
+        tasks.append(requests.start("b1", "interactive", "b"))
+        await settle()
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with scheduler.admit("interactive", "c"):
+                pass
+        rejections.append(rejected.value)
+
+        for name in ["holder", "a1", "a2", "b1"]:
+            await requests.release(name)
+        await asyncio.gather(*tasks)
+        return rejections, scheduler.stats()["classes"]["interactive"]
+
+    (per_user, queue_full), stats = asyncio.run(run())
+
+    assert per_user.status_code == 429
+    assert queue_full.status_code == 503
+    assert int(per_user.headers["Retry-After"]) >= 1
+    assert int(queue_full.headers["Retry-After"]) >= 1
+    assert stats["rejected"] == 2
+    assert stats["queued"] == 0 and stats["running"] == 0
+
+def test_cancelled_waiters_leave_the_queue():
+    async def run():
+        scheduler = Scheduler([priority_class("interactive")])
+        requests = Requests(scheduler)
+        holder = requests.start("holder", "interactive", "holder")
+        await settle()
+        cancelled = requests.start("cancelled", "interactive", "a")
+        waiting = requests.start("waiting", "interactive", "b")
+        await settle()
+
+        cancelled.cancel()
+        await settle()
+        queued_after_cancel = scheduler.stats()["classes"]["interactive"]["queued"]
+
+        await requests.release("holder")
+        await requests.release("waiting")
+        await asyncio.gather(holder, waiting)
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return requests.admitted, queued_after_cancel, scheduler.stats()
+
+    admitted, queued_after_cancel, stats = asyncio.run(run())
+
+    assert admitted == ["holder", "waiting"]
+    assert queued_after_cancel == 1
+    assert stats["running"] == 0
+    assert stats["classes"]["interactive"]["queued"] == 0
+
+def test_slot_freed_as_a_waiter_is_cancelled_goes_to_the_next_waiter():
+    async def run():
+        scheduler = Scheduler([priority_class("interactive")])
+        requests = Requests(scheduler)
+        holder = requests.start("holder", "interactive", "holder")
+        await settle()
+        cancelled = requests.start("cancelled", "interactive", "a")
+        waiting = requests.start("waiting", "interactive", "b")
+        await settle()
+
+        # Free the slot and cancel the next waiter, so the slot is handed out before the cancelled task runs
+        requests.releases["holder"].set()
+        cancelled.cancel()
+        await settle()
+
+        await requests.release("waiting")
+        await asyncio.gather(holder, waiting)
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return requests.admitted, scheduler.stats()
+
+    admitted, stats = asyncio.run(run())
+
+    assert admitted == ["holder", "waiting"]
+    assert stats["running"] == 0
+    assert stats["classes"]["interactive"]["queued"] == 0
+
+def test_rate_limited_requests_start_when_tokens_refill():
+    async def run():
+        scheduler = Scheduler([priority_class("extraction", max_concurrency=5, rate_per_second=20, burst=1)])
+        admitted_at = []
+
+        async def request():
+            async with scheduler.admit("extraction", "a"):
+                admitted_at.append(time.monotonic())
+
+        started_at = time.monotonic()
+        # Each request finishes at once, so only the token bucket holds the second one back
+        await asyncio.wait_for(asyncio.gather(request(), request()), timeout=2)
+        return [at - started_at for at in admitted_at]
+
+    first, second = asyncio.run(run())
+
+    assert first < 0.02
+    assert 0.03 < second < 0.5
@@ -0,0 +1,38 @@
+import asyncio
+import time
+from app.utils import single_flight as single_flight_module
+from app.utils.single_flight import single_flight
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return {"value": 42}
+
+    async def run():
+        return await asyncio.gather(*[single_flight("key", compute) for _ in range(5)])
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert results == [{"value": 42}] * 5
+
+def test_leader_renews_its_lease_while_running():
+    lease_states = []
+
+    async def compute():
+        # Outlive the lease several times over, checking it is still held as other workers would
+        for _ in range(4):
+            await asyncio.sleep(0.25)
+            _, lease_held = await asyncio.to_thread(single_flight_module._lookup, "slow", time.time())
+            lease_states.append(lease_held)
+        return "done"
+
+    result = asyncio.run(single_flight("slow", compute, lease_seconds=0.3))
+
+    assert result == "done"
+    assert lease_states == [True] * 4
+    # Released once finished
+    assert single_flight_module._lookup("slow", time.time())[1] is False
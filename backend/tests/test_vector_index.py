@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from app.services.vector_index import DocumentVectorStore
+
+def unit_rows(*rows):
+    matrix = np.asarray(rows, dtype=np.float32)
+    return (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).tolist()
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_search_ranks_closest_chunks_first(tmp_path, dtype):
+    store = DocumentVectorStore(tmp_path, dtype=dtype)
+    store.write_document("document", ["a", "b", "c"], [{"chunk_index": i} for i in range(3)], unit_rows([1, 0, 0], [0.6, 0.8, 0], [0, 0, 1]))
+
+    results = store.search("document", [1, 0.1, 0], n_results=2)
+
+    assert results["ids"] == [["a", "b"]]
+    assert results["metadatas"] == [[{"chunk_index": 0}, {"chunk_index": 1}]]
+    assert results["distances"][0][0] == pytest.approx(0.01, abs=0.01)
+
+def test_rewrite_keeps_mapped_vectors_readable(tmp_path):
+    store = DocumentVectorStore(tmp_path)
+    store.write_document("document", ["a", "b"], [{}, {}], unit_rows([1, 0], [0, 1]))
+    mapped = store.load_document("document")
+
+    store.write_document("document", ["c"], [{}], unit_rows([1, 1]))
+
+    # The old arrays were replaced, not overwritten in place
+    assert mapped.matrix.shape == (2, 2)
+    assert float(mapped.matrix[1, 1]) == 1.0
+    assert store.search("document", [1, 0], n_results=5)["ids"] == [["c"]]
+    # Only the current version's arrays are left on disk
+    assert len(list(tmp_path.glob("document.*.npy"))) == 1
+
+def test_other_workers_reload_a_rewritten_document(tmp_path):
+    writer = DocumentVectorStore(tmp_path)
+    reader = DocumentVectorStore(tmp_path)
+    writer.write_document("document", ["a"], [{}], unit_rows([1, 0]))
+    assert reader.search("document", [1, 0], n_results=1)["ids"] == [["a"]]
+
+    writer.write_document("document", ["b", "c"], [{}, {}], unit_rows([1, 0], [0, 1]))
+    assert reader.search("document", [0, 1], n_results=1)["ids"] == [["c"]]
+
+    writer.delete_document("document")
+    assert reader.search("document", [0, 1], n_results=1) is None
+    assert list(tmp_path.iterdir()) == []
+
+def test_reads_indexes_written_before_versioning(tmp_path):
+    np.save(tmp_path / "document.vectors.npy", np.asarray(unit_rows([1, 0], [0, 1]), dtype=np.float16))
+    (tmp_path / "document.chunks.json").write_text('{"ids": ["a", "b"], "metadatas": [{}, {}]}')
+    store = DocumentVectorStore(tmp_path)
+
+    assert store.search("document", [0, 1], n_results=1)["ids"] == [["b"]]
+
+    store.write_document("document", ["c"], [{}], unit_rows([1, 0]))
+    assert not (tmp_path / "document.vectors.npy").exists()
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import sqlite3
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import Base
+from app.models.models import ESGMetric, MetricRollup, QAInteraction
+from app.services import write_behind
+from app.services.rollup_service import rollup_key
+from app.services.write_behind import WriteBehindQueue
+
+@pytest.fixture
+def database(monkeypatch, tmp_path):
+    path = tmp_path / "esg.db"
+    # A short busy timeout keeps the locked-database test fast
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", connect_args={"timeout": 0.1})
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    asyncio.run(create_tables())
+
+    monkeypatch.setattr(write_behind, "SessionLocal", sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False))
+    monkeypatch.setattr(write_behind, "DEAD_LETTER_PATH", tmp_path / "dead_letter.jsonl")
+    yield path
+    asyncio.run(engine.dispose())
+
+def interaction(question="What was energy use?", answer="1,200 GWh."):
+    return {"user_id": "user", "document_id": "document", "question": question, "answer": answer}
+
+def stored_ids(path, table):
+    with sqlite3.connect(path) as conn:
+        return {row[0] for row in conn.execute(f"SELECT id FROM {table}")}
+
+def test_flush_writes_rows_and_rollup_deltas(database):
+    async def run():
+        queue = WriteBehindQueue(interval_ms=10_000)
+        rows = queue.enqueue(
+            ESGMetric,
+            [{"document_id": "document", "category": "Energy", "rag_status": "Green", "extracted_by": "llm"}],
+            rollup_deltas=[(rollup_key("Energy", "Green", "document"), 1)]
+        )
+        await queue.flush()
+        await queue.drain()
+        return rows
+
+    rows = asyncio.run(run())
+
+    assert stored_ids(database, "esg_metrics") == {rows[0]["id"]}
+    with sqlite3.connect(database) as conn:
+        assert conn.execute("SELECT metric_count FROM metric_rollups").fetchall() == [(1,)]
+
+def test_queued_rows_are_readable_until_written(database):
+    async def run():
+        queue = WriteBehindQueue(interval_ms=10_000)
+        row, = queue.enqueue(QAInteraction, [interaction()])
+        queued = queue.pending_rows(QAInteraction, document_id="document")
+        other_document = queue.pending_rows(QAInteraction, document_id="other")
+        await queue.flush()
+        written = queue.pending_rows(QAInteraction, document_id="document")
+        await queue.drain()
+        return row, queued, other_document, written
+
+    row, queued, other_document, written = asyncio.run(run())
+
+    assert [pending.id for pending in queued] == [row["id"]]
+    assert other_document == []
+    assert written == []
+    assert stored_ids(database, "qa_interactions") == {row["id"]}
+
+def test_bad_row_is_isolated_and_dead_lettered(database, monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_MAX_ATTEMPTS", 2)
+
+    async def run():
+        queue = WriteBehindQueue(interval_ms=10_000)
+        good = queue.enqueue(QAInteraction, [interaction(), interaction(question="What was water use?")])
+        bad, = queue.enqueue(QAInteraction, [interaction(answer=None)])
+        await queue.flush()
+        retried = queue.is_pending(QAInteraction, bad["id"])
+        await queue.flush(force=True)
+        dead_lettered = not queue.is_pending(QAInteraction, bad["id"])
+        await queue.drain()
+        return good, bad, retried, dead_lettered
+
+    good, bad, retried, dead_lettered = asyncio.run(run())
+
+    assert stored_ids(database, "qa_interactions") == {row["id"] for row in good}
+    assert retried and dead_lettered
+    entry, = [json.loads(line) for line in write_behind.DEAD_LETTER_PATH.read_text().splitlines()]
+    assert entry["row"]["id"] == bad["id"]
+    assert entry["attempts"] == 2
+
+def test_locked_database_requeues_batch_without_using_attempts(database, monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_MAX_ATTEMPTS", 1)
+    writes = []
+
+    async def run():
+        queue = WriteBehindQueue(interval_ms=10_000)
+        original_write = queue._write
+
+        async def counting_write(batch):
+            writes.append(sum(len(rows) for rows in batch.values()))
+            await original_write(batch)
+        queue._write = counting_write
+
+        rows = queue.enqueue(QAInteraction, [interaction(question=f"Question {i}?") for i in range(12)])
+        lock = sqlite3.connect(database, isolation_level=None)
+        lock.execute("BEGIN EXCLUSIVE")
+        try:
+            await queue.flush()
+            still_queued = len(queue.pending_rows(QAInteraction))
+            # Backing off: an unforced flush leaves the rows alone
+            await queue.flush()
+        finally:
+            lock.execute("ROLLBACK")
+            lock.close()
+        await queue.flush(force=True)
+        await queue.drain()
+        return rows, still_queued
+
+    rows, still_queued = asyncio.run(run())
+
+    # One attempt at the whole batch while locked, no per-row retries, then one successful write
+    assert writes == [12, 12]
+    assert still_queued == 12
+    assert stored_ids(database, "qa_interactions") == {row["id"] for row in rows}
+    assert not write_behind.DEAD_LETTER_PATH.exists()